@@ -26,6 +26,14 @@ const unsigned long CAN_TIMEOUT = 1000;  // 1 second timeout for CAN response so
 String pendingPID = "";
 bool waitingForResponse = false;
 
+// Batched requests - mode 01 takes up to 6 PIDs in one request ("01 0C 0D 11")
+const int MAX_BATCH = 6;
+bool waitingForBatch = false;
+// A batch answer can be longer than one CAN frame (ISO-TP) - the frames get put back together here
+byte answerBuf[32];
+int answerLength = 0;    // bytes the ECU said it is sending
+int answerReceived = 0;  // bytes put together so far
+
 void setup() {
   // Initialize serial communication at 115200 baud rate
   Serial.begin(115200);
@@ -73,10 +81,14 @@ void loop() {
   if (waitingForResponse && (millis() - canRequestTime) > CAN_TIMEOUT) {
     Serial.println("No response - timeout");
     waitingForResponse = false;
+    waitingForBatch = false;
   }
   
   // Add a small delay to prevent overwhelming the serial - adjust for later
-  delay(10);
+  // not while a multi-frame answer is coming in - the MCP2515 only holds 2 frames
+  if (!waitingForBatch) {
+    delay(10);
+  }
 }
 
 // Process commands from Python
@@ -95,7 +107,7 @@ void processCommand(String command) {
   else if (command == "PING") {
     Serial.println("PONG");
   }
-  // Handle PID requests from Python (format: "01 0C" for PID 0C with mode 01)
+  // Handle PID requests from Python (format: "01 0C" for PID 0C with mode 01, "01 0C 0D 11" for a batch)
   else if (command.length() >= 5) {
     // Try to parse as a PID request
     handlePIDRequest(command);
@@ -119,13 +131,17 @@ void handlePIDRequest(String command) {
   String mode = command.substring(0, spaceIndex);
   String pid = command.substring(spaceIndex + 1);
   
-  // Validate hex format (both should be 2 hex chars)
-  if (mode.length() != 2 || pid.length() != 2) {
+  // Validate hex format (mode 2 hex chars, each PID 2 hex chars with a space between)
+  if (mode.length() != 2 || (pid.length() + 1) % 3 != 0 || (pid.length() + 1) / 3 > MAX_BATCH) {
     return;
   }
   
-  // Send CAN request to vehicle with this mode/PID
-  askCarPID(mode, pid);
+  // Send CAN request to vehicle with this mode/PID - or all of the PIDs in one request
+  if (pid.length() == 2) {
+    askCarPID(mode, pid);
+  } else {
+    askCarBatch(mode, pid);
+  }
 }
 
 // Request the car for a specific PID value
@@ -149,6 +165,7 @@ void askCarPID(String mode, String pid) {
 
     // Set flag that we're waiting for a response
     waitingForResponse = true;
+    waitingForBatch = false;
     canRequestTime = millis();
     pendingPID = pid;
   } else {
@@ -156,6 +173,87 @@ void askCarPID(String mode, String pid) {
   }
 }
 
+// Request several PIDs in one frame - pids is "0C 0D 11"
+void askCarBatch(String mode, String pids) {
+
+  // Multi-PID request format:
+  // - Byte 0: Length (1 + number of PIDs)
+  // - Byte 1: Mode
+  // - Bytes 2-7: PIDs (up to 6)
+  // The answer is the mode + 0x40 followed by each PID and its data bytes
+
+  byte data[8] = {0, 0, 0, 0, 0, 0, 0, 0};
+  int count = 0;
+  data[1] = strtol(mode.c_str(), NULL, 16);
+  for (unsigned int i = 0; i + 1 < pids.length() && count < MAX_BATCH; i += 3) {
+    data[2 + count] = strtol(pids.substring(i, i + 2).c_str(), NULL, 16);
+    count++;
+  }
+  data[0] = count + 1;
+
+  if (CAN.sendMsgBuf(0x7DF, 0, 8, data) == CAN_OK) {
+    waitingForResponse = true;
+    waitingForBatch = true;
+    canRequestTime = millis();
+    pendingPID = "";
+    answerLength = 0;
+    answerReceived = 0;
+  } else {
+    Serial.println("CAN send failed");
+  }
+}
+
+// Put a batch answer back together from its CAN frames and print it once it is all there
+void handleBatchFrame(unsigned char len, unsigned char *rxBuf) {
+  byte frameType = rxBuf[0] >> 4;
+
+  if (frameType == 0) {
+    // Single frame - byte 0 is the length, the whole answer follows
+    answerLength = rxBuf[0] & 0x0F;
+    answerReceived = 0;
+    for (int i = 1; i < len && answerReceived < answerLength; i++) {
+      answerBuf[answerReceived++] = rxBuf[i];
+    }
+  } else if (frameType == 1) {
+    // First frame - 12 bit length, then the first 6 bytes
+    answerLength = min(((rxBuf[0] & 0x0F) << 8) | rxBuf[1], (int)sizeof(answerBuf));
+    answerReceived = 0;
+    for (int i = 2; i < len && answerReceived < answerLength; i++) {
+      answerBuf[answerReceived++] = rxBuf[i];
+    }
+    // Flow control to the engine ECU - send the rest, no gap between frames
+    byte flow[8] = {0x30, 0x00, 0x00, 0, 0, 0, 0, 0};
+    CAN.sendMsgBuf(0x7E0, 0, 8, flow);
+    return;
+  } else if (frameType == 2 && answerLength > 0) {
+    // Consecutive frame - 7 more bytes
+    for (int i = 1; i < len && answerReceived < answerLength; i++) {
+      answerBuf[answerReceived++] = rxBuf[i];
+    }
+  } else {
+    return;
+  }
+
+  if (answerReceived < answerLength) {
+    return;
+  }
+
+  // Send the whole answer to Python - two hex digits per byte, mode byte first
+  Serial.print("BATCH:");
+  for (int i = 0; i < answerLength; i++) {
+    Serial.print(" ");
+    if (answerBuf[i] < 0x10) {
+      Serial.print("0");
+    }
+    Serial.print(answerBuf[i], HEX);
+  }
+  Serial.println();
+
+  waitingForResponse = false;
+  waitingForBatch = false;
+  answerLength = 0;
+}
+
 // Check for incoming CAN messages and process responses
 void checkCANMessages() {
   unsigned long rxId;
@@ -174,12 +272,32 @@ void checkCANMessages() {
     // - Byte 2: PID
     // - Bytes 3+: Data (A, B values)
     
-    if (rxId == 0x7E8 && len >= 3) {
+    if (rxId == 0x7E8 && waitingForBatch) {
+      handleBatchFrame(len, rxBuf);
+    }
+    else if (rxId == 0x7E8 && len >= 3) {
       byte responseMode = rxBuf[1];
       byte responsePID = rxBuf[2];
       
       // Check if this is the response we're waiting for
       if (waitingForResponse && responsePID == strtol(pendingPID.c_str(), NULL, 16)) {
+        // Supported PID bitmasks (00, 20, 40) need all 4 data bytes - print them as 8 hex digits
+        if (responsePID % 0x20 == 0) {
+          Serial.print("SUPPORTED: ");
+          Serial.print(pendingPID);
+          Serial.print(" ");
+          for (int i = 3; i < 7; i++) {
+            byte value = (len > i) ? rxBuf[i] : 0;
+            if (value < 0x10) {
+              Serial.print("0");
+            }
+            Serial.print(value, HEX);
+          }
+          Serial.println();
+          waitingForResponse = false;
+          return;
+        }
+
         byte valueA = (len > 3) ? rxBuf[3] : 0;
         byte valueB = (len > 4) ? rxBuf[4] : 0;
         
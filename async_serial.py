@@ -0,0 +1,401 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+import can_communication as can
+from logs import get_logger
+
+_log = get_logger("serial")
+_line_log = get_logger("lines")
+_pid_log = get_logger("pid")
+
+"""
+asyncio serial engine - reading, decoding and PID scheduling in one event loop instead of a reader thread and a
+poller thread sharing locks
+
+    engine = AsyncSerialManager(port, event_callback=store.publish)
+    await engine.open()
+    sample = await engine.request(0x0C)   # Sample, or None if the arduino timed out or nothing came back
+    samples = await engine.request_batch([0x0C, 0x0D])  # {pid: Sample} for the PIDs the car answered
+
+uses pyserial-asyncio when it is installed, otherwise watches the port's file descriptor with loop.add_reader (not
+available for serial ports on windows)
+"""
+
+class _ReaderTransport:
+    """ Minimal transport over a non-blocking serial.Serial using loop.add_reader - used without pyserial-asyncio """
+
+    def __init__(self, loop, ser, protocol):
+        self._loop = loop
+        self._ser = ser
+        self._protocol = protocol
+        self._fd = ser.fileno()
+        loop.add_reader(self._fd, self._readable)
+        protocol.connection_made(self)
+
+    def _readable(self):
+        try:
+            data = self._ser.read(self._ser.in_waiting or 1)
+        except Exception as e:
+            self.close()
+            self._protocol.connection_lost(e)
+            return
+        if data:
+            self._protocol.data_received(data)
+
+    def write(self, data):
+        self._ser.write(data)
+
+    def close(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+            self._ser.close()
+
+class _PIDProtocol(asyncio.Protocol):
+    """ Turns bytes from the arduino into Samples and hands them to the engine """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.framer = can.LineFramer()
+
+    def connection_made(self, transport):
+        self.engine._transport = transport
+
+    def data_received(self, data):
+        rx = time.monotonic_ns()
+        for line in self.framer.feed(data):
+            self.engine._handle_line(line, rx)
+
+    def connection_lost(self, exc):
+        self.engine._connection_lost(exc)
+
+class AsyncSerialManager:
+    """ Serial connection driven by an asyncio event loop with an awaitable request(pid) """
+
+    def __init__(self, port, baudrate=115200, decode='utf-8', request_timeout=1.5, max_in_flight=1,
+                 event_callback=None, tracer=None, source=None, prepare=None, batch=1):
+        """ max_in_flight is how many requests can be waiting for an answer at once - the current firmware only
+        keeps one (a new request replaces the pending one) so leave it at 1 unless the firmware can queue them
+
+        prepare is a coroutine function main() awaits with the engine once the arduino is up, before polling starts
+        (e.g. supported PID discovery), batch is how many PIDs main() asks for in one request """
+        self.port = port
+        self.source = source or port
+        self.baudrate = baudrate
+        self.decode = decode
+        self.request_timeout = request_timeout
+        self.max_in_flight = max_in_flight
+        self.event_callback = event_callback
+        self.tracer = tracer
+        self.prepare = prepare
+        self.batch = batch
+
+        self._transport = None
+        self._loop = None
+        self._in_flight = None
+        self._waiting = deque()  # (pid, future) in the order the requests went out
+        self._stop = None
+        self._ready = None  # set on Arduino Ready or PONG
+        self.closed = None  # future set when the connection goes away
+        self.is_open = False
+
+        # counters
+        self.samples = 0
+        self.timeouts = 0
+        self.unsolicited = 0
+
+    async def open(self):
+        """ Open the port on the running event loop """
+        self._loop = asyncio.get_running_loop()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._stop = asyncio.Event()
+        self._ready = asyncio.Event()
+        self.closed = self._loop.create_future()
+        protocol = _PIDProtocol(self)
+        try:
+            import serial_asyncio
+        except ImportError:
+            import serial
+            ser = serial.Serial(self.port, self.baudrate, timeout=0)
+            _ReaderTransport(self._loop, ser, protocol)
+        else:
+            await serial_asyncio.create_serial_connection(self._loop, lambda: protocol, self.port,
+                                                          baudrate=self.baudrate)
+        self.is_open = True
+        _log.info("Opened %s at %d baud", self.port, self.baudrate)
+
+    def close(self):
+        """ Close the port - pending requests resolve to None """
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        self._connection_lost(None)
+
+    def _connection_lost(self, exc):
+        self.is_open = False
+        while self._waiting:
+            _, future = self._waiting.popleft()
+            if not future.done():
+                future.set_result(None)
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(exc)
+        if exc is not None:
+            _log.error("Serial read error on %s: %s", self.port, exc)
+
+    def send(self, message, newline=True):
+        """ Write a message to the arduino - no lock needed, only the event loop writes """
+        payload = message.encode(self.decode) if isinstance(message, str) else message
+        if newline and not payload.endswith(b"\n"):
+            payload += b"\r\n"
+        if self._transport is None:
+            raise RuntimeError('Serial port not open')
+        self._transport.write(payload)
+
+    async def request(self, pid, timeout=None):
+        """ Ask for a PID and wait for its answer - returns the Sample, or None on a timeout line or no answer """
+        async with self._in_flight:
+            future = self._loop.create_future()
+            entry = (pid, future)
+            self._waiting.append(entry)
+            if self.tracer is not None:
+                self.tracer.request(pid, source=self.source)
+            try:
+                self.send(f"01 {can.PID_TABLE[pid].code}")
+                return await asyncio.wait_for(future, self.request_timeout if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return None
+            finally:
+                try:
+                    self._waiting.remove(entry)
+                except ValueError:
+                    pass
+
+    async def request_batch(self, pids, timeout=None):
+        """ Ask for several PIDs in one request - returns {pid: Sample} for the ones answered ({} on a timeout line,
+        None if nothing at all came back) """
+        # one PID gets the classic single answer
+        if len(pids) == 1:
+            sample = await self.request(pids[0], timeout)
+            return {} if sample is None else {pids[0]: sample}
+        async with self._in_flight:
+            future = self._loop.create_future()
+            entry = (tuple(pids), future)
+            self._waiting.append(entry)
+            if self.tracer is not None:
+                self.tracer.request(pids, source=self.source)
+            try:
+                self.send(can.request_command(pids))
+                return await asyncio.wait_for(future, self.request_timeout if timeout is None else timeout) or {}
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return None
+            finally:
+                try:
+                    self._waiting.remove(entry)
+                except ValueError:
+                    pass
+
+    async def request_support(self, pid, timeout=None):
+        """ Ask for a support PID (00, 20, 40) and wait for its bitmask - None if the car didn't answer """
+        async with self._in_flight:
+            future = self._loop.create_future()
+            entry = (pid, future)
+            self._waiting.append(entry)
+            try:
+                self.send(f"01 {pid:02X}")
+                return await asyncio.wait_for(future, self.request_timeout if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                try:
+                    self._waiting.remove(entry)
+                except ValueError:
+                    pass
+
+    def _resolve(self, pid, sample):
+        """ Complete the oldest request for pid (or the oldest request at all for pid None) """
+        for entry in self._waiting:
+            if pid is None or entry[0] == pid:
+                self._waiting.remove(entry)
+                if not entry[1].done():
+                    entry[1].set_result(sample)
+                return True
+        return False
+
+    def _handle_line(self, line, rx):
+        """ Same handling as SerialManager._handle_line but resolving request futures instead of callbacks """
+        if not line.startswith(b'PID: '):
+            if line.startswith(b'BATCH: '):
+                self._handle_batch(line, rx)
+                return
+            if line.startswith(can._FAILED_PREFIXES):
+                self.timeouts += 1
+                self._resolve(None, None)
+                if self.tracer is not None:
+                    self.tracer.response(None, rx, self.source)
+            elif line.startswith(can._READY_PREFIXES):
+                self._ready.set()
+            elif line.startswith(b'SUPPORTED: '):
+                try:
+                    pid, mask = can.parse_support_frame(line)
+                except ValueError as e:
+                    _log.warning("%s", e)
+                else:
+                    self._resolve(pid, mask)
+            if line and _line_log.isEnabledFor(logging.INFO):
+                _line_log.info("%s: %s", self.source, line.decode(self.decode, errors='replace'))
+            return
+
+        try:
+            pid, A, B = can.parse_pid_frame(line)
+            sample = self._sample(pid, A, B, rx)
+        except Exception as e:
+            _log.warning("Error processing PID line %r: %s", line, e)
+            return
+
+        if not self._resolve(pid, sample):
+            self.unsolicited += 1
+        self._deliver(sample)
+
+    def _handle_batch(self, line, rx):
+        """ Split a batch answer into Samples and complete the oldest batch request with them """
+        samples = {}
+        try:
+            frames = can.parse_batch_frame(line)
+        except ValueError as e:
+            frames = ()
+            _log.warning("%s", e)
+        # the tracer settles the whole batch at once - the PIDs missing from it timed out
+        trace = None
+        if self.tracer is not None:
+            trace = (self.tracer.batch_response([pid for pid, A, B in frames], rx, self.source), rx)
+        for pid, A, B in frames:
+            try:
+                samples[pid] = self._sample(pid, A, B, rx, trace)
+            except Exception as e:
+                _log.warning("Error processing batch line %r: %s", line, e)
+        for entry in self._waiting:
+            if isinstance(entry[0], tuple):
+                self._waiting.remove(entry)
+                if not entry[1].done():
+                    entry[1].set_result(samples)
+                break
+        else:
+            self.unsolicited += len(samples)
+        for sample in samples.values():
+            self._deliver(sample)
+
+    def _sample(self, pid, A, B, rx, trace=None):
+        """ Decode one answered PID into a Sample - a batch passes its trace in, it is already settled with the
+        tracer """
+        value = can.DECODERS[pid](A, B)
+        if trace is None and self.tracer is not None:
+            trace = (self.tracer.response(pid, rx, self.source), rx)
+        return can.Sample(time.monotonic_ns(), pid, bytes((A,)) if B is None else bytes((A, B)), value, trace,
+                          self.source)
+
+    def _deliver(self, sample):
+        """ Count a Sample and hand it to the event callback """
+        self.samples += 1
+        if self.event_callback is not None:
+            try:
+                self.event_callback(sample)
+            except Exception as e:
+                _log.error("Event callback error: %s", e)
+
+        # debug log of every sample - off unless the pid category is at DEBUG
+        if _pid_log.isEnabledFor(logging.DEBUG):
+            _pid_log.debug("%s -> %s", sample.name, sample.formatted())
+
+    async def poll(self, scheduler):
+        """ Request PIDs as the scheduler says until stop() - the scheduler's own timing, all on the event loop """
+        while not self._stop.is_set() and not self.closed.done():
+            now = time.monotonic()
+            pids, wait = scheduler.next_batch(now, self.batch)
+            if not pids:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            scheduler.mark_sent(pids, now)
+            try:
+                answered = await self.request_batch(pids)
+            except Exception:
+                # port went away or is busy - try again shortly
+                scheduler.on_response(None)
+                await asyncio.sleep(0.1)
+                continue
+            # the same calls the threaded reader makes - on_batch() only for a BATCH line, the rest like single
+            # answers and timeout lines
+            if answered is None:
+                scheduler.no_answer()
+            elif len(pids) == 1:
+                scheduler.on_response(pids[0] if answered else None)
+            elif answered:
+                scheduler.on_batch(answered)
+            else:
+                scheduler.on_response(None)
+
+    async def handshake(self, timeout=3.0, ping_interval=0.25):
+        """ Wait for Arduino Ready (or PONG to a PING if it didn't reset) like SerialManager.handshake() - True once
+        the arduino is up """
+        deadline = self._loop.time() + timeout
+        while not self._stop.is_set() and self._loop.time() < deadline:
+            self.send("PING")
+            try:
+                await asyncio.wait_for(self._ready.wait(), min(ping_interval, deadline - self._loop.time()))
+                return True
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def main(self, scheduler):
+        """ Open the port, wait for the arduino to be ready and poll until stop() """
+        await self.open()
+        # arduino resets when the port opens - go as soon as it says it is up
+        if not await self.handshake():
+            _log.warning("%s never said Arduino Ready or PONG - polling anyway", self.port)
+        try:
+            if self.prepare is not None:
+                await self.prepare(self)
+            await self.poll(scheduler)
+        finally:
+            self.close()
+
+    def run(self, scheduler, started=None):
+        """ Run main() on a new event loop in this thread - started (threading.Event) is set once the port is open """
+        async def runner():
+            task = asyncio.ensure_future(self.main(scheduler))
+            while self.closed is None and not task.done():
+                await asyncio.sleep(0.01)
+            if started is not None:
+                started.set()
+            await task
+        try:
+            asyncio.run(runner())
+        except Exception as e:
+            _log.error("Failed to open %s: %s", self.port, e)
+        finally:
+            if started is not None:
+                started.set()
+
+    def stop(self):
+        """ Stop poll() - safe to call from another thread """
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+def start_thread(port, scheduler, **kwargs):
+    """ Start an engine in a background thread with its own event loop - returns (engine, thread) once it is open """
+    engine = AsyncSerialManager(port, **kwargs)
+    started = threading.Event()
+    thread = threading.Thread(target=engine.run, args=(scheduler, started), daemon=True)
+    thread.start()
+    started.wait(5.0)
+    if not engine.is_open:
+        raise RuntimeError(f"Failed to open {port}")
+    return engine, thread
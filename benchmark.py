@@ -0,0 +1,437 @@
+import os
+import sys
+import json
+import math
+import time
+import queue
+import random
+import timeit
+import argparse
+import platform
+import threading
+import can_communication as can
+from telemetry import TelemetryStore, SharedTelemetryStore
+from layout import load_layout, GraphSpec
+from metrics import MetricsEngine
+from history import History
+
+"""
+benchmark suite for each stage of the dashboard on its own
+
+    decode   compute_value/formula per call, old numexpr path (if pandas + numexpr are installed), batch decode
+    ingest   SerialManager._reader_loop lines per second fed from an in-memory fake serial port
+    drain    cost of getting a backlog of samples to the render loop - old queue drain vs telemetry store snapshot,
+             and the derived metrics engine per sample
+    render   one frame of draw_gauge/draw_box/draw_status_panel with the SDL dummy video driver
+
+run with: python benchmark.py [--stages decode,render] [--json results.json] [--compare baseline.json]
+"""
+
+STAGES = ("decode", "ingest", "drain", "render")
+
+def metric(value, unit, better="lower"):
+    """ One result - better says which direction is an improvement """
+    return {"value": value, "unit": unit, "better": better}
+
+def best_per_item(fn, count, repeat):
+    """ Best of repeat runs of fn in microseconds per item """
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) / count * 1e6
+
+# -------------------- DECODE --------------------
+
+_df = None
+
+def numexpr_compute_value(pid, A, B=None):
+    """ Old decode path - look up formula with pandas and evaluate it with numexpr every call """
+    global _df
+    import pandas as pd
+    import numexpr
+    if _df is None:
+        _df = pd.read_csv(can.canCSV, index_col="pid")
+
+    unit = _df.at[pid, 'unit']
+    formula_str = _df.at[pid, "formula"]
+    if B is None:
+        f = numexpr.evaluate(formula_str, local_dict={"A": A}).item()
+    else:
+        f = numexpr.evaluate(formula_str, local_dict={"A": A, "B": B}).item()
+    return (float(f), unit)
+
+def make_samples(count=10000, seed=0):
+    """ Random (pid, A, B) samples for every PID with a formula """
+    rng = random.Random(seed)
+    records = [rec for rec in can.PID_TABLE.values() if rec.decoder is not None]
+    samples = []
+    for _ in range(count):
+        rec = rng.choice(records)
+        A = rng.randint(0, 255)
+        B = rng.randint(0, 255) if rec.decoder.uses_b else None
+        samples.append((rec.code, A, B))
+    return samples
+
+def make_frames(count=100000, seed=0):
+    """ Raw 'PID: A [B] XX' lines in the same format the arduino sends """
+    frames = []
+    for pid, A, B in make_samples(count, seed):
+        if B is None:
+            frames.append(f"PID: {A:X} {pid}")
+        else:
+            frames.append(f"PID: {A:X} {B:X} {pid}")
+    return frames
+
+def bench_decode(quick=False):
+    """ Per-call latency of compute_value/formula and per-frame cost of scalar vs batch decoding """
+    count = 2000 if quick else 10000
+    repeat = 3 if quick else 5
+    samples = make_samples(count)
+
+    def run_compute_value():
+        for pid, A, B in samples:
+            can.compute_value(pid, A, B)
+
+    def run_formula():
+        for pid, A, B in samples:
+            can.formula(pid, A, B)
+
+    results = {
+        "decode.compute_value": metric(best_per_item(run_compute_value, count, repeat), "us/call"),
+        "decode.formula": metric(best_per_item(run_formula, count, repeat), "us/call"),
+    }
+
+    # old path for comparison - only when its dependencies are around
+    try:
+        import pandas, numexpr  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        # make sure both paths agree before timing them
+        for pid, A, B in samples[:500]:
+            old, _ = numexpr_compute_value(pid, A, B)
+            new, _ = can.compute_value(pid, A, B)
+            assert abs(old - new) < 1e-9, (pid, A, B, old, new)
+
+        old_count = count // 5
+        def run_numexpr():
+            for pid, A, B in samples[:old_count]:
+                numexpr_compute_value(pid, A, B)
+        results["decode.numexpr_compute_value"] = metric(best_per_item(run_numexpr, old_count, repeat), "us/call")
+
+    # block of frames one line at a time vs decode_frames on the same raw bytes
+    frame_count = 20000 if quick else 100000
+    frames = make_frames(frame_count)
+    block = "\n".join(frames).encode()
+
+    def run_scalar():
+        for line in frames:
+            parts = line[5:].split()
+            if len(parts) == 2:
+                A, pid = parts
+                can.compute_value(pid, int(A, 16))
+            else:
+                A, B, pid = parts
+                can.compute_value(pid, int(A, 16), int(B, 16))
+
+    def run_batch():
+        can.decode_frames(block)
+
+    results["decode.scalar_frames"] = metric(best_per_item(run_scalar, frame_count, 3), "us/frame")
+    results["decode.batch_frames"] = metric(best_per_item(run_batch, frame_count, 3), "us/frame")
+    return results
+
+# -------------------- INGEST --------------------
+
+class MemorySerial:
+    """ In-memory stand-in for serial.Serial that hands out a fixed block of bytes as fast as it is read """
+
+    def __init__(self, data, chunk=4096):
+        self._data = memoryview(data)
+        self._pos = 0
+        self.chunk = chunk  # most bytes in_waiting reports at once, like a UART buffer
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self._data) - self._pos)
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self._data) - self._pos)
+        if not n:
+            # drained - act like a read timing out
+            time.sleep(0.001)
+            return 0
+        buf[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+def bench_ingest(quick=False):
+    """ Lines per second through SerialManager._reader_loop from an in-memory port """
+    count = 20000 if quick else 100000
+    data = ("\r\n".join(make_frames(count)) + "\r\n").encode()
+
+    received = [0]
+    done = threading.Event()
+    def count_sample(sample):
+        received[0] += 1
+        if received[0] >= count:
+            done.set()
+
+    mgr = can.SerialManager("memory", serial_factory=lambda port, baudrate, timeout: MemorySerial(data),
+                            event_callback=count_sample)
+
+    began = time.perf_counter()
+    mgr.start()
+    done.wait(60)
+    elapsed = time.perf_counter() - began
+    mgr.stop()
+
+    return {
+        "ingest.reader_lines_per_second": metric(received[0] / elapsed, "lines/s", better="higher"),
+        "ingest.reader_us_per_line": metric(elapsed / max(received[0], 1) * 1e6, "us/line"),
+    }
+
+# -------------------- DRAIN --------------------
+
+def bench_drain(quick=False):
+    """ Cost for the render loop to catch up on a backlog of samples - queue drain vs store snapshot vs shared memory
+    snapshot (--ingest-process) """
+    rng = random.Random(0)
+    pids = list(can.DECODERS)
+    results = {}
+
+    for backlog in (10, 100, 1000, 2000):
+        samples = [can.Sample(i, rng.choice(pids), b"\x10", 1.0) for i in range(backlog)]
+        repeat = 20 if quick else 100
+
+        def run_queue():
+            q = queue.Queue(maxsize=2000)
+            for s in samples:
+                q.put(s)
+            began = time.perf_counter()
+            last_values = {}
+            while True:
+                try:
+                    s = q.get_nowait()
+                except queue.Empty:
+                    break
+                last_values[s.pid] = s
+            return time.perf_counter() - began
+
+        def run_store():
+            store = TelemetryStore()
+            for s in samples:
+                store.publish(s)
+            began = time.perf_counter()
+            store.snapshot()
+            return time.perf_counter() - began
+
+        # the same table reads what it wrote - attaching from the same process would confuse its resource tracking
+        shared = reader = SharedTelemetryStore.create()
+
+        def run_shared():
+            for s in samples:
+                shared.publish(s)
+            began = time.perf_counter()
+            reader.snapshot()
+            return time.perf_counter() - began
+
+        results[f"drain.queue_{backlog}"] = metric(min(run_queue() for _ in range(repeat)) * 1e6, "us")
+        results[f"drain.store_{backlog}"] = metric(min(run_store() for _ in range(repeat)) * 1e6, "us")
+        results[f"drain.shared_{backlog}"] = metric(min(run_shared() for _ in range(repeat)) * 1e6, "us")
+        shared.close()
+
+    shared = SharedTelemetryStore.create()
+    samples = [can.Sample(i, rng.choice(pids), b"\x10", 1.0) for i in range(2000 if quick else 20000)]
+    results["drain.shared_publish"] = metric(
+        best_per_item(lambda: [shared.publish(s) for s in samples], len(samples), 3), "us/sample")
+    shared.close()
+
+    # rolling stats and trip data - cost per sample shouldn't grow with how long the drive has been
+    rng = random.Random(0)
+    samples = [can.Sample(i * 10_000_000, rng.choice((0x0C, 0x0D, 0x05, 0x5E)), b"", rng.uniform(0, 100))
+               for i in range(2000 if quick else 20000)]
+    engine = MetricsEngine(lambda sample: None)
+    results["drain.metrics_per_sample"] = metric(
+        best_per_item(lambda: [engine.consume(s) for s in samples], len(samples), 3), "us/sample")
+    return results
+
+# -------------------- RENDER --------------------
+
+def load_dashboard():
+    """ Drawing functions from dashboard.py without running its setup and main loop """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dashboard.py")
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    head = source[:source.index("# -------------------- SETUP")]
+    # dashboard.py imports pygame in its setup (so it loads while the ports open) - the drawing functions need it
+    import pygame
+    namespace = {"__name__": "dashboard_benchmark", "__file__": path, "pygame": pygame}
+    exec(compile(head, path, "exec"), namespace)
+    return namespace
+
+def bench_render(quick=False):
+    """ Time of each draw function and one full frame with the SDL dummy video driver """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    pygame.init()
+
+    dash = load_dashboard()
+    width, height = 1200, 700
+    dash["WIDTH"], dash["HEIGHT"] = width, height
+    dash["screen"] = screen = pygame.display.set_mode((width, height))
+    dash["status"] = {'arduino_detected': True, 'serial_running': True, 'simulator_running': False,
+                      'replay_running': None}
+    MetricsEngine()  # registers the derived channels the layout names
+    plan = load_layout()
+    dash["box_options"] = plan.box_options
+    dash["box_index"] = 1  # oil temp
+    last_values = dash["last_values"] = {0x5C: can.Sample(0, 0x5C, b"\x7d", 185.0)}
+
+    draw_gauge, draw_box, draw_status_panel = dash["draw_gauge"], dash["draw_box"], dash["draw_status_panel"]
+    draw_gauges = dash["draw_gauges"]
+    small = ((int(width * 0.12), int(height * 0.25)), 70, 15, 100, 'PSI')
+    large = ((int(width * 0.33), int(height * 0.55)), 180, 55, 125, 'MPH')
+
+    def frame():
+        screen.fill((0, 0, 0))
+        draw_box()
+        draw_gauges(plan.gauges, {})
+        draw_status_panel()
+        pygame.display.flip()
+
+    # what the loop does when only the rpm needle moved
+    shown = {}
+    draw_gauges(plan.gauges, shown)
+    rpm = [0]
+    def partial_frame():
+        rpm[0] = (rpm[0] + 100) % 8000
+        last_values[0x0C] = can.Sample(0, 0x0C, b"\x00\x00", float(rpm[0]))
+        pygame.display.update(draw_gauges(plan.gauges, shown, full=False))
+
+    # first frame builds the caches - not what a running dashboard pays
+    frame()
+    count = 20 if quick else 100
+    results = {
+        "render.draw_gauge_small": metric(best_per_item(lambda: draw_gauge(*small), 1, count) / 1e3, "ms"),
+        "render.draw_gauge_large": metric(best_per_item(lambda: draw_gauge(*large), 1, count) / 1e3, "ms"),
+        "render.draw_box": metric(best_per_item(draw_box, 1, count) / 1e3, "ms"),
+        "render.draw_status_panel": metric(best_per_item(draw_status_panel, 1, count) / 1e3, "ms"),
+        "render.frame": metric(best_per_item(frame, 1, count) / 1e3, "ms"),
+        "render.partial_frame": metric(best_per_item(partial_frame, 1, count) / 1e3, "ms"),
+    }
+
+    # trend graphs over an hour of 10Hz data per PID - what they cost has to follow the width, not the sample count
+    history = dash["history"] = History([graph.pid for graph in plan.graphs])
+    rng = random.Random(0)
+    for i in range(3600 * 10):
+        for graph in plan.graphs:
+            value = graph.min + (graph.max - graph.min) * (0.5 + 0.4 * math.sin(i / 3000) + rng.uniform(-0.05, 0.05))
+            history.record(can.Sample(i * 100_000_000, graph.pid, b"", value))
+    dash["GRAPHS"] = graphs = list(plan.graphs)
+    dash["graph_span"] = len(dash["GRAPH_SPANS"]) - 1  # the whole hour
+    draw_graph, draw_graphs = dash["draw_graph"], dash["draw_graphs"]
+
+    def graph_frame():
+        screen.fill((0, 0, 0))
+        draw_graphs({})
+        pygame.display.flip()
+
+    end = history.newest() + 1
+    results["render.graph_hour"] = metric(best_per_item(lambda: draw_graph(0, end), 1, count) / 1e3, "ms")
+    graphs[0] = GraphSpec(graphs[0].pid, graphs[0].label, graphs[0].unit, graphs[0].min, graphs[0].max, "lttb")
+    caches = dash["_lttb_caches"]
+
+    def first_lttb():
+        caches.clear()
+        draw_graph(0, end)
+    results["render.graph_hour_lttb_first"] = metric(best_per_item(first_lttb, 1, count // 4) / 1e3, "ms")
+
+    # what a redraw costs once the points are cached - a new sample in since the last one
+    ticks = iter(range(3600 * 10, 10**9))
+
+    def redraw_lttb():
+        i = next(ticks)
+        history.record(can.Sample(i * 100_000_000, graphs[0].pid, b"", graphs[0].min))
+        draw_graph(0, i * 100_000_000 + 1)
+    results["render.graph_hour_lttb"] = metric(best_per_item(redraw_lttb, 1, count) / 1e3, "ms")
+    graphs[0] = plan.graphs[0]
+    results["render.graphs_hour_frame"] = metric(best_per_item(graph_frame, 1, count) / 1e3, "ms")
+    pygame.quit()
+    return results
+
+# -------------------- REPORTING --------------------
+
+BENCHMARKS = {"decode": bench_decode, "ingest": bench_ingest, "drain": bench_drain, "render": bench_render}
+
+def run(stages=STAGES, quick=False):
+    """ Run the chosen stages and return results with enough metadata to compare runs """
+    results = {}
+    for stage in stages:
+        results.update(BENCHMARKS[stage](quick=quick))
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+def compare(current, baseline, threshold=0.10):
+    """ Relative change of every metric in both runs - returns the names that got worse by more than threshold """
+    regressions = []
+    print(f"{'metric':<34}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name, now in current["results"].items():
+        before = baseline["results"].get(name)
+        if not before or not before["value"]:
+            continue
+        change = (now["value"] - before["value"]) / before["value"]
+        worse = change > threshold if now["better"] == "lower" else change < -threshold
+        flag = "  REGRESSION" if worse else ""
+        print(f"{name:<34}{before['value']:>14.3f}{now['value']:>14.3f}{change:>+10.1%}{flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dashboard benchmark suite")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma separated subset of {', '.join(STAGES)}")
+    parser.add_argument("--quick", action="store_true", help="smaller runs for a fast sanity check")
+    parser.add_argument("--json", metavar="FILE", help="write results as JSON ('-' for stdout)")
+    parser.add_argument("--compare", metavar="FILE", help="compare against an earlier --json run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    for stage in stages:
+        if stage not in BENCHMARKS:
+            parser.error(f"unknown stage {stage!r}")
+
+    output = run(stages, quick=args.quick)
+
+    if args.json == "-":
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        for name, result in output["results"].items():
+            print(f"{name:<34}{result['value']:>14.3f} {result['unit']}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(output, baseline, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,421 @@
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+import can_communication as can
+from logs import get_logger
+
+_log = get_logger("app")
+
+"""
+telemetry broadcast - one adapter, any number of displays and loggers
+
+the dashboard that owns the serial port serves its decoded samples over TCP (--serve), other dashboards show them
+(--connect) and `python broadcast.py HOST:PORT` logs them as csv, so the port is only ever opened once
+
+publish() is a sample sink that only drops the sample in a dict - a background asyncio loop wakes every `interval`,
+picks up what changed and sends each client a delta with just the PIDs whose value changed since its last one.
+a client that can't keep up isn't written to until its socket drains, its unsent values are coalesced to the latest
+per PID meanwhile, and it is dropped once it has been stuck for stall_timeout - so nothing a client does holds up
+ingest or the other clients
+
+every message is HEADER (body length, type) then the body:
+    H  hello (server -> client)      json {"version", "clock": server monotonic ns, "pids": {code: [name, unit]}}
+    D  delta (server -> client)      DELTA_HEAD (newest ts, count) then count ENTRY (pid, age in us, value)
+    S  subscribe (client -> server)  uint16 count then count uint16 PIDs - no PIDs means every PID
+
+values are in can.csv units - each client converts to whatever it shows
+"""
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 8765
+MAX_MESSAGE = 64 * 1024  # anything bigger from a client is garbage
+
+HEADER = struct.Struct("<IB")
+DELTA_HEAD = struct.Struct("<qH")
+ENTRY = struct.Struct("<HIf")
+COUNT = struct.Struct("<H")
+
+HELLO, DELTA, SUBSCRIBE = b"H", b"D", b"S"
+
+def parse_address(spec, host="127.0.0.1"):
+    """ 'HOST:PORT', ':PORT', 'PORT' or 'HOST' -> (host, port) """
+    name, _, port = spec.rpartition(":") if ":" in spec else ("", "", spec)
+    if not port.isdigit():
+        name, port = spec, ""
+    return name or host, int(port) if port else DEFAULT_PORT
+
+def message(kind, body):
+    return HEADER.pack(len(body), kind[0]) + body
+
+def encode_hello():
+    pids = {rec.code: [rec.name, rec.unit] for rec in can.PID_TABLE.values()}
+    body = {"version": PROTOCOL_VERSION, "clock": time.monotonic_ns(), "pids": pids}
+    return message(HELLO, json.dumps(body, separators=(",", ":")).encode())
+
+def encode_delta(samples):
+    """ Samples -> one delta message - timestamps go as the age (us) behind the newest one """
+    newest = max(sample.ts for sample in samples)
+    parts = [DELTA_HEAD.pack(newest, len(samples))]
+    for sample in samples:
+        age = min((newest - sample.ts) // 1000, 0xFFFFFFFF)
+        parts.append(ENTRY.pack(sample.pid, age, sample.value))
+    return message(DELTA, b"".join(parts))
+
+def decode_delta(body):
+    """ Delta body -> [(ts, pid, value)] with ts on the server's clock """
+    newest, count = DELTA_HEAD.unpack_from(body)
+    return [(newest - age * 1000, pid, value)
+            for pid, age, value in ENTRY.iter_unpack(body[DELTA_HEAD.size:DELTA_HEAD.size + count * ENTRY.size])]
+
+def encode_subscribe(pids):
+    pids = sorted(pids or ())
+    return message(SUBSCRIBE, COUNT.pack(len(pids)) + struct.pack(f"<{len(pids)}H", *pids))
+
+def decode_subscribe(body):
+    """ Subscribe body -> set of PIDs or None for every PID """
+    count, = COUNT.unpack_from(body)
+    pids = struct.unpack_from(f"<{count}H", body, COUNT.size)
+    return set(pids) or None
+
+class _Client:
+    """ One connected client - its subscription and what it hasn't been sent yet """
+    __slots__ = ("writer", "name", "pids", "dirty", "sent", "stalled_since", "coalesced")
+
+    def __init__(self, writer, name):
+        self.writer = writer
+        self.name = name
+        self.pids = None          # None = every PID
+        self.dirty = {}           # pid -> latest sample not sent yet
+        self.sent = {}            # pid -> value last sent, so unchanged values aren't sent again
+        self.stalled_since = None  # monotonic time the socket last backed up
+        self.coalesced = 0        # samples replaced by a newer one before they went out
+
+    def offer(self, samples):
+        pids = self.pids
+        dirty = self.dirty
+        for sample in samples:
+            if pids is None or sample.pid in pids:
+                if sample.pid in dirty:
+                    self.coalesced += 1
+                dirty[sample.pid] = sample
+
+    def subscribe(self, pids, latest):
+        """ Change what this client gets - it is sent the current value of each one straight away """
+        self.pids = pids
+        self.dirty = {}
+        self.sent = {}
+        self.offer(latest.values())
+
+class BroadcastServer:
+    """ Serve samples to TCP clients from a background thread - publish() never waits on a client """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, interval=0.05, max_buffer=256 * 1024,
+                 stall_timeout=10.0):
+        """ port 0 picks a free one (see .port once started), max_buffer is how much can be queued on a client's
+        socket before it counts as stalled """
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.stall_timeout = stall_timeout
+
+        self._lock = threading.Lock()
+        self._changed = {}  # pid -> latest sample since the last tick - the only thing publish() touches
+        self._latest = {}   # pid -> latest sample, for new subscriptions - event loop only
+        self._clients = set()
+        self._handlers = set()  # one task per connected client
+        self._thread = None
+        self._started = threading.Event()
+        self._error = None
+        self.running = False
+
+        self.published = 0
+        self.frames = 0
+        self.bytes_sent = 0
+        self.connections = 0
+        self.dropped_clients = 0
+        self._coalesced = 0  # from clients that have gone
+
+    def publish(self, sample):
+        """ Sink for raw samples (can.csv units) - safe to call from any thread """
+        with self._lock:
+            self._changed[sample.pid] = sample
+        self.published += 1
+
+    def start(self):
+        """ Start listening - raises if the address can't be bound """
+        self.running = True
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait(5.0)
+        if self._error is not None:
+            self.running = False
+            raise self._error
+        _log.info("Broadcasting telemetry on %s:%d", self.host, self.port)
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            self._error = e
+        finally:
+            self._started.set()
+
+    async def _main(self):
+        server = await asyncio.start_server(self._serve_client, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._started.set()
+        async with server:
+            while self.running:
+                await asyncio.sleep(self.interval)
+                self._tick()
+            for client in list(self._clients):
+                client.writer.close()
+            # let the client handlers see the close and finish rather than being cancelled
+            if self._handlers:
+                await asyncio.wait(self._handlers, timeout=1.0)
+
+    async def _serve_client(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        client = _Client(writer, f"{peer[0]}:{peer[1]}" if peer else "?")
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        writer.write(encode_hello())
+        client.offer(self._latest.values())
+        self._clients.add(client)
+        self._handlers.add(asyncio.current_task())
+        self.connections += 1
+        _log.info("Telemetry client %s connected", client.name)
+        try:
+            while True:
+                length, kind = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if length > MAX_MESSAGE:
+                    _log.warning("Telemetry client %s sent a %d byte message, dropping it", client.name, length)
+                    break
+                body = await reader.readexactly(length)
+                if kind == SUBSCRIBE[0]:
+                    client.subscribe(decode_subscribe(body), self._latest)
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            self._remove(client)
+            _log.info("Telemetry client %s disconnected", client.name)
+
+    def _remove(self, client):
+        if client in self._clients:
+            self._clients.discard(client)
+            self._coalesced += client.coalesced
+        client.writer.close()
+
+    def _tick(self):
+        """ Hand what changed to every client and send what their sockets can take """
+        with self._lock:
+            changed, self._changed = self._changed, {}
+        self._latest.update(changed)
+        now = time.monotonic()
+        for client in list(self._clients):
+            if changed:
+                client.offer(changed.values())
+            self._flush(client, now)
+
+    def _flush(self, client, now):
+        if not client.dirty:
+            return
+        transport = client.writer.transport
+        if transport.is_closing():
+            self._remove(client)
+            return
+        if transport.get_write_buffer_size() > self.max_buffer:
+            # keep coalescing until it drains - give up on it after stall_timeout
+            if client.stalled_since is None:
+                client.stalled_since = now
+            elif now - client.stalled_since > self.stall_timeout:
+                _log.warning("Telemetry client %s stalled for %.0fs, dropping it", client.name, self.stall_timeout)
+                self.dropped_clients += 1
+                self._remove(client)
+                transport.abort()
+            return
+        client.stalled_since = None
+
+        sent = client.sent
+        samples = [sample for sample in client.dirty.values() if sent.get(sample.pid) != sample.value]
+        client.dirty = {}
+        if not samples:
+            return
+        data = encode_delta(samples)
+        client.writer.write(data)
+        for sample in samples:
+            sent[sample.pid] = sample.value
+        self.frames += 1
+        self.bytes_sent += len(data)
+
+    def stop(self):
+        """ Close every client and stop listening """
+        self.running = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+
+    def stats(self):
+        return {"clients": len(self._clients), "connections": self.connections, "published": self.published,
+                "frames": self.frames, "bytes_sent": self.bytes_sent, "dropped_clients": self.dropped_clients,
+                "coalesced": self._coalesced + sum(client.coalesced for client in list(self._clients))}
+
+class BroadcastClient:
+    """ Blocking client for a BroadcastServer - receive() returns the next delta as Samples on this machine's clock """
+
+    def __init__(self, host, port=DEFAULT_PORT, pids=None, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.pids = pids
+        self.timeout = timeout
+        self.name = f"{host}:{port}"
+        self.units = {}  # pid -> unit the server sends it in
+        self._sock = None
+        self._file = None
+        self._offset = 0  # add to a server ts to get a local one
+
+    def connect(self):
+        """ Connect, read the hello and send the subscription - raises OSError/ConnectionError on failure """
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        kind, body = self._read()
+        if kind != HELLO[0]:
+            raise ConnectionError(f"{self.name} is not a telemetry server")
+        hello = json.loads(body)
+        if hello.get("version") != PROTOCOL_VERSION:
+            raise ConnectionError(f"{self.name} speaks telemetry protocol {hello.get('version')}")
+        # same clock on the same machine, near enough over a LAN
+        self._offset = time.monotonic_ns() - hello["clock"]
+        self.units = {int(code, 16): unit for code, (name, unit) in hello["pids"].items()}
+        if self.pids:
+            self.subscribe(self.pids)
+
+    def subscribe(self, pids):
+        """ Only get these PIDs from now on (None for every PID) """
+        self.pids = pids
+        self._sock.sendall(encode_subscribe(pids))
+
+    def _read(self):
+        head = self._file.read(HEADER.size)
+        if len(head) < HEADER.size:
+            raise ConnectionError(f"{self.name} closed the connection")
+        length, kind = HEADER.unpack(head)
+        body = self._file.read(length)
+        if len(body) < length:
+            raise ConnectionError(f"{self.name} closed the connection")
+        return kind, body
+
+    def receive(self):
+        """ Wait for the next delta - list of Samples (no raw bytes) """
+        while True:
+            kind, body = self._read()
+            if kind == DELTA[0]:
+                offset = self._offset
+                return [can.Sample(ts + offset, pid, b"", value, source=self.name)
+                        for ts, pid, value in decode_delta(body)]
+
+    def close(self):
+        """ Close the connection - also wakes a receive() blocked in another thread """
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+
+class BroadcastSource:
+    """ Samples from another dashboard's broadcast as a source - reconnects until stopped """
+
+    def __init__(self, address, publish, pids=None, retry=1.0):
+        host, port = parse_address(address)
+        self.client = BroadcastClient(host, port, pids)
+        self.name = self.client.name
+        self.publish = publish
+        self.retry = retry
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.running = False
+        self.frames = 0
+        self.reconnects = 0
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+        self.running = True
+
+    def _reader(self):
+        client = self.client
+        while not self._stop_event.is_set():
+            try:
+                client.connect()
+                _log.info("Receiving telemetry from %s", self.name)
+                while not self._stop_event.is_set():
+                    samples = client.receive()
+                    self.frames += 1
+                    for sample in samples:
+                        self.publish(sample)
+            except (OSError, ValueError) as e:
+                if self._stop_event.is_set():
+                    break
+                _log.warning("Telemetry from %s lost: %s", self.name, e)
+            client.close()
+            if self._stop_event.wait(self.retry):
+                break
+            self.reconnects += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.client.close()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+        self.running = False
+
+    def stats(self):
+        return {"frames": self.frames, "reconnects": self.reconnects}
+
+def main(argv=None):
+    """ Log a broadcast as csv - seconds since the first sample, PID, name, value, unit """
+    parser = argparse.ArgumentParser(description="Log telemetry from a dashboard started with --serve")
+    parser.add_argument("address", nargs="?", default=f"127.0.0.1:{DEFAULT_PORT}", help="HOST:PORT to connect to")
+    parser.add_argument("--pids", help="comma separated PIDs to log (default every PID) e.g. 0C,0D")
+    args = parser.parse_args(argv)
+
+    pids = {int(pid, 16) for pid in args.pids.split(",") if pid.strip()} if args.pids else None
+    host, port = parse_address(args.address)
+    client = BroadcastClient(host, port, pids)
+    try:
+        client.connect()
+    except OSError as e:
+        parser.exit(1, f"Couldn't connect to {client.name}: {e}\n")
+
+    out = sys.stdout
+    out.write("time,pid,name,value,unit\n")
+    first = None
+    try:
+        while True:
+            for sample in client.receive():
+                if first is None:
+                    first = sample.ts
+                out.write(f"{(sample.ts - first) / 1e9:.3f},{sample.code},{sample.name},{sample.value:g},"
+                          f"{client.units.get(sample.pid, '')}\n")
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    except ConnectionError as e:
+        print(e, file=sys.stderr)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,420 @@
 import serial
 import serial.tools.list_ports
 import threading
+import queue
 import sys
-from datetime import datetime, timezone
+import os
+import csv
+import time
 from collections import deque
-import pandas as pd
-import numexpr
+import re
+import logging
+from logs import get_logger
+
+# numpy is only imported by the batch/table paths so the in-car process starts without it
+
+_log = get_logger("serial")
+_line_log = get_logger("lines")
+_pid_log = get_logger("pid")
+
+canCSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "can.csv")
+
+# formulas can only use A, B, numbers and basic math so they are safe to compile
+_FORMULA_RE = re.compile(r"^[\sAB0-9.+\-*/()]+$")
+
+class PIDDecoder:
+    """ Formula for one PID compiled once into a python function and a full lookup table """
+
+    def __init__(self, pid, formula, unit):
+        self.pid = pid
+        self.formula = formula
+        self.unit = unit
+        self.uses_b = "B" in formula
+        self._table = None
+
+        if not _FORMULA_RE.match(formula):
+            raise ValueError(f"Unsupported formula for PID {pid}: {formula!r}")
+
+        # compile formula into a function - B defaults to 0 because the arduino leaves B off when it is 0
+        self.func = eval(f"lambda A, B=0: ({formula})", {"__builtins__": {}})
+
+        # plain list of every value of A is the fastest lookup for single values - too big to be worth it with B
+        self._small_table = None if self.uses_b else [float(self.func(A)) for A in range(256)]
+
+    @property
+    def table(self):
+        """ NumPy lookup table for every possible input - 256 entries for A only, 65536 for A and B (index is A*256 + B) """
+        if self._table is None:
+            import numpy as np
+            if self.uses_b:
+                index = np.arange(65536)
+                self._table = np.asarray(self.func(index >> 8, index & 0xFF), dtype=np.float64)
+            else:
+                self._table = np.asarray(self._small_table, dtype=np.float64)
+        return self._table
+
+    def __call__(self, A, B=None):
+        """ Return the value for raw bytes A and B """
+        if self._small_table is not None:
+            return self._small_table[A]
+        return float(self.func(A, B or 0))
+
+class PIDRecord:
+    """ One row of can.csv """
+    __slots__ = ("pid", "code", "name", "formula", "unit", "decoder")
+
+    def __init__(self, pid, code, name, formula, unit, decoder):
+        self.pid = pid          # numeric PID
+        self.code = code        # PID as sent to the arduino e.g. '0C'
+        self.name = name
+        self.formula = formula
+        self.unit = unit
+        self.decoder = decoder  # None for PIDs without a formula
+
+    def __repr__(self):
+        return f"PIDRecord({self.code} {self.name})"
+
+def load_pid_table(path=canCSV):
+    """ Read can.csv into PIDRecords keyed by numeric PID and compile their formulas """
+    table = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            code = row["pid"].strip().upper()
+            pid = int(code, 16)
+            formula_str = (row.get("formula") or "").strip()
+            unit = (row.get("unit") or "").strip()
+
+            # PIDs like supported_pid have no formula
+            decoder = None
+            if formula_str:
+                try:
+                    decoder = PIDDecoder(pid, formula_str, unit)
+                except Exception as e:
+                    get_logger("app").warning("Skipping formula for PID %s: %s", code, e)
+
+            table[pid] = PIDRecord(pid, code, row["description"].strip(), formula_str, unit, decoder)
+    return table
+
+# loaded once and shared by everything that needs PID info
+PID_TABLE = load_pid_table()
+
+# compiled decoders keyed by numeric PID
+DECODERS = {pid: rec.decoder for pid, rec in PID_TABLE.items() if rec.decoder is not None}
 
-canCSV = "can.csv"
-df = pd.read_csv(canCSV, index_col="pid")
+def pid_number(pid):
+    """ Numeric PID from either an int or a hex string like '0C' """
+    return int(pid, 16) if isinstance(pid, str) else pid
 
 def formula(pid, A, B=None):
     """ Take incoming PID command and return calculated value based on correlating formula """
-    formula = df.at[pid, "formula"]
-    # Some forumals have A and B but others only A
-    if B is None:
-        f = numexpr.evaluate(formula, local_dict={"A": A}).item()
-    else:
-        f = numexpr.evaluate(formula, local_dict={"A": A, "B": B}).item()
-
-    return f"{f:.2f}{df.at[pid, 'unit']}"
+    decoder = DECODERS[pid_number(pid)]
+    return f"{decoder(A, B):.2f}{decoder.unit}"
 
 def compute_value(pid, A, B=None):
     """ Compute numeric value and unit for pid """
+    decoder = DECODERS[pid_number(pid)]
+    return (decoder(A, B), decoder.unit)
+
+class Sample:
+    """ One decoded reading - unit, name and formatted text are looked up only when asked for """
+    __slots__ = ("ts", "pid", "raw", "value", "trace", "source")
+
+    def __init__(self, ts, pid, raw, value, trace=None, source=None):
+        self.ts = ts        # time.monotonic_ns() when it was read
+        self.pid = pid      # numeric PID
+        self.raw = raw      # data bytes from the ECU - A or A and B
+        self.value = value  # decoded value in the PID's unit
+        self.trace = trace  # (request sent ns or None, bytes received ns) when latency tracing is on
+        self.source = source  # adapter it came from (its port) - None for simulated/replayed samples
+
+    @property
+    def A(self):
+        return self.raw[0]
+
+    @property
+    def B(self):
+        return self.raw[1] if len(self.raw) > 1 else None
+
+    @property
+    def code(self):
+        """ PID as sent to the arduino e.g. '0C' """
+        rec = PID_TABLE.get(self.pid)
+        return rec.code if rec else f"{self.pid:02X}"
+
+    @property
+    def name(self):
+        rec = PID_TABLE.get(self.pid)
+        return rec.name if rec else self.code
+
+    @property
+    def unit(self):
+        """ Unit from can.csv - samples converted for display are layout.DisplaySamples saying theirs """
+        rec = PID_TABLE.get(self.pid)
+        return rec.unit if rec else ""
+
+    def formatted(self, digits=2):
+        """ Value with its unit e.g. '1726.00rpm' """
+        return f"{self.value:.{digits}f}{self.unit}"
+
+    def __repr__(self):
+        return f"Sample({self.code} {self.formatted()} raw={self.raw.hex()} ts={self.ts})"
+
+def decode_batch(pids, A, B=None):
+    """ Decode arrays of raw bytes at once - each PID's lookup table is applied to all of its samples in one go """
+    import numpy as np
+    pids = np.asarray(pids)
+    A = np.asarray(A, dtype=np.intp)
+    B = np.zeros_like(A) if B is None else np.asarray(B, dtype=np.intp)
+
+    # PIDs without a decoder are left as NaN
+    values = np.full(len(pids), np.nan)
+    for pid in np.unique(pids):
+        decoder = DECODERS.get(int(pid))
+        if decoder is None:
+            continue
+        mask = pids == pid
+        if decoder.uses_b:
+            values[mask] = decoder.table[(A[mask] << 8) | B[mask]]
+        else:
+            values[mask] = decoder.table[A[mask]]
+    return values
+
+# value of every byte as a hex digit, -1 for anything that isn't one - built on first use
+_HEX_DIGITS = None
+
+def _hex_digits():
+    """ Build the hex digit lookup table the first time it is needed """
+    global _HEX_DIGITS
+    if _HEX_DIGITS is None:
+        import numpy as np
+        digits = np.full(256, -1, dtype=np.int16)
+        for i, c in enumerate(b"0123456789ABCDEF"):
+            digits[c] = i
+        for i, c in enumerate(b"abcdef", 10):
+            digits[c] = i
+        _HEX_DIGITS = digits
+    return _HEX_DIGITS
+
+def parse_frames(frames):
+    """ Split raw 'PID: A [B] XX' frames into row, pid, A and B arrays - other lines are skipped
+
+    frames can be a bytes block with one frame per line or a sequence of lines (str or bytes), rows are line numbers
+    """
+    import numpy as np
+    if isinstance(frames, (bytes, bytearray, memoryview)):
+        blob = bytes(frames)
+    else:
+        blob = b"\n".join(line.rstrip("\r\n").encode() if isinstance(line, str) else bytes(line).rstrip(b"\r\n")
+                          for line in frames)
+
+    # always end on a newline, then pad so looking a few bytes ahead never leaves the array
+    data = np.frombuffer(blob + b"\n" + bytes(5), dtype=np.uint8)
+    body = data[:-5]
+    is_newline = body == 10
+    newlines = np.flatnonzero(is_newline)
+    starts = np.concatenate(([0], newlines[:-1] + 1))
+    n_lines = len(newlines)
+
+    # PID lines start with 'PID: ' and have room for at least A and the pid
+    is_pid = (newlines - starts) >= 8
+    for k, ch in enumerate(b"PID: "):
+        is_pid &= data[starts + k] == ch
+
+    # payload is everything after 'PID: ' up to the newline - marked with +1/-1 and filled in with a running sum
+    pid_lines = np.flatnonzero(is_pid)
+    marks = np.zeros(len(body) + 1, dtype=np.int8)
+    marks[starts[pid_lines] + 5] = 1
+    marks[newlines[pid_lines]] = -1
+    payload = np.cumsum(marks[:-1], dtype=np.int8).view(np.bool_)
+    digits = _hex_digits()[data]
+    is_hex = digits[:-5] >= 0
+
+    # anything other than hex digits and whitespace makes the line invalid
+    junk = np.flatnonzero(payload & ~is_hex & (body != 32) & (body != 13) & (body != 9))
+    bad = np.bincount(np.searchsorted(newlines, junk), minlength=n_lines) > 0
+
+    # hex tokens are runs of hex digits in the payload - 1 or 2 digits each
+    token = payload & is_hex
+    first_digit = np.flatnonzero(token & ~np.concatenate(([False], token[:-1])))
+    last_digit = np.flatnonzero(token & ~np.concatenate((token[1:], [False])))
+    length = last_digit - first_digit + 1
+    value = np.where(length == 1, digits[first_digit], digits[first_digit] * 16 + digits[first_digit + 1])
+    token_line = np.searchsorted(newlines, first_digit)
+    bad |= np.bincount(token_line[length > 2], minlength=n_lines) > 0
+
+    # keep lines with 'A pid' or 'A B pid'
+    count = np.bincount(token_line, minlength=n_lines)
+    rows = np.flatnonzero(is_pid & ~bad & ((count == 2) | (count == 3)))
+    first = (np.cumsum(count) - count)[rows]
+    count = count[rows]
+
+    A = value[first].astype(np.intp)
+    B = np.where(count == 3, value[first + count - 2], 0).astype(np.intp)
+    pids = value[first + count - 1].astype(np.uint8)
+    return rows, pids, A, B
+
+def decode_frames(frames, timestamps=None):
+    """ Decode a block of raw frames (drained serial buffer, recorded log) into value, pid and timestamp columns """
+    import numpy as np
+    rows, pids, A, B = parse_frames(frames)
+
+    # frames without their own timestamps all get the time they were decoded
+    if timestamps is None:
+        ts = np.full(len(rows), time.time())
+    else:
+        ts = np.asarray(timestamps, dtype=np.float64)[rows]
+
+    return {"value": decode_batch(pids, A, B), "pid": pids, "timestamp": ts}
+
+def parse_pid_frame(line):
+    """ Parse a single b'PID: A [B] XX' line into (pid, A, B) - B is None when the arduino left it off """
+    parts = line.split()
+
+    # split into A and B if B exists - base 16 because OBD2 PIDs are hex
+    if len(parts) == 3:
+        return int(parts[2], 16), int(parts[1], 16), None
+    if len(parts) == 4:
+        return int(parts[3], 16), int(parts[1], 16), int(parts[2], 16)
+    raise ValueError(f"Invalid PID format: {line!r}")
+
+# mode 01 takes up to 6 PIDs in one request - the answer carries each PID followed by its data bytes
+MAX_BATCH = 6
+
+# data bytes in the answer for each PID with a formula - needed to split a batch answer back into PIDs
+DATA_LENGTHS = {pid: 2 if dec.uses_b else 1 for pid, dec in DECODERS.items()}
+
+def request_command(pids):
+    """ [0x0C, 0x0D] -> '01 0C 0D' - one PID is the classic single request, more is a batch (up to MAX_BATCH) """
+    return "01 " + " ".join(PID_TABLE[pid].code for pid in pids)
+
+def parse_batch_frame(line):
+    """ Parse a b'BATCH: 41 0C 1A F8 0D 3C' line (the whole answer, mode byte first) into [(pid, A, B), ...] - B is
+    None for one byte PIDs like in parse_pid_frame """
+    data = bytes.fromhex(line[7:].decode("ascii"))
+    if not data or data[0] != 0x41:
+        raise ValueError(f"Invalid batch format: {line!r}")
+    frames = []
+    i = 1
+    while i < len(data):
+        pid = data[i]
+        length = DATA_LENGTHS.get(pid)
+        if length is None or i + length >= len(data):
+            raise ValueError(f"Can't split batch at PID {pid:02X}: {line!r}")
+        frames.append((pid, data[i + 1], data[i + 2] if length == 2 else None))
+        i += 1 + length
+    return frames
+
+# lines the arduino sends when a PID request gets no answer
+_FAILED_PREFIXES = (b'No response', b'CAN send failed')
+
+# lines that say the arduino is up and reading commands - setup() finished after a reset, or an answer to PING
+_READY_PREFIXES = (b'Arduino Ready', b'PONG')
+
+# PIDs whose answer is a bitmask of which of the next 32 PIDs the car supports
+SUPPORT_PIDS = (0x00, 0x20, 0x40)
+
+def parse_support_frame(line):
+    """ Parse a b'SUPPORTED: XX AABBCCDD' line (all 4 data bytes of a support PID) into (pid, 32 bit mask) """
+    parts = line.split()
+    if len(parts) != 3:
+        raise ValueError(f"Invalid support format: {line!r}")
+    return int(parts[1], 16), int(parts[2], 16)
+
+def supported_from_masks(masks):
+    """ {support pid: mask} -> set of supported PIDs - the high bit of a mask is pid + 1, the low bit pid + 0x20 """
+    return {base + bit for base, mask in masks.items() for bit in range(1, 33) if mask & (1 << (32 - bit))}
+
+class LineFramer:
+    """ Split a stream of serial bytes into lines incrementally without decoding them """
+
+    def __init__(self, max_line=1024):
+        self.max_line = max_line
+        self._partial = bytearray()  # bytes after the last newline, waiting for the rest of their line
+
+    def feed(self, data):
+        """ Add a chunk of bytes and return the complete lines in it (bytes, no line endings) """
+        # arduino println ends lines with \r\n - drop every \r in one pass instead of stripping each line
+        chunk = bytes(data).replace(b"\r", b"")
+        end = chunk.rfind(b"\n")
+
+        # no complete line yet - keep it for next time (and drop runaway garbage with no newlines)
+        if end < 0:
+            self._partial += chunk
+            if len(self._partial) > self.max_line:
+                self._partial.clear()
+            return []
+
+        if self._partial:
+            self._partial += chunk[:end]
+            lines = bytes(self._partial).split(b"\n")
+            self._partial.clear()
+        else:
+            lines = chunk[:end].split(b"\n")
+        self._partial += chunk[end + 1:]
+        return lines
 
-    # Get units and formula
-    unit = df.at[pid, 'unit']
-    formula_str = df.at[pid, "formula"]
+    def reset(self):
+        """ Forget any partial line """
+        self._partial.clear()
 
-    if B is None:
-        f = numexpr.evaluate(formula_str, local_dict={"A": A}).item()
-    else:
-        f = numexpr.evaluate(formula_str, local_dict={"A": A, "B": B}).item()
-    return (float(f), unit)
+def find_arduino_ports():
+    """ Find the COM ports of every Arduino plugged in """
+    ports = list(serial.tools.list_ports.comports())
+    return [p.device for p in ports
+            if 'Arduino' in p.description or 'CH340' in p.description] # CH340 is common arduino clone
 
 def find_arduino_port():
     """ Find COM port of Arduino by scanning all available ports """
-    ports = list(serial.tools.list_ports.comports())
-    for p in ports:
-        if 'Arduino' in p.description or 'CH340' in p.description: # CH340 is common arduino clone
-            return p.device
-    return None
+    ports = find_arduino_ports()
+    return ports[0] if ports else None
 
 class SerialManager:
     """ Manage a serial connection with a background reader thread and a send() command """
 
     # baudrate and timeout and buffer is a default number
     def __init__(self, port, baudrate=115200, read_timeout=0.1, decode='utf-8', max_buffer=1000,
-                 event_queue=None, event_callback=None):
-        """ Create a SerialManager and use threading to read incoming lines in the background """
+                 event_queue=None, event_callback=None, response_callback=None, serial_factory=None, capture=None,
+                 tracer=None, source=None):
+        """ Create a SerialManager and use threading to read incoming lines in the background
+
+        serial_factory(port, baudrate, timeout) opens the port instead of serial.Serial (e.g. capture.ReplaySerial)
+        capture is a file to tee every raw byte to with its arrival time (see capture.py)
+        tracer is a latency.LatencyTracer to tag samples with request/receive times
+        source is the name samples get tagged with (defaults to the port)
+        """
 
         # port settings
         self.port = port
+        self.source = source or port
         self.baudrate = baudrate
         self.read_timeout = read_timeout
         self.decode = decode
+        self.serial_factory = serial_factory or (lambda port, baudrate, timeout: serial.Serial(port, baudrate, timeout=timeout))
+        self.capture = capture
+        self._capture = None
 
         # thread settings
         self._ser = None
         self._thread = None
         self._stop_event = threading.Event()
-        self._lock = threading.Lock()
+        self._lock = threading.Lock()        # internal buffer
+        self._write_lock = threading.Lock()  # send() - separate so writes never hold up the reader
 
-        # internal buffer for incoming lines (thread-safe when used with _lock)
+        # internal buffer for incoming raw lines (thread-safe when used with _lock)
         self._buffer = deque(maxlen=max_buffer)
 
+        # reusable read buffer and framer for splitting it into lines
+        self._read_buf = bytearray(4096)
+        self._framer = LineFramer()
+
         self.event_queue = event_queue
         self.event_callback = event_callback # note to self: callback is leaving queue and coming back to last place
+        self.response_callback = response_callback # called with the PID that answered, or None on a timeout line
+        self.support_callback = None # called with (pid, mask) when a support PID answers - see discovery.py
+        self.batch_callback = None # called with the PIDs in a BATCH answer - the rest of the batch failed
+        self.ready = threading.Event() # set once the arduino said Arduino Ready or PONG - see handshake()
+        self.dropped_events = 0 # events that didn't fit in event_queue - the reader never waits on it
+        self.tracer = tracer
 
     def start(self):
         """ Start background thread by opening serial port """
@@ -76,101 +424,164 @@ class SerialManager:
             return
         try:
             # connect to serial port
-            self._ser = serial.Serial(self.port, self.baudrate, timeout=self.read_timeout)
+            self._ser = self.serial_factory(self.port, self.baudrate, self.read_timeout)
         except Exception as e:
-            print(f"Failed to open {self.port}: {e}")
+            _log.error("Failed to open %s: %s", self.port, e)
             raise
+        _log.info("Opened %s at %d baud", self.port, self.baudrate)
+
+        # raw byte capture for replaying this session later
+        if self.capture and self._capture is None:
+            from capture import CaptureWriter
+            self._capture = CaptureWriter(self.capture)
 
         # start thread
         self._stop_event.clear()
+        self.ready.clear()
+        self._framer.reset()
         self._thread = threading.Thread(target=self._reader_loop, daemon=True)
         self._thread.start()
 
     def _reader_loop(self):
-        """ Loop to read lines from serial """
+        """ Loop to read everything waiting on serial in one call and handle the complete lines """
         while not self._stop_event.is_set():
             try:
-                # read line from serial port
-                line = self._ser.readline()
-                if not line:
+                # read whatever is waiting in one go - if nothing is, wait up to read_timeout for the first byte
+                waiting = self._ser.in_waiting
+                if waiting > len(self._read_buf):
+                    self._read_buf = bytearray(waiting)
+                n = self._ser.readinto(memoryview(self._read_buf)[:max(waiting, 1)])
+                if not n:
+                    continue
+                rx = time.monotonic_ns()
+                if self._capture is not None:
+                    self._capture.write(self._read_buf[:n])
+
+                lines = self._framer.feed(memoryview(self._read_buf)[:n])
+                if not lines:
                     continue
-                try:
-                    # decode line from bytes to string
-                    decoded = line.decode(self.decode, errors='replace').strip()
-                except Exception:
-                    # show bytes if decoding fails
-                    decoded = repr(line)
 
-                # store message in internal buffer
+                # store raw messages in internal buffer - one lock per read instead of per line
                 with self._lock:
-                    self._buffer.append(decoded)
-
-                # Right now this does not take into account PID with no forumla - might remove non-formula PIDs
-                # Base 16 for int because OBD2 PIDs are hex
-                if decoded.startswith('PID: '):
-                    try:
-                        parts = decoded[5:].split()  # Remove 'PID: ' and split into the bits
-
-                        # split into A and B if B exists
-                        if len(parts) == 2:
-                            A, pid = parts
-                            A = int(A, 16)
-                            B = None
-                        elif len(parts) == 3:
-                            A, B, pid = parts
-                            A = int(A, 16)
-                            B = int(B, 16)
-                        else:
-                            # print invalid pid and skip it
-                            print(f"Invalid PID format: {decoded}")
-                            continue
-
-                        # get command from dataframe
-                        cmd = df.loc[pid, "command"]
-
-                        # compute numeric value and unit
-                        value, unit = compute_value(pid, A, B)
-                        formatted = None
-                        # create string formatted with value and unit - I don't think it will be used for the dashboard but will be good for debugging
-                        if value is not None:
-                            formatted = f"{value:.2f}{unit}"
-
-                        # create event dict
-                        event = {
-                            "timestamp": datetime.now(timezone.utc).isoformat(), # might be needed for dashboard
-                            "pid": pid,
-                            "command": cmd,
-                            "raw": {"A": A, "B": B},
-                            "value": value, # main unit for dashboard
-                            "unit": unit,
-                            "formatted": formatted
-                        }
-
-                        # push to queue/callback if provided
-                        if self.event_queue is not None:
-                            try:
-                                self.event_queue.put(event)
-                            except Exception as e:
-                                print(f"Failed to put event in queue: {e}")
-                        if self.event_callback is not None:
-                            try:
-                                self.event_callback(event)
-                            except Exception as e:
-                                print(f"Event callback error: {e}")
-
-                        # keep a debug print - turn off during non-testing
-                        if formatted:
-                            print(f"{cmd} -> {formatted}")
-                        else:
-                            print(f"{cmd} -> raw A={A} B={B}")
-                    except Exception as e:
-                        print(f"Error processing PID: {e}")
-                else:
-                    print(decoded)
+                    self._buffer.extend(lines)
+
+                for line in lines:
+                    self._handle_line(line, rx)
             except Exception as e:
-                print(f"Serial read error: {e}")
+                _log.error("Serial read error on %s: %s", self.port, e)
                 break
 
+    def _handle_line(self, line, rx=None):
+        """ Parse one raw line read at rx - PID frames become Samples, anything else is printed """
+        # Right now this does not take into account PID with no forumla - might remove non-formula PIDs
+        if not line.startswith(b'PID: '):
+            # several PIDs answered in one frame - anything asked for and not in it isn't coming
+            if line.startswith(b'BATCH: '):
+                try:
+                    frames = parse_batch_frame(line)
+                except ValueError as e:
+                    frames = ()
+                    _log.warning("%s", e)
+                # the whole batch is settled in one go before any sample goes out - a poller released part way
+                # through would have its next batch failed by the end of this one
+                answered = [pid for pid, A, B in frames]
+                sent = None
+                if self.tracer is not None:
+                    rx = time.monotonic_ns() if rx is None else rx
+                    sent = self.tracer.batch_response(answered, rx, self.source)
+                self._notify_batch(answered)
+                for pid, A, B in frames:
+                    self._emit(pid, A, B, (sent, rx) if self.tracer is not None else None)
+                return
+            # arduino gave up on the pending request
+            if line.startswith(_FAILED_PREFIXES):
+                self._notify_response(None)
+                if self.tracer is not None:
+                    self.tracer.response(None, rx, self.source)
+            elif line.startswith(_READY_PREFIXES):
+                self.ready.set()
+            # supported PID bitmask - only asked for while discovering
+            elif line.startswith(b'SUPPORTED: '):
+                try:
+                    pid, mask = parse_support_frame(line)
+                except ValueError as e:
+                    _log.warning("%s", e)
+                else:
+                    # the mask has to be stored before the waiting query wakes up and reads it
+                    if self.support_callback is not None:
+                        self.support_callback(pid, mask)
+                    self._notify_response(pid)
+            # only text lines get decoded - and only when someone is logging them
+            if line and _line_log.isEnabledFor(logging.INFO):
+                _line_log.info("%s: %s", self.source, line.decode(self.decode, errors='replace'))
+            return
+
+        try:
+            pid, A, B = parse_pid_frame(line)
+        except ValueError as e:
+            _log.warning("Error processing PID line %r: %s", line, e)
+            return
+        self._notify_response(pid)
+        trace = None
+        if self.tracer is not None:
+            rx = time.monotonic_ns() if rx is None else rx
+            trace = (self.tracer.response(pid, rx, self.source), rx)
+        self._emit(pid, A, B, trace)
+
+    def _emit(self, pid, A, B, trace):
+        """ Decode one answered PID and hand the Sample to the queue/callback """
+        try:
+            # compute numeric value and keep the raw bytes - unit and name come from the PID table when needed
+            value = DECODERS[pid](A, B)
+            sample = Sample(time.monotonic_ns(), pid, bytes((A,)) if B is None else bytes((A, B)), value, trace,
+                            self.source)
+
+            # push to queue/callback if provided - never block the reader on a full queue
+            if self.event_queue is not None:
+                try:
+                    self.event_queue.put_nowait(sample)
+                except queue.Full:
+                    self.dropped_events += 1
+                except Exception as e:
+                    _log.error("Failed to put event in queue: %s", e)
+            if self.event_callback is not None:
+                try:
+                    self.event_callback(sample)
+                except Exception as e:
+                    _log.error("Event callback error: %s", e)
+
+            # debug log of every sample - off unless the pid category is at DEBUG
+            if _pid_log.isEnabledFor(logging.DEBUG):
+                _pid_log.debug("%s -> %s", sample.name, sample.formatted())
+        except Exception as e:
+            _log.warning("Error processing PID %02X: %s", pid, e)
+
+    def _notify_response(self, pid):
+        """ Tell the poller a request was answered (pid) or failed (None) """
+        if self.response_callback is not None:
+            try:
+                self.response_callback(pid)
+            except Exception as e:
+                _log.error("Response callback error: %s", e)
+
+    def _notify_batch(self, answered):
+        """ Tell the poller a batch was answered with these PIDs - per PID and then None without a batch callback """
+        if self.batch_callback is None:
+            for pid in answered:
+                self._notify_response(pid)
+            self._notify_response(None)
+            return
+        try:
+            self.batch_callback(answered)
+        except Exception as e:
+            _log.error("Batch callback error: %s", e)
+
+    def recent_lines(self):
+        """ Recent lines from the device decoded to text - for debugging """
+        with self._lock:
+            raw = list(self._buffer)
+        return [line.decode(self.decode, errors='replace') for line in raw]
+
     def send(self, message, newline=True):
         """ Send a message to the serial port - thread safe """
 
@@ -184,12 +595,29 @@ class SerialManager:
             payload += b"\r\n"
 
         # send to serial port
-        with self._lock:
+        with self._write_lock:
             # check for serial port open
             if not self._ser or not self._ser.is_open:
                 raise RuntimeError('Serial port not open')
             self._ser.write(payload)
             self._ser.flush() # ensure it gets sent
+            if self._capture is not None:
+                self._capture.write(payload, direction=1)  # sent to the device
+
+    def handshake(self, timeout=3.0, ping_interval=0.25):
+        """ Wait for the arduino to be ready instead of sleeping a fixed time - returns True once it is
+
+        a board that resets when the port opens says Arduino Ready when setup() is done, one that doesn't answers
+        PING - PINGs that land in the bootloader are lost (optiboot just starts the sketch sooner) """
+        deadline = time.monotonic() + timeout
+        while not self._stop_event.is_set():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            self.send("PING")
+            if self.ready.wait(min(ping_interval, left)):
+                return True
+        return False
 
     def stop(self, wait=True):
         """ Stop thread and close serial port """
@@ -201,8 +629,16 @@ class SerialManager:
                 self._ser.close()
         except Exception:
             pass
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
 
 if __name__ == '__main__':
+    import logs
+
+    # everything the arduino says goes straight to the console here
+    logs.setup(path=None, console_level=logging.DEBUG, levels={"pid": logging.DEBUG}, burst=1000, interval=1.0,
+               flush_interval=0.05)
 
     port = find_arduino_port()
     if not port:
@@ -244,4 +680,5 @@ if __name__ == '__main__':
         pass
     finally:
         mgr.stop()
+        logs.shutdown()
         print('Stopped.')
\ No newline at end of file
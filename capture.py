@@ -0,0 +1,246 @@
+import sys
+import time
+import struct
+import threading
+import argparse
+
+"""
+byte-exact serial capture and replay
+
+a capture file is a short header followed by one record per read/write on the port:
+    int64   nanoseconds since the capture started
+    uint8   direction (0 = from the device, 1 = sent to it)
+    uint32  length
+    bytes   exactly what was read or written
+
+ReplaySerial plays a capture back with the same interface SerialManager uses on serial.Serial, so an unmodified
+SerialManager can be run offline on real traffic:
+    mgr = can.SerialManager("drive.cap", serial_factory=replay_factory(speed=0))
+"""
+
+MAGIC = b"DDCAP1\n"
+RECORD = struct.Struct("<qBI")
+RX, TX = 0, 1
+
+class CaptureWriter:
+    """ Append raw serial traffic with arrival times to a capture file """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._start = time.monotonic_ns()
+        self._lock = threading.Lock()  # reader thread writes rx, send() writes tx
+        self.bytes_captured = 0
+
+    def write(self, data, direction=RX):
+        """ Record one chunk - buffered so the reader thread doesn't wait on the disk """
+        ts = time.monotonic_ns() - self._start
+        with self._lock:
+            self._file.write(RECORD.pack(ts, direction, len(data)))
+            self._file.write(data)
+            self.bytes_captured += len(data)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+def read_capture(path):
+    """ Yield (ns since start, direction, bytes) for every record in a capture file """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            ts, direction, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return  # capture cut off mid-record
+            yield ts, direction, data
+
+class ReplaySerial:
+    """ Stand-in for serial.Serial that plays back what the device sent in a capture file
+
+    speed 1 keeps the original timing, 2 plays twice as fast, 0 hands out one recorded read after another as fast as
+    they get taken
+    writes are accepted and thrown away
+    """
+
+    def __init__(self, path, timeout=0.1, speed=1.0, loop=False, baudrate=115200):
+        self.port = path
+        self.timeout = timeout
+        self.baudrate = baudrate
+        self.speed = speed
+        self.loop = loop
+        self.is_open = True
+
+        # only what the device sent matters for replay
+        self._records = [(ts, data) for ts, direction, data in read_capture(path) if direction == RX]
+        self._next = 0          # next record to release
+        self._data = bytearray()  # released but not yet read
+        self._cond = threading.Condition()
+        self._began = time.monotonic()
+        self._offset = 0        # ns added to record times when looping
+        self.bytes_written = 0
+
+    @property
+    def finished(self):
+        """ True once every recorded byte has been read """
+        return self._next >= len(self._records) and not self._data and not self.loop
+
+    def _release(self):
+        """ Move records whose time has come into the read buffer - call with _cond held """
+        records = self._records
+        if not records:
+            return
+        if self.speed:
+            elapsed = int((time.monotonic() - self._began) * 1e9 * self.speed)
+        while True:
+            if self._next >= len(records):
+                if not self.loop:
+                    return
+                self._offset += records[-1][0] + 1
+                self._next = 0
+            ts, data = records[self._next]
+            if self.speed and ts + self._offset > elapsed:
+                return
+            self._data += data
+            self._next += 1
+            # as fast as possible still hands out one record at a time so reads look like they did live
+            if not self.speed:
+                return
+
+    def _time_to_next(self):
+        """ Seconds until the next record is due (None when there is nothing left) """
+        if self._next >= len(self._records) and not self.loop:
+            return None
+        if not self.speed:
+            return 0
+        ts = self._records[self._next % len(self._records)][0] + self._offset
+        return max(ts / 1e9 / self.speed - (time.monotonic() - self._began), 0)
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            self._release()
+            return len(self._data)
+
+    def read(self, size=1):
+        """ Read up to size bytes, waiting up to timeout for the first one like pyserial """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if not self.is_open:
+                    raise OSError("port closed")
+                self._release()
+                if self._data:
+                    out = bytes(self._data[:size])
+                    del self._data[:size]
+                    return out
+                wait = self._time_to_next()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return b""
+                if wait is None:
+                    # nothing left - behave like a quiet port
+                    wait = remaining
+                elif remaining is not None:
+                    wait = min(wait, remaining)
+                self._cond.wait(wait)
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        line = bytearray()
+        while not line.endswith(b"\n"):
+            chunk = self.read(1)
+            if not chunk:
+                break
+            line += chunk
+        return bytes(line)
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("port closed")
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+def replay_factory(speed=1.0, loop=False):
+    """ serial_factory for SerialManager that opens the 'port' as a capture file """
+    def factory(port, baudrate, timeout):
+        return ReplaySerial(port, timeout=timeout, speed=speed, loop=loop, baudrate=baudrate)
+    return factory
+
+def profile_replay(path, speed=0, profile=False):
+    """ Run an unmodified SerialManager over a capture and report samples decoded per second """
+    import can_communication as can
+
+    received = [0]
+    def count(sample):
+        received[0] += 1
+
+    mgr = can.SerialManager(path, serial_factory=replay_factory(speed=speed), event_callback=count)
+
+    # the reader runs in its own thread - profile inside it
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        reader_loop = mgr._reader_loop
+        mgr._reader_loop = lambda: profiler.runcall(reader_loop)
+
+    began = time.monotonic()
+    mgr.start()
+    while not mgr._ser.finished and mgr._thread.is_alive():
+        time.sleep(0.01)
+    elapsed = time.monotonic() - began
+    mgr.stop()
+
+    if profiler:
+        import pstats
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+    return {"seconds": elapsed, "samples": received[0], "samples_per_second": received[0] / elapsed if elapsed else 0.0}
+
+def summarize(path):
+    """ Byte and record counts for a capture """
+    rx = tx = records = 0
+    last = 0
+    for ts, direction, data in read_capture(path):
+        records += 1
+        last = ts
+        if direction == RX:
+            rx += len(data)
+        else:
+            tx += len(data)
+    return {"records": records, "rx_bytes": rx, "tx_bytes": tx, "seconds": last / 1e9}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect or replay serial captures")
+    parser.add_argument("command", choices=["info", "replay"])
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=0, help="replay speed (1 = original timing, 0 = as fast as possible)")
+    parser.add_argument("--profile", action="store_true", help="print a cProfile summary of the replay")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        result = summarize(args.path)
+    else:
+        result = profile_replay(args.path, speed=args.speed, profile=args.profile)
+    for key, value in result.items():
+        print(f"{key:>20}: {value:.3f}" if isinstance(value, float) else f"{key:>20}: {value}")
+    sys.exit(0)
@@ -1,24 +1,65 @@
-import pygame
+import time
+_started = time.monotonic_ns()  # startup milestones count from here
 import math
 import sys
 import can_communication as can
-import queue, threading, time, random
-import pandas as pd
+from telemetry import TelemetryStore
+from recorder import Recording, check_new
+from latency import LatencyTracer
+from metrics import MetricsEngine
+from pipeline import Pipeline, find_ports
+from layout import load_layout, LAYOUT_PATH
+from history import History, LttbCache, downsample, plot_points
+from ingest import IngestProcess, NO_ADAPTERS, RUNNING
+import logs
+import threading, random
+import argparse
+import logging
 
 """
 translate to imperial units
-
-when updating values, only update if there is a whole number change
 """
 
 # -------------------- DRAWING FUNCTIONS --------------------
 
-# maybe add ability to put logo instead of label text like for volt and fuel pressure or figure something out for that
-def draw_gauge(center, radius, value, max_value, label):
-    """ Create gauge with needle """
+# render cache - fonts, static text and gauge faces are built once instead of every frame
+_fonts = {}
+_text_cache = {}
+_face_cache = {}
+
+def get_font(size):
+    """ Font of the given size - created once and reused """
+    font = _fonts.get(size)
+    if font is None:
+        font = _fonts[size] = pygame.font.SysFont(None, size)
+    return font
+
+def static_text(text, size, color):
+    """ Rendered surface for text that doesn't change - rendered once and reused """
+    key = (text, size, color)
+    surf = _text_cache.get(key)
+    if surf is None:
+        surf = _text_cache[key] = get_font(size).render(text, True, color)
+    return surf
+
+def clear_render_cache():
+    """ Drop cached gauge faces and text so they get rebuilt - used when the window is resized """
+    _text_cache.clear()
+    _face_cache.clear()
+
+def gauge_face(radius, label):
+    """ Static part of a gauge (outer circle, tick marks and label) drawn once onto its own surface """
+    key = (radius, label)
+    face = _face_cache.get(key)
+    if face is not None:
+        return face
+
+    size = radius * 2 + 2
+    face = pygame.Surface((size, size), pygame.SRCALPHA)
+    center = (radius + 1, radius + 1)
 
     # Draw outer circle
-    pygame.draw.circle(screen, (255, 255, 255), center, radius, 3)
+    pygame.draw.circle(face, (255, 255, 255), center, radius, 3)
 
     # Draw tick marks - AI created
     for i in range(0, 181, 20):  # 0 to 180 degrees
@@ -27,7 +68,21 @@ def draw_gauge(center, radius, value, max_value, label):
         y1 = center[1] - (radius - 15) * math.sin(angle)
         x2 = center[0] + radius * math.cos(angle)
         y2 = center[1] - radius * math.sin(angle)
-        pygame.draw.line(screen, (255, 255, 255), (x1, y1), (x2, y2), 2)
+        pygame.draw.line(face, (255, 255, 255), (x1, y1), (x2, y2), 2)
+
+    # Draw label
+    label_text = static_text(label, 36, (200, 200, 200))
+    label_rect = label_text.get_rect(center=(center[0], center[1] + radius - 20))
+    face.blit(label_text, label_rect)
+
+    _face_cache[key] = face
+    return face
+
+# maybe add ability to put logo instead of label text like for volt and fuel pressure or figure something out for that
+def draw_gauge(center, radius, value, max_value, label):
+    """ Create gauge with needle - only the needle is drawn each frame, the rest comes from the cached face """
+
+    screen.blit(gauge_face(radius, label), (center[0] - radius - 1, center[1] - radius - 1))
 
     # Draw needle - AI created
     angle = math.radians(180 - (value / max_value) * 180)
@@ -37,18 +92,12 @@ def draw_gauge(center, radius, value, max_value, label):
 
     """
     # Draw value text
-    font = pygame.font.SysFont(None, 40)
+    font = get_font(40)
     text = font.render(f"{value:.0f}", True, (255, 255, 255))
     text_rect = text.get_rect(center=(center[0], center[1] + 50))
     screen.blit(text, text_rect)
     """
 
-    # Draw label
-    label_font = pygame.font.SysFont(None, 36)
-    label_text = label_font.render(label, True, (200, 200, 200))
-    label_rect = label_text.get_rect(center=(center[0], center[1] + radius - 20))
-    screen.blit(label_text, label_rect)
-
 # colors for status indicators
 WHITE = (220, 220, 220)
 GREEN = (0, 200, 0)
@@ -64,47 +113,98 @@ def draw_status_indicator(surface, x, y, label, state):
     """ Draw status indicator with label - for detection splash """
     color = WHITE if state is None else (GREEN if state else RED)
     pygame.draw.circle(surface, color, (x, y), 10)
-    font = pygame.font.SysFont(None, 20)
-    text = font.render(label, True, (255, 255, 255))
-    surface.blit(text, (x + 16, y - 8))
+    surface.blit(static_text(label, 20, (255, 255, 255)), (x + 16, y - 8))
+
+def gauge_rect(center, radius):
+    """ Area a gauge covers on screen """
+    return pygame.Rect(center[0] - radius - 1, center[1] - radius - 1, radius * 2 + 2, radius * 2 + 2)
+
+def gauge_value(gauge):
+    """ Value a gauge shows - latest value (already in display units) snapped to the gauge's display resolution """
+    value = value_of(gauge.pid, gauge.default)
+    return round(value / gauge.resolution) * gauge.resolution
+
+def gauge_center(gauge):
+    """ Where a gauge sits at the current window size """
+    return int(WIDTH * gauge.pos[0]), int(HEIGHT * gauge.pos[1])
+
+def show_gauge(gauges, i, shown):
+    """ Draw gauge i at its current value and remember the value in shown """
+    gauge = gauges[i]
+    shown[i] = gauge_value(gauge)
+    draw_gauge(gauge_center(gauge), gauge.radius, shown[i] - gauge.min, gauge.max - gauge.min, gauge.label)
+
+def draw_gauges(gauges, shown, full=True, box_changed=False):
+    """ Draw the gauges whose shown value changed since last time (every gauge when full) - returns the rects drawn
+
+    shown maps gauge index -> value it is showing and gets updated. a partial redraw also takes the info box when
+    box_changed, and anything overlapping a rect it wipes - at some window sizes gauges overlap each other and the box
+    """
+    if full:
+        for i in range(len(gauges)):
+            show_gauge(gauges, i, shown)
+        return [gauge_rect(gauge_center(gauge), gauge.radius) for gauge in gauges]
+
+    # (rect, gauge index or None for the box) in the order a full redraw draws them
+    items = [(box_rect(), None)]
+    items += [(gauge_rect(gauge_center(gauge), gauge.radius), i) for i, gauge in enumerate(gauges)]
+    dirty = [box_changed] + [shown.get(i) != gauge_value(gauge) for i, gauge in enumerate(gauges)]
+    if not any(dirty):
+        return []
+
+    # wiping a rect takes out whatever overlaps it - that has to be redrawn too, and may overlap something else
+    grew = True
+    while grew:
+        grew = False
+        wiped = [rect for (rect, _), d in zip(items, dirty) if d]
+        for n, (rect, _) in enumerate(items):
+            if not dirty[n] and rect.collidelist(wiped) != -1:
+                dirty[n] = grew = True
+
+    drawn = [item for item, d in zip(items, dirty) if d]
+    for rect, _ in drawn:
+        screen.fill((0, 0, 0), rect)
+    for _, i in drawn:
+        if i is None:
+            draw_box()
+        else:
+            show_gauge(gauges, i, shown)
+    return [rect for rect, _ in drawn]
+
+BOX_SIZE = (420, 110)
+
+def box_rect():
+    """ Area the info box covers including the hint under it """
+    box_w, box_h = BOX_SIZE
+    return pygame.Rect((WIDTH - box_w) // 2, 20, box_w, box_h + 32)
+
+def box_text():
+    """ Value of the current box option as it is shown e.g. '185.0°F' """
+    opt = box_options[box_index]
+    sample = last_values.get(opt.pid)
+    if not sample:
+        return 'N/A'
+    return f"{sample.value:.1f}{opt.unit}"
 
 # AI
 def draw_box():
     """ Draw box that displays extra info """
 
     # draw a rounded-ish rectangle near the top center with current box info
-    box_w, box_h = 420, 110
-    x = (WIDTH - box_w) // 2
-    y = 20
+    box_w, box_h = BOX_SIZE
+    x, y = box_rect().topleft
     # background
     pygame.draw.rect(screen, (30, 30, 30), (x, y, box_w, box_h), border_radius=8)
     # border
     pygame.draw.rect(screen, (100, 100, 100), (x, y, box_w, box_h), 2, border_radius=8)
 
-    # get current option
-    opt = box_options[box_index]
-    pid = opt['pid']
-    label = opt['label']
-
-    # find value
-    ev = last_values.get(pid)
-    if ev:
-        val_raw = ev.get('value')
-        # Convert temperatures from Celsius to Fahrenheit for display
-        if pid in ['05', '5C', '0F', '46']:  # Temperature PIDs
-            val_raw = (val_raw * 9/5) + 32
-            unit = '°F'
-        else:
-            unit = ev.get('unit', '')
-        val = f"{val_raw:.1f}{unit}"
-    else:
-        val = 'N/A'
+    # get current option and its value
+    label = box_options[box_index].label
+    val = box_text()
 
-    # draw texts
-    title_font = pygame.font.SysFont(None, 28)
-    val_font = pygame.font.SysFont(None, 36)
-    title = title_font.render(label, True, (220, 220, 220))
-    val_surf = val_font.render(str(val), True, (255, 255, 255))
+    # draw texts - title and hint are static, only the value is rendered each frame
+    title = static_text(label, 28, (220, 220, 220))
+    val_surf = get_font(36).render(str(val), True, (255, 255, 255))
 
     # center title and value inside the box
     center_x = x + box_w // 2
@@ -114,33 +214,146 @@ def draw_box():
     screen.blit(val_surf, val_rect)
 
     # hint for switching
-    hint = title_font.render('Press SPACE to cycle', True, (120, 120, 120))
+    hint = static_text('Press SPACE to cycle', 28, (120, 120, 120))
     hint_rect = hint.get_rect(center=(center_x, y + box_h + 16))
     screen.blit(hint, hint_rect)
 
+GRAPH_SPANS = (120, 600, 3600)  # seconds a graph covers - T cycles through them
+GRAPH_REFRESH = 0.25  # seconds between redraws of one graph
+_lttb_caches = {}  # graph index -> the lttb points it keeps between draws
+
+def span_text(seconds):
+    return f"{seconds // 3600} h" if seconds >= 3600 else f"{seconds // 60} min"
+
+def graph_rect(i):
+    """ Area graph i covers - the graphs are stacked under the title """
+    top, gap = 50, 10
+    h = (HEIGHT - top - 10) // len(GRAPHS) - gap
+    return pygame.Rect(20, top + i * (h + gap), WIDTH - 40, h)
+
+def draw_graph(i, end):
+    """ Draw one trend graph ending at end (ns) - downsampled to one bucket per pixel column first """
+    spec = GRAPHS[i]
+    rect = graph_rect(i)
+    pygame.draw.rect(screen, (30, 30, 30), rect)
+    pygame.draw.rect(screen, (100, 100, 100), rect, 1)
+
+    sample = last_values.get(spec.pid)
+    value = 'N/A' if sample is None else f"{sample.value:.1f}{spec.unit}"
+    screen.blit(static_text(spec.label, 24, (220, 220, 220)), (rect.x + 8, rect.y + 6))
+    screen.blit(get_font(24).render(value, True, (255, 255, 255)), (rect.x + 120, rect.y + 6))
+    high = static_text(f"{spec.max:g}", 20, (120, 120, 120))
+    screen.blit(high, (rect.right - high.get_width() - 6, rect.y + 6))
+    low = static_text(f"{spec.min:g}", 20, (120, 120, 120))
+    screen.blit(low, (rect.right - low.get_width() - 6, rect.bottom - 20))
+
+    plot = pygame.Rect(rect.x + 8, rect.y + 28, rect.w - 56, rect.h - 34)
+    if end is None or plot.w < 2 or plot.h < 2:
+        return rect
+    start = end - GRAPH_SPANS[graph_span] * 1_000_000_000
+    ts, values = history.window(spec.pid, start)
+    if len(ts) == 0:
+        return rect
+    columns, lows, highs = downsample(ts, values, start, end, plot.w, spec.downsample,
+                                      _lttb_caches.setdefault(i, LttbCache()))
+    tops, bottoms = plot_points(columns, lows, highs, tuple(plot), spec.min, spec.max)
+    if len(tops) > 1:
+        if spec.downsample == "minmax":
+            # band between the lowest and highest value in each column
+            pygame.draw.polygon(screen, (110, 0, 0), tops + bottoms[::-1])
+            pygame.draw.lines(screen, (255, 0, 0), False, bottoms)
+        pygame.draw.lines(screen, (255, 0, 0), False, tops)
+    return rect
+
+def draw_graphs(graphs_drawn, full=True):
+    """ Draw the graphs - every one when full, otherwise the one with new samples that was drawn longest ago (at most
+    every GRAPH_REFRESH) so no frame pays for all of them - returns the rects drawn
+
+    graphs_drawn maps graph index -> (samples recorded, monotonic time) when it was last drawn and gets updated
+    """
+    newest = history.newest()
+    end = None if newest is None else newest + 1
+    now = time.monotonic()
+    if full:
+        title = static_text(f"Last {span_text(GRAPH_SPANS[graph_span])} - G for gauges, T to change", 28,
+                            (120, 120, 120))
+        screen.blit(title, title.get_rect(center=(WIDTH // 2, 25)))
+        todo = range(len(GRAPHS))
+    else:
+        stale = [(graphs_drawn[i][1], i) for i, spec in enumerate(GRAPHS)
+                 if graphs_drawn.get(i, (None, 0.0))[0] != history.count(spec.pid)
+                 and now - graphs_drawn.get(i, (None, 0.0))[1] >= GRAPH_REFRESH]
+        todo = [min(stale)[1]] if stale else []
+    rects = []
+    for i in todo:
+        count = history.count(GRAPHS[i].pid)
+        rects.append(draw_graph(i, end))
+        graphs_drawn[i] = (count, now)
+    return rects
+
+def value_of(pid, default):
+    """ Latest value for a pid or default if nothing has come in yet """
+    sample = last_values.get(pid)
+    return default if sample is None else sample.value
+
 def draw_status_panel():
     """ Draw initialization status panel """
     # top-left corner
     draw_status_indicator(screen, 20, 20, 'Arduino Detected', status['arduino_detected'])
     draw_status_indicator(screen, 20, 50, 'Serial Connected', status['serial_running'])
     draw_status_indicator(screen, 20, 80, 'Simulator Running', status['simulator_running'])
+    if status['replay_running'] is not None:
+        draw_status_indicator(screen, 20, 110, 'Replay Running', status['replay_running'])
+
+_latency_report = {'at': 0.0, 'report': None, 'sources': {}}
+
+def draw_latency_overlay():
+    """ Per-PID latency table over the gauges - toggled with L """
+    # percentiles walk every histogram bucket - refresh twice a second instead of every frame
+    now = time.monotonic()
+    if _latency_report['report'] is None or now - _latency_report['at'] > 0.5:
+        _latency_report['report'] = tracer.report()
+        _latency_report['sources'] = store.source_stats()
+        _latency_report['at'] = now
+    report = _latency_report['report']
+
+    def percentiles(hist):
+        return f"{hist['p50']:.1f} / {hist['p95']:.1f} / {hist['p99']:.1f}"
+
+    rows = [("PID", "name", "shown", "rtt p50/p95/p99 ms", "total p50/p95/p99 ms", "timeouts")]
+    for code, pid in report['pids'].items():
+        rec = can.PID_TABLE.get(int(code, 16))
+        rows.append((code, rec.name if rec else code, str(pid['total']['count']), percentiles(pid['rtt']),
+                     percentiles(pid['total']), str(pid['timeouts'])))
+    rows.append(("", "frame interval", str(report['frames']['count']), "", percentiles(report['frames']), ""))
+    for name, counts in _latency_report['sources'].items():
+        rows.append(("", name, str(counts['samples']), f"{counts['per_second']:.1f} samples/s", "", ""))
+
+    # the font isn't monospaced - each column starts at its own x
+    columns = (0, 50, 280, 350, 560, 770)
+    font = get_font(20)
+    line_h = font.get_linesize()
+    panel = pygame.Surface((columns[-1] + 100, line_h * len(rows) + 16), pygame.SRCALPHA)
+    panel.fill((0, 0, 0, 200))
+    for i, row in enumerate(rows):
+        for x, cell in zip(columns, row):
+            panel.blit(font.render(cell, True, (0, 255, 0)), (8 + x, 8 + i * line_h))
+    screen.blit(panel, (20, HEIGHT - panel.get_height() - 20))
 
 # -------------------- BOOTING FUNCTIONS --------------------
 
 def boot():
-    """ Final boot message for dashboard initialization """
+    """ Final boot message for dashboard initialization - shown until the first values come in """
     screen.fill((0, 0, 0))
-    large_font = pygame.font.SysFont(None, 48)
+    large_font = get_font(48)
     draw_text_centered(screen, 'Booting dashboard...', large_font, HEIGHT // 2 - 20)
     draw_status_panel()
-    pygame.display.flip()
-    time.sleep(1.2)
 
 # -------------------- LOOP FUNCTIONS --------------------
 
 # AI
-def simulator(q, stop_event):
-    """ Simulator that puts fake OBD2 events into queue """
+def simulator(publish, stop_event):
+    """ Simulator that publishes fake OBD2 samples - publish is called with each Sample """
     speed = 0
     rpm = 0
     # additional fake values for box options
@@ -148,183 +361,255 @@ def simulator(q, stop_event):
     oil_temp = 85.0
     intake_temp = 30.0
     ambient_temp = 20.0
+    fuel_rate = 1.0  # L/h
     while not stop_event.is_set():
         speed = (speed + random.randint(0, 3)) % 121
         rpm = (rpm + random.randint(10, 200)) % 8001
-        ev_speed = {
-            'timestamp': time.time(),
-            'pid': '0D',
-            'command': 'speed',
-            'raw': {'A': int(speed) & 0xFF, 'B': None},
-            'value': float(speed),
-            'unit': 'kph',
-            'formatted': f"{speed:.0f}kph",
-        }
-        ev_rpm = {
-            'timestamp': time.time(),
-            'pid': '0C',
-            'command': 'rpm',
-            'raw': {'A': (rpm >> 8) & 0xFF, 'B': rpm & 0xFF},
-            'value': float(rpm),
-            'unit': 'rpm',
-            'formatted': f"{rpm:.0f}rpm",
-        }
-        try:
-            q.put_nowait(ev_speed)
-            q.put_nowait(ev_rpm)
-            # update additional simulated sensors
-            engine_time += 0.12
-            # small random walk for temps
-            oil_temp += random.uniform(-0.2, 0.5)
-            intake_temp += random.uniform(-0.3, 0.3)
-            ambient_temp += random.uniform(-0.1, 0.1)
-
-            ev_engine = {
-                'timestamp': time.time(),
-                'pid': '1F',
-                'command': 'engine_run_time',
-                'raw': {'A': int(engine_time) >> 8 & 0xFF, 'B': int(engine_time) & 0xFF},
-                'value': engine_time,
-                'unit': 's',
-                'formatted': f"{int(engine_time)}s",
-            }
-            ev_oil = {
-                'timestamp': time.time(),
-                'pid': '5C',
-                'command': 'oil_temp',
-                'raw': {'A': int(oil_temp + 40) & 0xFF, 'B': None},
-                'value': oil_temp,
-                'unit': '°C',
-                'formatted': f"{oil_temp:.1f}°C",
-            }
-            ev_intake = {
-                'timestamp': time.time(),
-                'pid': '0F',
-                'command': 'intake_air_temp',
-                'raw': {'A': int(intake_temp + 40) & 0xFF, 'B': None},
-                'value': intake_temp,
-                'unit': '°C',
-                'formatted': f"{intake_temp:.1f}°C",
-            }
-            ev_ambient = {
-                'timestamp': time.time(),
-                'pid': '46',
-                'command': 'ambient_air_temp',
-                'raw': {'A': int(ambient_temp + 40) & 0xFF, 'B': None},
-                'value': ambient_temp,
-                'unit': '°C',
-                'formatted': f"{ambient_temp:.1f}°C",
-            }
-            # push them as well
-            q.put_nowait(ev_engine)
-            q.put_nowait(ev_oil)
-            q.put_nowait(ev_intake)
-            q.put_nowait(ev_ambient)
-        except queue.Full:
-            pass
+        now = time.monotonic_ns()
+        publish(can.Sample(now, 0x0D, bytes((int(speed) & 0xFF,)), float(speed)))
+        publish(can.Sample(now, 0x0C, bytes(((rpm >> 8) & 0xFF, rpm & 0xFF)), float(rpm)))
+
+        # update additional simulated sensors
+        engine_time += 0.12
+        # small random walk for temps
+        oil_temp += random.uniform(-0.2, 0.5)
+        intake_temp += random.uniform(-0.3, 0.3)
+        ambient_temp += random.uniform(-0.1, 0.1)
+        fuel_rate = 0.8 + rpm / 8000 * 20
+
+        # push them as well
+        publish(can.Sample(now, 0x1F, bytes((int(engine_time) >> 8 & 0xFF, int(engine_time) & 0xFF)), engine_time))
+        publish(can.Sample(now, 0x5C, bytes((int(oil_temp + 40) & 0xFF,)), oil_temp))
+        publish(can.Sample(now, 0x0F, bytes((int(intake_temp + 40) & 0xFF,)), intake_temp))
+        publish(can.Sample(now, 0x46, bytes((int(ambient_temp + 40) & 0xFF,)), ambient_temp))
+        raw = int(fuel_rate * 20)
+        publish(can.Sample(now, 0x5E, bytes((raw >> 8 & 0xFF, raw & 0xFF)), fuel_rate))
         time.sleep(0.12)
 
-def pid_poller(mgr, stop_event):
-    """ Continuously request PIDs from the Arduino """
-
-    # Open csv to get full list of chosen PIDs
-    canCSV = "can.csv"
-    df = pd.read_csv(canCSV, index_col="pid")
-    pids_to_poll = [pid for pid in df.index if pd.notna(df.at[pid, "formula"]) and df.at[pid, "formula"] != ""]
-    current_index = 0
-    
-    time.sleep(1)  # wait for arduino to be ready
-    
-    # test connection
-    try:
-        mgr.send("PING")
-    except Exception:
-        return
-    
-    last_request_time = time.time()
-    poll_interval = 0.3  # seconds between requests - ai suggested
-    
-    # loop to send PID requests
-    while not stop_event.is_set():
-        current_time = time.time()
-        
-        # Send next PID request if enough time has passed
-        if current_time - last_request_time >= poll_interval:
-            if pids_to_poll:
-                pid = pids_to_poll[current_index]
-                try:
-                    # Send in format: "01 <PID>" (mode 01 = current data)
-                    mgr.send(f"01 {pid}")
-                except Exception:
-                    pass
-                current_index = (current_index + 1) % len(pids_to_poll)
-            last_request_time = current_time
-        
-        time.sleep(0.01)
+def replayer(recording, publish, stop_event, speed, start):
+    """ Feed a recorded drive back into the dashboard """
+    recording.replay(publish, stop_event, speed=speed, start=start)
+    logs.get_logger("app").info("Replay finished (%d samples)", len(recording))
 
 # -------------------- SETUP --------------------
 
-# initialize queue
-event_queue = queue.Queue(maxsize=2000)
+imported = time.monotonic_ns()
+parser = argparse.ArgumentParser(description="Digital dashboard")
+parser.add_argument("--port", action="append", metavar="PORT[=PID,...]",
+                    help="serial port to use instead of searching for Arduinos (e.g. from emulator.py) - repeat for more "
+                         "adapters, =0C,0D limits the PIDs that adapter polls")
+parser.add_argument("--record", metavar="DIR", help="save every sample to a recording in DIR")
+parser.add_argument("--replay", metavar="DIR", help="play back a recording instead of reading the Arduino")
+parser.add_argument("--capture", metavar="FILE", help="save the raw serial bytes to FILE for replaying with --replay-serial")
+parser.add_argument("--replay-serial", metavar="FILE", help="run the serial reader on a capture instead of the Arduino")
+parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier (0 = as fast as possible)")
+parser.add_argument("--start", type=float, default=0.0, help="seconds into the recording to start the replay")
+parser.add_argument("--asyncio", action="store_true", help="read, decode and poll in one asyncio event loop instead of threads")
+parser.add_argument("--latency", metavar="FILE", default="latency.json", help="where to write the latency report on exit")
+parser.add_argument("--batch", type=int, default=can.MAX_BATCH,
+                    help=f"PIDs asked for in one request (1-{can.MAX_BATCH}) - drops to 1 by itself after a few "
+                         "unanswered batches, 1 skips that wait with firmware without batch support")
+parser.add_argument("--pid-cache", metavar="FILE", default="supported_pids.json",
+                    help="where the PIDs each car supports are kept between runs")
+parser.add_argument("--rediscover", action="store_true", help="ask the car which PIDs it supports even if cached")
+parser.add_argument("--serve", metavar="[HOST:]PORT",
+                    help="broadcast the samples over TCP for other dashboards and loggers (0.0.0.0:PORT for the LAN)")
+parser.add_argument("--connect", metavar="HOST:PORT",
+                    help="show the samples another dashboard broadcasts instead of reading an Arduino")
+parser.add_argument("--ingest-process", action="store_true",
+                    help="read, poll and decode in a separate process that shares the latest values through shared memory")
+parser.add_argument("--layout", metavar="FILE", default=LAYOUT_PATH, help="gauge layout file (see layout.json)")
+parser.add_argument("--log", metavar="FILE", default="dashboard.log", help="rotating log file")
+parser.add_argument("--log-level", action="append", metavar="CATEGORY=LEVEL",
+                    help=f"log level per category ({', '.join(logs.CATEGORIES)}) e.g. pid=DEBUG to log every sample")
+args = parser.parse_args()
+
+# serial threads only queue log records - a background thread writes them, warnings also go to the console
+try:
+    logs.setup(args.log, levels=logs.parse_levels(args.log_level), console_level=logging.WARNING)
+except ValueError as e:
+    parser.error(str(e))
+
+# gauges and box options compiled once - samples get converted to display units as they come in, not per frame.
+# the metrics engine comes first so the layout can name the channels it derives
+metrics = MetricsEngine()
+try:
+    plan = load_layout(args.layout)
+except (OSError, ValueError, KeyError) as e:
+    parser.error(f"bad layout {args.layout}: {e}")
+
+# a recording that can't be written or read is the arguments' fault - say so now, not from pygame or the ingest process
+if args.record:
+    try:
+        check_new(args.record)
+    except OSError as e:
+        parser.error(f"can't record to {args.record}: {e}")
+recording = None
+if args.replay:
+    try:
+        recording = Recording(args.replay)
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"can't replay {args.replay}: {e}")
+
+# latest value per PID (in display units) shared by the reader/simulator and the render loop - with --ingest-process
+# the reading side is another process (see ingest.py), started now so it opens the ports while pygame loads
+ingest = None
+if args.ingest_process and not args.replay:
+    ingest = IngestProcess(args)
+    ingest.start()
+    store = ingest.store
+else:
+    store = TelemetryStore()
+
+# stage timestamps and per-PID latency histograms for samples read from serial, plus startup milestones
+tracer = LatencyTracer(started=_started)
+show_latency = False
+startup = tracer.startup
+startup.mark("imports", imported)
+
+# ring buffers behind the trend graphs - fed every sample in display units, or each frame's new values when the
+# samples are decoded in the ingest process. nothing is allocated (and numpy not loaded) until the first sample
+history = History([graph.pid for graph in plan.graphs])
+display_sinks = [store.publish]
+if ingest is None:
+    display_sinks.append(history.record)
+
+# everything a new sample goes to - the store (through the metrics too) and optionally the recorder and broadcast,
+# which the ingest process has when there is one
+pipeline = Pipeline(plan, display_sinks, metrics)
+if args.record and ingest is None:
+    try:
+        pipeline.record(args.record)
+    except OSError as e:
+        parser.error(f"can't record to {args.record}: {e}")
+if args.serve and ingest is None:
+    try:
+        pipeline.serve(args.serve)
+    except OSError as e:
+        parser.error(f"can't serve on {args.serve}: {e}")
+
+def take_over_ingest():
+    """ The ingest process found no adapters, so it records and serves nothing - the samples the dashboard makes
+    itself (the simulator) get recorded and served here instead """
+    log = logs.get_logger("app")
+    if args.record:
+        log.warning("Ingest process found no adapters - recording to %s from the dashboard", args.record)
+        try:
+            pipeline.record(args.record)
+        except OSError as e:
+            log.error("Can't record to %s: %s", args.record, e)
+    if args.serve:
+        log.warning("Ingest process found no adapters - serving on %s from the dashboard", args.serve)
+        try:
+            pipeline.serve(args.serve)
+        except OSError as e:
+            log.error("Can't serve on %s: %s", args.serve, e)
+
+publish = pipeline.publish
 
 # status checks for initalization
 status = {
     'arduino_detected': None,
     'serial_running': None,
-    'simulator_running': None}
-
-# check for arduino and serial connection
-port = can.find_arduino_port()
-mgr = None
-poll_stop = threading.Event()  # stop poller event
-poll_thread = None
-
-if port:
-    status['simulator_running'] = False
-    status['arduino_detected'] = True
-    # try to run and start serial manager
-    try:
-        mgr = can.SerialManager(port, event_queue=event_queue)
-        mgr.start()
+    'simulator_running': None,
+    'replay_running': None}
+
+# check for arduinos and serial connections - not needed when replaying
+replay_stop = threading.Event()  # stop replay event
+replay_thread = None
+connected = threading.Event()  # set once the adapters are found and open (or there are none)
+
+def connect():
+    """ Find the adapters and open them - runs while pygame starts up, each one then handshakes on its own poller """
+    if ingest is not None:
+        # the ingest process finds and opens the adapters - the store is ours again if it found none
+        state = ingest.wait_started()
+        if state == NO_ADAPTERS:
+            take_over_ingest()
+        else:
+            status['simulator_running'] = False
+            status['arduino_detected'] = True
+            status['serial_running'] = state == RUNNING
+            startup.mark("ports open")
+        connected.set()
+        return
+    if args.connect:
+        # another dashboard has the adapter - its broadcast is the only source
+        pipeline.connect(args.connect)
+        status['simulator_running'] = False
+        status['arduino_detected'] = True
         status['serial_running'] = True
-        # start polling thread
-        poll_stop.clear()
-        poll_thread = threading.Thread(target=pid_poller, args=(mgr, poll_stop), daemon=True)
-        poll_thread.start()
-    except Exception:
-        status['serial_running'] = False
+        connected.set()
+        return
+    ports = find_ports(args)
+    startup.mark("ports found")
+    if ports:
+        status['simulator_running'] = False
+        status['arduino_detected'] = True
+        # every adapter gets its own reader and poll schedule, all publishing into the same store
+        status['serial_running'] = bool(pipeline.open(ports, args, tracer))
+        startup.mark("ports open")
+    connected.set()
+
+connect_thread = None
+
+if args.replay:
+    status['arduino_detected'] = False
+    status['serial_running'] = False
+    status['simulator_running'] = False
+    status['replay_running'] = True
+    replay_thread = threading.Thread(target=replayer, args=(recording, publish, replay_stop, args.speed, args.start),
+                                     daemon=True)
+    replay_thread.start()
+    connected.set()
 else:
-    status['arduino_detected'] = None # set to none for simulation prompt later
+    # arduino detected stays None (checking) until connect() is done - no arduino means the simulation prompt
+    connect_thread = threading.Thread(target=connect, daemon=True)
+    connect_thread.start()
 
-# Pygame setup
+# Pygame setup - the slowest import, so it loads while the serial ports open
+import pygame
 pygame.init()
 # increase window size to fit extra gauges
 WIDTH, HEIGHT = 1200, 700
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
+screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
 clock = pygame.time.Clock()
+startup.mark("window")
 
 # simulation controls
 sim_stop = threading.Event() # stop simulator
 sim_thread = None
 prompt_for_test_mode = False
-if status['arduino_detected'] is None:
-    # no Arduino found; prompt user
-    prompt_for_test_mode = True
-    status['arduino_detected'] = False
-    status['serial_running'] = False
 
 # store last values for gauges
 last_values = {}
+last_seq = {}
 
-# box options to cycle through with SPACE
-# map user requested options to PIDs (1F engine run time, 5C oil temp, 0F intake air temp, 46 ambient air temp)
-box_options = [
-    {'label': 'Engine run time', 'pid': '1F'},
-    {'label': 'Oil temp', 'pid': '5C'},
-    {'label': 'Intake air temp', 'pid': '0F'},
-    {'label': 'Ambient air temp', 'pid': '46'},
-]
+# box options to cycle through with SPACE and gauges - both come from the layout file
+box_options = plan.box_options
 box_index = 0
+GAUGES = plan.gauges
+
+# trend graphs instead of the gauges on G - from the layout file too
+GRAPHS = plan.graphs
+show_graphs = False
+graph_span = 0
+graphs_drawn = {}
+
+# frame pacing - full rate while values are moving, idle rate once nothing has changed for ACTIVE_HOLD seconds
+FPS = 30
+IDLE_FPS = 5
+ACTIVE_HOLD = 0.5
+
+# boot message until the first values come in - gauges after BOOT_WAIT seconds even without them
+BOOT_WAIT = 1.2
+boot_started = None
+
+# what is on screen - only gauges/box whose shown value changed get redrawn
+gauges_shown = {}
+box_shown = None
+redraw_all = True
+last_change = 0.0
 
 # -------------------- MAIN LOOP --------------------
 
@@ -339,11 +624,16 @@ while running:
         if event.type == pygame.QUIT:
             running = False
 
-        # if exc ever, quit out
+        # window resized - gauge positions follow WIDTH/HEIGHT, cached faces get rebuilt
+        elif event.type == pygame.VIDEORESIZE:
+            WIDTH, HEIGHT = event.w, event.h
+            screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
+            clear_render_cache()
+            redraw_all = True
+
+        # if exc ever, quit out - through the cleanup below so recordings get flushed
         elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
             running = False
-            pygame.quit()
-            sys.exit()
 
         # test mode prompt handling
         elif event.type == pygame.KEYDOWN and prompt_for_test_mode:
@@ -353,82 +643,112 @@ while running:
                 status['simulator_running'] = True
                 prompt_for_test_mode = False
                 sim_stop.clear()
-                sim_thread = threading.Thread(target=simulator, args=(event_queue, sim_stop), daemon=True)
+                sim_thread = threading.Thread(target=simulator, args=(publish, sim_stop), daemon=True)
                 sim_thread.start()
 
-            # if n, quit
+            # if n, quit - through the cleanup below like ESC, so the ingest process and its table go too
             elif event.key == pygame.K_n:
-                pygame.quit()
-                sys.exit()
+                running = False
 
         # cycle box options on SPACE (only when not prompting)
         elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE and not prompt_for_test_mode:
             box_index = (box_index + 1) % len(box_options)
 
-    # draw UI
-    screen.fill((0, 0, 0))
-    draw_status_panel()
-
-    # Prompt for simulator mode if needed
-    if prompt_for_test_mode:
-        font = pygame.font.SysFont(None, 28)
-        draw_text_centered(screen, 'No Arduino found. Press Y to run test mode, N to quit.', font, HEIGHT // 3)
-
-    # Final step: boot message
-    if not booted and (status['serial_running'] or status['simulator_running']):
-        boot()
-        booted = True
+        # graphs instead of gauges on G, T for how far back they go
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_g and GRAPHS and not prompt_for_test_mode:
+            show_graphs = not show_graphs
+            redraw_all = True
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_t and show_graphs:
+            graph_span = (graph_span + 1) % len(GRAPH_SPANS)
+            redraw_all = True
+
+        # latency overlay on L
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_l and not prompt_for_test_mode:
+            show_latency = not show_latency
+            redraw_all = True
+
+    # no Arduino found; prompt user once the search is over
+    if status['arduino_detected'] is None and connected.is_set():
+        prompt_for_test_mode = True
+        status['arduino_detected'] = False
+        status['serial_running'] = False
 
-    # take incoming events from queue
-    while True:
-        try:
-            ev = event_queue.get_nowait() # get return item without blocking
-        except queue.Empty:
-            break
-        # store last value per pid
-        last_values[ev['pid']] = ev
-
-    if booted and (status['simulator_running'] or status['serial_running']): # show gauges in test mode OR regular mode
-        # clear splash screen before gauges
+    # consistent copy of the last value per pid - no matter how many samples came in since last frame
+    prev_seq = last_seq
+    last_values, last_seq = store.snapshot()
+    drained = time.monotonic_ns()
+    new_samples = [last_values[pid] for pid, seq in last_seq.items() if prev_seq.get(pid) != seq]
+    if ingest is not None:
+        # the graphs only get what each frame sees - samples coalesced in between never reach this process
+        for sample in new_samples:
+            history.record(sample)
+    if new_samples and not startup.reached("first sample"):
+        # when this loop first sees one - a replayed or broadcast sample's own ts is on another clock
+        startup.mark("first sample", drained)
+
+    # boot message until the first values are in - then straight to the gauges
+    data_running = status['simulator_running'] or status['serial_running'] or status['replay_running']
+    if not booted and data_running:
+        if boot_started is None:
+            boot_started = time.monotonic()
+        booted = bool(last_values) or time.monotonic() - boot_started > BOOT_WAIT
+
+    gauges_on = booted and data_running # show gauges in test, replay OR regular mode
+
+    # the overlay sits on top of the gauges - redraw everything under it while it is up
+    if redraw_all or not gauges_on or show_latency:
+        # draw UI
         screen.fill((0, 0, 0))
-
-        # draw info box
-        draw_box()
-
-        # small gauges positions
-        oil_pos = (int(WIDTH * 0.12), int(HEIGHT * 0.25))      # top-left
-        fuel_pos = (int(WIDTH * 0.12), int(HEIGHT * 0.75))     # bottom-left
-        volt_pos = (int(WIDTH * 0.88), int(HEIGHT * 0.25))     # top-right
-        coolant_pos = (int(WIDTH * 0.88), int(HEIGHT * 0.75))  # bottom-right
-
-        # main gauges positions
-        left_main = (int(WIDTH * 0.33), int(HEIGHT * 0.55))
-        right_main = (int(WIDTH * 0.67), int(HEIGHT * 0.55))
-
-        # read values (fall back to sensible defaults)
-        oil_val = last_values.get('0A', {}).get('value', 15)
-        fuel_val = last_values.get('2F', {}).get('value', 60)
-        volt_val = last_values.get('33', {}).get('value', 12)
-        coolant_val_c = last_values.get('05', {}).get('value', 20)
-        
-        # Convert coolant temp from Celsius to Fahrenheit
-        coolant_val = (coolant_val_c * 9/5) + 32
-
-        # draw small gauges (radius 70)
-        draw_gauge(oil_pos, 70, oil_val, 100, 'PSI')
-        draw_gauge(fuel_pos, 70, fuel_val, 100, '%')
-        draw_gauge(volt_pos, 70, volt_val, 16, 'Volts')
-        draw_gauge(coolant_pos, 70, coolant_val, 250, '°F')
-
-        # draw main gauges (radius 180)
-        speed_val_kph = last_values.get('0D', {}).get('value', 0)
-        speed_val = speed_val_kph * 0.621371  # Convert KM/H to MPH
-        rpm_val = last_values.get('0C', {}).get('value', 0)
-        draw_gauge(left_main, 180, speed_val, 125, 'MPH')
-        draw_gauge(right_main, 180, rpm_val, 8000, 'RPM')
-
-    pygame.display.flip()
-    clock.tick(30)
+        draw_status_panel()
+
+        # Prompt for simulator mode if needed
+        if prompt_for_test_mode:
+            draw_text_centered(screen, 'No Arduino found. Press Y to run test mode, N to quit.', get_font(28), HEIGHT // 3)
+
+        # Final step: boot message
+        if not booted and data_running:
+            boot()
+
+        if gauges_on:
+            # clear splash screen before gauges
+            screen.fill((0, 0, 0))
+
+            # draw info box and every gauge - or the graphs
+            if show_graphs:
+                draw_graphs(graphs_drawn)
+            else:
+                draw_box()
+                box_shown = (box_index, box_text())
+                draw_gauges(GAUGES, gauges_shown)
+            redraw_all = False
+            last_change = time.monotonic()
+
+        if show_latency:
+            draw_latency_overlay()
+
+        pygame.display.flip()
+        startup.mark("first frame")
+    elif show_graphs:
+        rects = draw_graphs(graphs_drawn, full=False)
+        if rects:
+            pygame.display.update(rects)
+            last_change = time.monotonic()
+    else:
+        # only what changed by at least its display resolution
+        rects = draw_gauges(GAUGES, gauges_shown, full=False, box_changed=(box_index, box_text()) != box_shown)
+        box_shown = (box_index, box_text())
+        if rects:
+            pygame.display.update(rects)
+            last_change = time.monotonic()
+
+    if gauges_on and last_values and not startup.reached("first needle"):
+        startup.mark("first needle")
+        logs.get_logger("app").info("Startup: %s", startup.summary())
+
+    tracer.displayed(new_samples, drained)
+    # full rate while connecting and booting too - the first values should go up as soon as they are in
+    booting = not booted and not prompt_for_test_mode
+    clock.tick(FPS if booting or time.monotonic() - last_change < ACTIVE_HOLD else IDLE_FPS)
 
 # -------------------- POST GAME --------------------
 
@@ -436,14 +756,19 @@ while running:
 if sim_thread and sim_thread.is_alive():
     sim_stop.set()
     sim_thread.join(timeout=1.0)
-if poll_thread and poll_thread.is_alive():
-    poll_stop.set()
-    poll_thread.join(timeout=1.0)
-if mgr:
-    try:
-        mgr.stop()
-    except Exception:
-        pass
+if replay_thread and replay_thread.is_alive():
+    replay_stop.set()
+    replay_thread.join(timeout=1.0)
+if connect_thread is not None:
+    connect_thread.join(timeout=6.0)  # quit while the ports were still opening
+pipeline.stop(store.source_stats())
+if ingest is not None:
+    table_stats = store.stats()
+    logs.get_logger("app").info("Ingest process exited with %s %s", ingest.stop(), table_stats)
+if args.latency and tracer.report()['pids']:
+    tracer.dump(args.latency)
+    print(f"Latency report written to {args.latency}")
+logs.shutdown()
 
 # quit game
 pygame.quit()
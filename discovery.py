@@ -0,0 +1,116 @@
+import os
+import json
+import threading
+import serial.tools.list_ports
+import can_communication as can
+from logs import get_logger
+
+_log = get_logger("poll")
+
+"""
+supported PID discovery
+
+PID 00 answers with a bitmask of which of PIDs 01-20 the car supports, its last bit says whether PID 20 (the mask for
+21-40) is supported, and so on up to 40 - asking for those once at startup means the poll list only has PIDs the car
+answers instead of paying the arduino's 1s CAN timeout for every one it doesn't
+
+results are cached per vehicle so later boots skip the discovery:
+    cache = SupportCache("supported_pids.json")
+    supported = cache.get(vehicle_key(port))
+
+the firmware can't read the VIN (mode 09 is a multi-frame answer), so a vehicle is the adapter it is wired to - the
+adapter's USB serial number when it has one, the port name otherwise
+"""
+
+def next_support_pid(pid, mask):
+    """ Support PID to ask after pid given its mask - None once the car says there are no more """
+    following = pid + 0x20
+    return following if mask & 1 and following in can.SUPPORT_PIDS else None
+
+def discover(query):
+    """ Ask for each support mask in turn with query(pid) -> mask or None - returns the supported PIDs, or None when
+    the car didn't answer PID 00 at all """
+    masks = {}
+    pid = 0x00
+    while pid is not None:
+        mask = query(pid)
+        if mask is None:
+            break
+        masks[pid] = mask
+        pid = next_support_pid(pid, mask)
+    return can.supported_from_masks(masks) if masks else None
+
+async def discover_async(query):
+    """ discover() for an async query e.g. AsyncSerialManager.request_support """
+    masks = {}
+    pid = 0x00
+    while pid is not None:
+        mask = await query(pid)
+        if mask is None:
+            break
+        masks[pid] = mask
+        pid = next_support_pid(pid, mask)
+    return can.supported_from_masks(masks) if masks else None
+
+def serial_query(mgr, timeout=1.5):
+    """ query(pid) for discover() over a running SerialManager - uses its response/support callbacks, so call it before
+    the poller takes them over """
+    answered = threading.Event()
+    result = {}
+
+    def on_support(pid, mask):
+        result[pid] = mask
+
+    def on_response(pid):
+        answered.set()
+
+    def query(pid):
+        result.clear()
+        answered.clear()
+        mgr.support_callback = on_support
+        mgr.response_callback = on_response
+        try:
+            mgr.send(f"01 {pid:02X}")
+            answered.wait(timeout)
+        finally:
+            mgr.support_callback = None
+            mgr.response_callback = None
+        return result.get(pid)
+    return query
+
+def vehicle_key(port):
+    """ Name to cache a vehicle's supported PIDs under - adapter serial number if the port has one """
+    for info in serial.tools.list_ports.comports():
+        if info.device == port and info.serial_number:
+            return f"usb:{info.serial_number}"
+    return port
+
+class SupportCache:
+    """ Supported PIDs per vehicle in a json file - {key: ["0C", "0D", ...]} """
+
+    def __init__(self, path="supported_pids.json"):
+        self.path = path
+        self._lock = threading.Lock()  # adapters discover at the same time
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except (OSError, ValueError) as e:
+            _log.warning("Ignoring supported PID cache %s: %s", path, e)
+            self._entries = {}
+
+    def get(self, key):
+        """ Cached supported PIDs for key or None """
+        with self._lock:
+            codes = self._entries.get(key)
+        return None if codes is None else {int(code, 16) for code in codes}
+
+    def put(self, key, supported):
+        """ Save the supported PIDs for key - written straight away so a crash doesn't lose them """
+        with self._lock:
+            self._entries[key] = [f"{pid:02X}" for pid in sorted(supported)]
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(tmp, self.path)
@@ -0,0 +1,379 @@
+import os
+import sys
+import math
+import time
+import random
+import select
+import threading
+import argparse
+import can_communication as can
+
+"""
+virtual arduino + ECU on a pseudo-terminal for testing the python side without a car (linux/mac only)
+
+speaks the same protocol as arduino-file.c++:
+    PING                 -> PONG
+    LED_ON / LED_OFF     -> LED turned ON / OFF
+    01 XX                -> PID: A [B] XX  after the ECU latency, or 'No response - timeout' after the CAN timeout
+    01 00 / 20 / 40      -> SUPPORTED: XX AABBCCDD  bitmask of the PIDs it answers (unsupported ones left out)
+    01 XX YY ...         -> BATCH: 41 XX A [B] YY A [B] ...  up to 6 PIDs, only the ones the car answers
+    anything else        -> Echo: ...
+
+run it on its own and point the dashboard/SerialManager at the port it prints, or use --load-test to hammer a
+SerialManager with it and see how many frames per second get through
+"""
+
+# -------------------- SIGNAL MODELS --------------------
+
+class Constant:
+    """ Signal that never changes """
+    def __init__(self, value):
+        self.value_now = value
+
+    def value(self, t):
+        return self.value_now
+
+class Sine:
+    """ Signal swinging between low and high every period seconds """
+    def __init__(self, low, high, period):
+        self.low, self.high, self.period = low, high, period
+
+    def value(self, t):
+        return self.low + (self.high - self.low) * (0.5 + 0.5 * math.sin(2 * math.pi * t / self.period))
+
+class Ramp:
+    """ Signal climbing from low to high every period seconds then starting over """
+    def __init__(self, low, high, period):
+        self.low, self.high, self.period = low, high, period
+
+    def value(self, t):
+        return self.low + (self.high - self.low) * ((t % self.period) / self.period)
+
+class RandomWalk:
+    """ Signal that wanders by up to step each time it is read, kept between low and high """
+    def __init__(self, start, step, low, high, seed=None):
+        self.current, self.step, self.low, self.high = start, step, low, high
+        self._rng = random.Random(seed)
+
+    def value(self, t):
+        self.current = min(max(self.current + self._rng.uniform(-self.step, self.step), self.low), self.high)
+        return self.current
+
+# what a drive roughly looks like - anything not listed sits at a constant
+DEFAULT_SIGNALS = {
+    0x04: Sine(15, 80, 7),            # engine load
+    0x05: Ramp(20, 95, 600),          # coolant warming up
+    0x0A: Sine(250, 400, 11),         # fuel pressure
+    0x0B: Sine(20, 90, 5),            # intake manifold pressure
+    0x0C: Sine(800, 6500, 9),         # rpm
+    0x0D: Sine(0, 120, 30),           # speed
+    0x0F: RandomWalk(30, 0.3, 10, 60),
+    0x11: Sine(0, 90, 4),             # throttle
+    0x1F: Ramp(0, 65535, 65535),      # engine run time
+    0x2F: Ramp(100, 0, 3600),         # fuel level
+    0x42: RandomWalk(13.8, 0.05, 11.5, 14.5),
+    0x46: RandomWalk(20, 0.1, -10, 40),
+    0x5C: Ramp(20, 110, 900),         # oil warming up
+    0x5E: Sine(0.5, 25, 13),          # fuel rate
+}
+
+# -------------------- ENCODING --------------------
+
+class _Encoder:
+    """ Turn a value back into the raw bytes the ECU would send using the PID's lookup table """
+    def __init__(self, decoder):
+        import numpy as np
+        self.uses_b = decoder.uses_b
+        self._order = np.argsort(decoder.table, kind="stable")
+        self._sorted = decoder.table[self._order]
+
+    def __call__(self, value):
+        import numpy as np
+        i = int(np.searchsorted(self._sorted, value))
+        # pick whichever neighbour is closer
+        if i >= len(self._sorted) or (i > 0 and value - self._sorted[i - 1] < self._sorted[i] - value):
+            i -= 1
+        raw = int(self._order[i])
+        if self.uses_b:
+            return raw >> 8, raw & 0xFF
+        return raw, 0
+
+# -------------------- EMULATOR --------------------
+
+class VirtualArduino:
+    """ Arduino firmware + ECU emulated behind a pseudo-terminal """
+
+    def __init__(self, latency=0.01, jitter=0.0, drop_rate=0.0, unsupported=(), can_timeout=1.0,
+                 signals=None, flood_rate=0, seed=None, max_batch=can.MAX_BATCH):
+        """ latency/jitter are the ECU response time in seconds, drop_rate is the chance a request gets no answer,
+        unsupported PIDs never answer, flood_rate sends that many unrequested PID frames per second, max_batch is how
+        many PIDs one request can ask for (1 is firmware from before batching, which ignores longer requests) """
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.unsupported = set(unsupported)
+        self.can_timeout = can_timeout
+        self.signals = dict(DEFAULT_SIGNALS)
+        if signals:
+            self.signals.update(signals)
+        self.flood_rate = flood_rate
+        self.max_batch = max_batch
+
+        self._rng = random.Random(seed)
+        self._encoders = {pid: _Encoder(dec) for pid, dec in can.DECODERS.items()}
+        self._master = None
+        self._slave = None
+        self.port = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self.led = False
+
+        # one request at a time like the firmware - ([pid codes], due time, [codes the car answers])
+        self._pending = None
+
+        # counters
+        self.requests = 0
+        self.responses = 0
+        self.timeouts = 0
+        self.flooded = 0
+
+    def start(self):
+        """ Open the pseudo-terminal, start answering on it and return the port name to connect to """
+        import tty
+        self._master, self._slave = os.openpty()
+        # raw mode so nothing gets echoed or translated, and keep the slave open so reads never hit EOF
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._stop_event.clear()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        """ Stop answering and close the pseudo-terminal """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    def _write(self, text):
+        os.write(self._master, text.encode())
+
+    def _loop(self):
+        """ Read commands, answer pending requests when they are due and flood if asked to """
+        self._write("Arduino Ready\r\nCAN BUS Shield initialized\r\n")
+        partial = b""
+        flood_sent = 0
+        flood_pids = [pid for pid in self._encoders if pid not in self.unsupported]
+
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            timeout = 0.05
+            if self._pending:
+                timeout = min(timeout, max(self._pending[1] - now, 0))
+            if self.flood_rate:
+                timeout = min(timeout, 0.001)
+
+            try:
+                ready, _, _ = select.select([self._master], [], [], timeout)
+                if ready:
+                    partial += os.read(self._master, 4096)
+            except OSError:
+                break
+
+            # handle complete commands
+            *lines, partial = partial.split(b"\n")
+            for line in lines:
+                self._command(line.decode(errors="replace").strip().upper())
+
+            now = time.monotonic()
+            if self._pending and now >= self._pending[1]:
+                self._answer(now)
+
+            # unrequested frames to push the reader as hard as flood_rate says
+            if self.flood_rate and flood_pids:
+                owed = int((now - self._started) * self.flood_rate) - flood_sent
+                if owed > 0:
+                    owed = min(owed, 2000)
+                    frames = "".join(self._frame(flood_pids[(flood_sent + i) % len(flood_pids)], now)
+                                     for i in range(owed))
+                    self._write(frames)
+                    flood_sent += owed
+                    self.flooded += owed
+
+    def _command(self, command):
+        """ Same command handling as processCommand() in the firmware """
+        if command == "LED_ON":
+            self.led = True
+            self._write("LED turned ON\r\n")
+        elif command == "LED_OFF":
+            self.led = False
+            self._write("LED turned OFF\r\n")
+        elif command == "PING":
+            self._write("PONG\r\n")
+        elif len(command) >= 5:
+            self._request(command)
+        elif command:
+            self._write(f"Echo: {command}\r\n")
+
+    def _request(self, command):
+        """ Same as handlePIDRequest() - a new request replaces any pending one """
+        mode, *pids = command.split(" ")
+        if not pids or len(pids) > self.max_batch or len(mode) != 2 or any(len(pid) != 2 for pid in pids):
+            return
+        try:
+            pid_nums = [int(pid, 16) for pid in pids]
+        except ValueError:
+            return
+        self.requests += 1
+
+        # the car answers what it supports after the ECU latency - nothing at all and the arduino times out
+        supported = set(self._encoders)
+        if len(pids) == 1:
+            supported.update(self._support_masks())
+        answered = [pid for pid, num in zip(pids, pid_nums)
+                    if mode == "01" and num in supported and num not in self.unsupported]
+        if answered and self._rng.random() >= self.drop_rate:
+            delay = max(self.latency + self._rng.uniform(-self.jitter, self.jitter), 0)
+        else:
+            answered = []
+            delay = self.can_timeout
+        self._pending = (pids, time.monotonic() + delay, answered)
+
+    def _answer(self, now):
+        """ Send the response (or timeout) for the pending request """
+        pids, _, answered = self._pending
+        self._pending = None
+        if not answered:
+            self.timeouts += 1
+            self._write("No response - timeout\r\n")
+            return
+        self.responses += 1
+        if len(pids) > 1:
+            self._write(self._batch_frame(answered, now))
+            return
+        pid_num = int(pids[0], 16)
+        if pid_num in can.SUPPORT_PIDS:
+            self._write(f"SUPPORTED: {pids[0]} {self._support_masks()[pid_num]:08X}\r\n")
+        else:
+            self._write(self._frame(pid_num, now, pids[0]))
+
+    def _batch_frame(self, codes, now):
+        """ 'BATCH: 41 XX A [B] ...' like the firmware prints a multi-PID answer - two hex digits per byte """
+        data = [0x41]
+        for code in codes:
+            pid_num = int(code, 16)
+            signal = self.signals.get(pid_num)
+            A, B = self._encoders[pid_num](signal.value(now - self._started) if signal else 0.0)
+            data += (pid_num, A, B) if self._encoders[pid_num].uses_b else (pid_num, A)
+        return "BATCH: " + " ".join(f"{byte:02X}" for byte in data) + "\r\n"
+
+    def _support_masks(self):
+        """ {support pid: mask} for the PIDs this car answers - a support PID is only there if something after it is """
+        answered = set(self._encoders) - self.unsupported
+        masks = {}
+        for base in reversed(can.SUPPORT_PIDS):
+            mask = 0
+            for bit in range(1, 33):
+                if base + bit in answered or base + bit in masks:
+                    mask |= 1 << (32 - bit)
+            if mask or base == 0x00:
+                masks[base] = mask
+        return masks
+
+    def _frame(self, pid_num, now, code=None):
+        """ 'PID: A [B] XX' exactly how the firmware prints it - hex without padding, B left off when it is 0 """
+        signal = self.signals.get(pid_num)
+        value = signal.value(now - self._started) if signal else 0.0
+        A, B = self._encoders[pid_num](value)
+        code = code or can.PID_TABLE[pid_num].code
+        if B > 0 or code in ("0C", "1F"):
+            return f"PID: {A:X} {B:X} {code}\r\n"
+        return f"PID: {A:X} {code}\r\n"
+
+# -------------------- LOAD TEST --------------------
+
+def load_test(emulator, seconds, poll=True, batch=1):
+    """ Run a SerialManager against the emulator and report how many samples per second got decoded - batch PIDs
+    per request """
+    from scheduler import PIDScheduler
+
+    received = [0]
+    def count(sample):
+        received[0] += 1
+
+    mgr = can.SerialManager(emulator.port, event_callback=count)
+    stop = threading.Event()
+    poller = None
+
+    mgr.start()
+    if poll:
+        # every PID as fast as it answers
+        scheduler = PIDScheduler(list(can.DECODERS), intervals={pid: 0.0 for pid in can.DECODERS})
+        mgr.response_callback = scheduler.on_response
+        mgr.batch_callback = scheduler.on_batch
+        poller = threading.Thread(target=scheduler.run,
+                                  args=(lambda pids: mgr.send(can.request_command(pids)), stop, batch),
+                                  daemon=True)
+        poller.start()
+
+    began = time.monotonic()
+    time.sleep(seconds)
+    elapsed = time.monotonic() - began
+    stop.set()
+    if poller:
+        poller.join(timeout=2.0)
+    mgr.stop()
+
+    return {
+        "seconds": elapsed,
+        "samples": received[0],
+        "samples_per_second": received[0] / elapsed,
+        "requests": emulator.requests,
+        "responses": emulator.responses,
+        "timeouts": emulator.timeouts,
+        "flooded": emulator.flooded,
+        "dropped_events": mgr.dropped_events,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Virtual Arduino/ECU on a pseudo-terminal")
+    parser.add_argument("--latency", type=float, default=0.01, help="ECU response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- added to the latency")
+    parser.add_argument("--drop", type=float, default=0.0, help="chance a request never gets an answer (0-1)")
+    parser.add_argument("--unsupported", default="", help="comma separated PIDs the car doesn't answer e.g. 32,5E")
+    parser.add_argument("--flood", type=int, default=0, help="unrequested PID frames per second")
+    parser.add_argument("--load-test", type=float, metavar="SECONDS", help="run a SerialManager against it and report")
+    parser.add_argument("--batch", type=int, default=1, help=f"PIDs per request in the load test (up to {can.MAX_BATCH})")
+    parser.add_argument("--no-poll", action="store_true", help="load test without sending requests (use with --flood)")
+    parser.add_argument("--no-batch", action="store_true",
+                        help="act like firmware from before batching - multi-PID requests get no answer")
+    args = parser.parse_args()
+
+    emu = VirtualArduino(latency=args.latency, jitter=args.jitter, drop_rate=args.drop,
+                         unsupported=[int(p, 16) for p in args.unsupported.split(",") if p.strip()],
+                         flood_rate=args.flood, max_batch=1 if args.no_batch else can.MAX_BATCH)
+    port = emu.start()
+
+    if args.load_test:
+        for key, value in load_test(emu, args.load_test, poll=not args.no_poll, batch=args.batch).items():
+            print(f"{key:>20}: {value:.1f}" if isinstance(value, float) else f"{key:>20}: {value}")
+        emu.stop()
+        sys.exit(0)
+
+    print(f"Virtual Arduino on {port} - Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emu.stop()
@@ -0,0 +1,229 @@
+import threading
+from bisect import bisect_left
+
+"""
+value history for the trend graphs
+
+every graphed PID gets a preallocated numpy ring buffer of (ts, value) - appending is two stores, nothing grows and
+the oldest values are overwritten once it is full. history.record is a sample sink like the store's publish
+
+a graph never draws the raw samples - an hour of 10Hz data is 36000 of them. downsample() cuts the time window into
+one bucket per pixel column first:
+    minmax  lowest and highest value in each column - an exact envelope, spikes are never lost
+    lttb    largest-triangle-three-buckets - one point per column that keeps the shape of the line
+so what gets drawn depends on the graph's width, not on how many samples are behind it. lttb picks its points one
+column after another, so an LttbCache keeps the ones that can't change between draws and only the newest columns
+are picked again
+
+the buffers and the downsampling search the timestamps, so they only go forward per PID - a sample older than the
+newest one (a second adapter, a merged replay) is recorded at the newest ts
+
+a PID's buffer is only made when its first sample comes in, so numpy isn't imported (and nothing is allocated)
+before the window is up
+"""
+
+DEFAULT_SECONDS = 3600
+DEFAULT_RATE = 25  # samples per second per PID the buffers are sized for
+
+class RingBuffer:
+    """ Preallocated (ts, value) ring for one PID """
+
+    def __init__(self, capacity):
+        import numpy as np
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, np.int64)
+        self.values = np.zeros(capacity, np.float64)
+        self.count = 0  # appended so far - also tells a graph whether anything new came in
+        self._last = None  # newest ts
+
+    def append(self, ts, value):
+        """ Add a value - ts before the newest are moved up to it so the buffer stays sorted """
+        if self._last is not None and ts < self._last:
+            ts = self._last
+        self._last = ts
+        i = self.count % self.capacity
+        self.ts[i] = ts
+        self.values[i] = value
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def newest(self):
+        return int(self.ts[(self.count - 1) % self.capacity]) if self.count else None
+
+    def since(self, start):
+        """ (ts, values) from start on, oldest first - views when they don't wrap, a copy of just that part if they do """
+        import numpy as np
+        if self.count <= self.capacity:
+            n = self.count
+            i = np.searchsorted(self.ts[:n], start)
+            return self.ts[i:n], self.values[i:n]
+        split = self.count % self.capacity
+        if split == 0:
+            i = np.searchsorted(self.ts, start)
+            return self.ts[i:], self.values[i:]
+        # oldest part is [split:], newest [:split]
+        i = np.searchsorted(self.ts[:split], start)
+        if i > 0:
+            return self.ts[i:split], self.values[i:split]
+        j = split + np.searchsorted(self.ts[split:], start)
+        return np.concatenate((self.ts[j:], self.ts[:split])), np.concatenate((self.values[j:], self.values[:split]))
+
+class History:
+    """ Ring buffer per graphed PID - record() is a sample sink, window() what a graph draws from """
+
+    def __init__(self, pids, seconds=DEFAULT_SECONDS, rate=DEFAULT_RATE):
+        """ buffers hold seconds of history at rate samples per second - PIDs polled faster keep less time. each is
+        made on its PID's first sample """
+        self.seconds = seconds
+        self.pids = frozenset(pids)
+        self.capacity = int(seconds * rate)
+        self.buffers = {}
+        self._lock = threading.Lock()  # several adapters can feed it while the render loop reads
+
+    def record(self, sample):
+        """ Sink for samples in display units - ignores PIDs nothing graphs """
+        pid = sample.pid
+        if pid not in self.pids:
+            return
+        with self._lock:
+            buf = self.buffers.get(pid)
+            if buf is None:
+                buf = self.buffers[pid] = RingBuffer(self.capacity)
+            buf.append(sample.ts, sample.value)
+
+    def count(self, pid):
+        """ Samples recorded for pid so far """
+        with self._lock:
+            buf = self.buffers.get(pid)
+            return buf.count if buf is not None else 0
+
+    def newest(self):
+        """ ts of the newest sample in any buffer - graphs end there so a replay shows its own time """
+        with self._lock:
+            times = [buf.newest for buf in self.buffers.values() if buf.count]
+        return max(times) if times else None
+
+    def window(self, pid, start):
+        """ (ts, values) of pid from start on """
+        with self._lock:
+            buf = self.buffers.get(pid)
+            if buf is None:
+                import numpy as np
+                return np.zeros(0, np.int64), np.zeros(0)
+            ts, values = buf.since(start)
+            # the writer may wrap over a view while it is being drawn
+            return ts.copy(), values.copy()
+
+def minmax(ts, values, start, end, width):
+    """ Envelope of the samples in [start, end) over width columns - (column, low, high) for columns with samples """
+    import numpy as np
+    edges = np.linspace(start, end, width + 1).astype(np.int64)
+    bounds = np.searchsorted(ts, edges)
+    first, last = bounds[0], bounds[-1]
+    starts = bounds[:-1]
+    filled = bounds[1:] > starts
+    if not filled.any():
+        empty = np.zeros(0)
+        return empty, empty, empty
+    # each filled column runs up to the next filled one - the empty ones in between hold nothing
+    offsets = starts[filled] - first
+    chunk = values[first:last]
+    return np.nonzero(filled)[0], np.minimum.reduceat(chunk, offsets), np.maximum.reduceat(chunk, offsets)
+
+class LttbCache:
+    """ lttb points one graph picked for good - kept between draws so only the newest columns are picked again """
+
+    def __init__(self):
+        self.key = None  # (ns per column, width) they were picked for
+        self.done = None  # columns before this one (counted from ts 0) are picked
+        self.ts = []     # their points, oldest first
+        self.values = []
+
+    def reset(self, key):
+        self.key = key
+        self.done = None
+        self.ts.clear()
+        self.values.clear()
+
+def lttb(ts, values, start, end, width, cache=None):
+    """ Largest-triangle-three-buckets over the samples in [start, end) - (column, value, value) for one point per
+    column with samples, so it draws like minmax
+
+    columns sit on multiples of their width in ns so they stay put as the window moves - a column's point depends on
+    the point before it and the mean of the next column, so once the next column is full it can't change and goes in
+    cache. the first draw picks every column, later ones just the last two and any new ones """
+    import numpy as np
+    i, j = np.searchsorted(ts, (start, end))
+    ts, values = ts[i:j], values[i:j]
+    scale = width / (end - start)
+    if len(ts) <= width:
+        return (ts - start) * scale, values, values
+
+    step = max((end - start) // width, 1)
+    if cache is None:
+        cache = LttbCache()
+    if cache.key != (step, width) or (cache.done is not None and int(ts[-1]) < cache.done * step):
+        # other span or width, or the samples went back in time (a replay started over)
+        cache.reset((step, width))
+
+    # the columns not picked for good yet
+    first = 0 if cache.done is None else int(np.searchsorted(ts, cache.done * step))
+    t, y = ts[first:], values[first:]
+    x = (t - start).astype(np.float64)
+    columns = t // step
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(columns)) + 1))
+    stops = np.append(starts[1:], len(t))
+    # average of each column - the third corner of the triangle for the column before it
+    sizes = stops - starts
+    means_x = np.add.reduceat(x, starts) / sizes
+    means_y = np.add.reduceat(y, starts) / sizes
+
+    # the first point of all is where the first triangle starts
+    ax, ay = (cache.ts[-1] - start, cache.values[-1]) if cache.ts else (x[0], y[0])
+    m = len(starts)
+    picked = np.empty(m, np.int64)
+    for b in range(m):
+        lo, hi = starts[b], stops[b]
+        cx, cy = (means_x[b + 1], means_y[b + 1]) if b + 1 < m else (x[-1], y[-1])
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        a = lo + int(area.argmax())
+        picked[b] = a
+        ax, ay = x[a], y[a]
+
+    # the last column can still fill, so it and the one before stay open
+    final = max(m - 2, 0)
+    if final:
+        cache.ts.extend((t[picked[:final]]).tolist())
+        cache.values.extend(y[picked[:final]].tolist())
+        cache.done = int(columns[starts[final]])
+    # columns that scrolled out of the window are gone for good
+    old = bisect_left(cache.ts, start)
+    if old:
+        del cache.ts[:old]
+        del cache.values[:old]
+
+    out_ts = np.concatenate((np.array(cache.ts, np.int64), t[picked[final:]], t[-1:]))
+    out_values = np.concatenate((np.array(cache.values, np.float64), y[picked[final:]], y[-1:]))
+    return (out_ts - start) * scale, out_values, out_values
+
+DOWNSAMPLERS = {"minmax": minmax, "lttb": lttb}
+
+def downsample(ts, values, start, end, width, method="minmax", cache=None):
+    """ (column, low, high) to draw the samples in [start, end) across width pixel columns - cache is the graph's
+    LttbCache when it draws with lttb """
+    if method == "lttb":
+        return lttb(ts, values, start, end, width, cache)
+    return DOWNSAMPLERS[method](ts, values, start, end, width)
+
+def plot_points(columns, lows, highs, rect, low, high):
+    """ Downsampled values -> pixel points (tops, bottoms) inside rect (x, y, w, h) for values between low and high """
+    import numpy as np
+    x, y, w, h = rect
+    scale = h / (high - low) if high > low else 0.0
+    xs = x + columns
+    tops = y + h - np.clip((highs - low) * scale, 0, h)
+    bottoms = y + h - np.clip((lows - low) * scale, 0, h)
+    return np.column_stack((xs, tops)).tolist(), np.column_stack((xs, bottoms)).tolist()
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import subprocess
+from telemetry import SharedTelemetryStore
+import logs
+
+"""
+serial ingest in its own process
+
+with --ingest-process the dashboard only renders - a child python process finds and polls the adapters, decodes,
+works out the metrics, records and broadcasts, and writes the latest value per PID into a SharedTelemetryStore the
+render loop reads each frame. the two never share a GIL, so a slow frame can't hold up a serial read and a burst of
+decoding can't make a frame late, and each side gets its own core
+
+the child is started as `python ingest.py TABLE OPTIONS` (OPTIONS is the dashboard's arguments as json) and runs until
+its stdin is closed - so it also goes away if the dashboard dies. how far it got is in the table's state:
+    STARTING      looking for and opening the adapters
+    RUNNING       polling at least one adapter
+    NO_ADAPTERS   nothing to poll - the table is the dashboard's again (e.g. for the simulator)
+    NOT_OPENED    adapters found but none of them opened
+    STOPPED       done
+
+it logs to its own file next to the dashboard's (dashboard-ingest.log) and writes the request/response side of the
+latency report to latency-ingest.json - the dashboard's latency.json has the decode/drain/render side
+"""
+
+STARTING, RUNNING, NO_ADAPTERS, NOT_OPENED, STOPPED = range(5)
+
+# dashboard arguments the child needs
+OPTIONS = ("port", "record", "capture", "replay_serial", "speed", "asyncio", "latency", "batch", "pid_cache",
+           "rediscover", "layout", "log", "log_level", "serve", "connect")
+
+def sibling(path, suffix="ingest"):
+    """ 'dashboard.log' -> 'dashboard-ingest.log' """
+    base, ext = os.path.splitext(path)
+    return f"{base}-{suffix}{ext}"
+
+class IngestProcess:
+    """ Dashboard side of the ingest process - owns the shared table and the child """
+
+    def __init__(self, options):
+        """ options is the dashboard's argparse namespace """
+        self.options = {name: getattr(options, name, None) for name in OPTIONS}
+        self.store = SharedTelemetryStore.create()
+        self.process = None
+
+    def start(self):
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.process = subprocess.Popen([sys.executable, os.path.join(here, "ingest.py"), self.store.name,
+                                         json.dumps(self.options)], stdin=subprocess.PIPE)
+
+    def wait_started(self, timeout=30.0):
+        """ Wait until the child has opened its adapters (or given up) - returns its state """
+        deadline = time.monotonic() + timeout
+        while self.store.state == STARTING and self.process.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        state = self.store.state
+        return NOT_OPENED if state == STARTING else state
+
+    def stop(self, timeout=5.0):
+        """ Ask the child to stop, wait for it and remove the table - returns its exit code """
+        code = None
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                code = self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                code = self.process.wait()
+        self.store.close()
+        return code
+
+def run(store, options, stop_event):
+    """ Everything the dashboard does with a sample, publishing into store instead of an in-process TelemetryStore """
+    from latency import LatencyTracer
+    from layout import load_layout
+    from metrics import MetricsEngine
+    from pipeline import Pipeline, find_ports
+    log = logs.get_logger("app")
+
+    tracer = LatencyTracer()
+    metrics = MetricsEngine()  # registers the derived channels the layout can name
+    pipeline = Pipeline(load_layout(options.layout), [store.publish], metrics)
+    ports = [] if options.connect else find_ports(options)
+    if not options.connect and not ports:
+        # the dashboard records and serves the samples it makes itself (the simulator)
+        store.state = NO_ADAPTERS
+        return
+
+    # before the sources start so the first samples are in the recording too
+    if options.record:
+        try:
+            pipeline.record(options.record)
+        except OSError as e:
+            log.error("Can't record to %s: %s", options.record, e)
+    if options.serve:
+        try:
+            pipeline.serve(options.serve)
+        except OSError as e:
+            log.error("Can't serve on %s: %s", options.serve, e)
+    if options.connect:
+        pipeline.connect(options.connect)
+    else:
+        pipeline.open(ports, options, tracer)
+    sources = pipeline.sources
+    store.state = RUNNING if sources else NOT_OPENED
+    if sources:
+        log.info("Ingest process polling %s", ", ".join(source.name for source in sources))
+        stop_event.wait()
+
+    pipeline.stop(store.source_stats())
+    if options.latency and tracer.report()['pids']:
+        tracer.dump(sibling(options.latency))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dashboard serial ingest - started by dashboard.py --ingest-process")
+    parser.add_argument("table", help="shared memory name of the telemetry table")
+    parser.add_argument("options", help="dashboard arguments as json")
+    args = parser.parse_args(argv)
+    options = argparse.Namespace(**json.loads(args.options))
+
+    logs.setup(sibling(options.log) if options.log else None, levels=logs.parse_levels(options.log_level),
+               console_level=logging.WARNING)
+    store = SharedTelemetryStore.attach(args.table)
+    stop_event = threading.Event()
+
+    def ingest():
+        try:
+            run(store, options, stop_event)
+        except Exception:
+            logs.get_logger("app").exception("Ingest process failed")
+            if store.state == STARTING:
+                store.state = NOT_OPENED
+        if store.state != NO_ADAPTERS:
+            store.state = STOPPED
+    worker = threading.Thread(target=ingest)
+    worker.start()
+
+    # the dashboard closes our stdin to stop us - or dies, which does the same
+    sys.stdin.buffer.read()
+    stop_event.set()
+    worker.join()
+    store.close()
+    logs.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import json
+import math
+import time
+import threading
+
+"""
+sensor-to-pixel latency tracing
+
+every traced sample carries monotonic timestamps for each stage it went through:
+    sent       poller wrote '01 XX' to the arduino
+    rx         reader got the bytes of the response
+    decoded    reader turned it into a Sample (sample.ts)
+    drained    render loop picked it up in its snapshot
+    displayed  pygame.display.flip() put it on screen
+
+and the time between stages goes into a histogram per PID:
+    rtt        sent -> rx        request to response round trip
+    decode     rx -> decoded
+    drain      decoded -> drained  how long it sat in the store
+    render     drained -> displayed
+    total      sent (or rx when nothing was requested) -> displayed
+
+startup milestones (imports done, window open, adapter handshake, first needle...) go in a StartupTimer as time since
+the process started
+"""
+
+STAGES = ("rtt", "decode", "drain", "render", "total")
+
+class StartupTimer:
+    """ When each startup milestone was first reached - ms since started, in the order they happened """
+
+    def __init__(self, started=None):
+        self.started = time.monotonic_ns() if started is None else started
+        self._marks = {}
+        self._lock = threading.Lock()  # adapters mark their handshake from their own threads
+
+    def mark(self, name, at=None):
+        """ Record name at monotonic ns at (default now) - only the first time it is reached counts """
+        at = time.monotonic_ns() if at is None else at
+        with self._lock:
+            self._marks.setdefault(name, at)
+
+    def reached(self, name):
+        return name in self._marks
+
+    def report(self):
+        """ {milestone: ms since started} sorted by time """
+        with self._lock:
+            marks = sorted(self._marks.items(), key=lambda item: item[1])
+        return {name: round((at - self.started) / 1e6, 1) for name, at in marks}
+
+    def summary(self):
+        """ One line for the log e.g. 'imports 210ms, window 260ms, ...' """
+        return ", ".join(f"{name} {ms:.0f}ms" for name, ms in self.report().items())
+
+class Histogram:
+    """ Log-bucketed latency histogram - constant time add, percentiles to within one bucket (~9%) """
+
+    BUCKETS_PER_OCTAVE = 8
+    MAX_BUCKET = 8 * 40  # 1us to ~12 days
+
+    def __init__(self):
+        self.counts = [0] * (self.MAX_BUCKET + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns):
+        """ Add one latency in nanoseconds """
+        us = ns / 1000
+        bucket = 0 if us <= 1 else min(int(math.log2(us) * self.BUCKETS_PER_OCTAVE) + 1, self.MAX_BUCKET)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p):
+        """ Latency in ms that p percent of the values are at or below (upper edge of its bucket) """
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return min(2 ** (bucket / self.BUCKETS_PER_OCTAVE) / 1000, self.max / 1e6)
+        return self.max / 1e6
+
+    def summary(self):
+        """ count, mean, p50/p95/p99 and max in ms """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count / 1e6 if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max / 1e6,
+        }
+
+class _PIDTrace:
+    """ Histograms and counters for one PID """
+    __slots__ = ("stages", "requests", "responses", "timeouts", "unsolicited")
+
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.requests = 0
+        self.responses = 0
+        self.timeouts = 0
+        self.unsolicited = 0  # frames that arrived with no request pending for them
+
+class LatencyTracer:
+    """ Collect stage timestamps from the poller, reader and render loop into per-PID histograms
+
+    request() is called by the poller, response() by SerialManager, displayed() by the render loop - all thread safe
+    """
+
+    def __init__(self, started=None):
+        """ started is when the process started (monotonic ns) for the startup milestones """
+        self._lock = threading.Lock()
+        self._pids = {}
+        self._pending = {}  # source -> ({pids}, sent ns) - each arduino handles one request (or batch) at a time
+        self.frames = Histogram()  # flip to flip - for frame pacing
+        self._last_flip = None
+        self.started = time.monotonic_ns()
+        self.startup = StartupTimer(started)
+
+    def _trace(self, pid):
+        """ Histograms for pid - call with _lock held """
+        trace = self._pids.get(pid)
+        if trace is None:
+            trace = self._pids[pid] = _PIDTrace()
+        return trace
+
+    def request(self, pids, now=None, source=None):
+        """ A request for a pid (or a batch of them) was just written to the arduino on source """
+        if isinstance(pids, int):
+            pids = (pids,)
+        now = time.monotonic_ns() if now is None else now
+        with self._lock:
+            pending = self._pending.get(source)
+            if pending is not None:
+                # never answered at all - not even a timeout line
+                for pid in pending[0]:
+                    self._trace(pid).timeouts += 1
+            for pid in pids:
+                self._trace(pid).requests += 1
+            self._pending[source] = (set(pids), now)
+
+    def response(self, pid, rx, source=None):
+        """ pid answered (or None for a timeout line) on source with its bytes read at rx -
+        returns the sent time or None """
+        with self._lock:
+            pending = self._pending.get(source)
+            if pid is None:
+                if pending is not None:
+                    for missed in pending[0]:
+                        self._trace(missed).timeouts += 1
+                    del self._pending[source]
+                return None
+
+            trace = self._trace(pid)
+            if pending is None or pid not in pending[0]:
+                trace.unsolicited += 1
+                return None
+            pending[0].discard(pid)
+            if not pending[0]:
+                del self._pending[source]
+            trace.responses += 1
+            trace.stages["rtt"].add(rx - pending[1])
+            return pending[1]
+
+    def batch_response(self, pids, rx, source=None):
+        """ A batch answer with pids in it was read at rx on source - settles the whole pending batch at once (the
+        ones left out timed out) and returns its sent time or None """
+        with self._lock:
+            pending = self._pending.pop(source, None)
+            for pid in pids:
+                trace = self._trace(pid)
+                if pending is None or pid not in pending[0]:
+                    trace.unsolicited += 1
+                    continue
+                trace.responses += 1
+                trace.stages["rtt"].add(rx - pending[1])
+            if pending is None:
+                return None
+            for missed in pending[0].difference(pids):
+                self._trace(missed).timeouts += 1
+            return pending[1]
+
+    def displayed(self, samples, drained, flipped=None):
+        """ samples (new since the last frame) were taken from the store at drained and are on screen at flipped """
+        flipped = time.monotonic_ns() if flipped is None else flipped
+        with self._lock:
+            if self._last_flip is not None:
+                self.frames.add(flipped - self._last_flip)
+            self._last_flip = flipped
+
+            for sample in samples:
+                # only samples the serial reader tagged - replayed ones carry timestamps from another run
+                if sample.trace is None:
+                    continue
+                sent, rx = sample.trace
+                stages = self._trace(sample.pid).stages
+                stages["decode"].add(sample.ts - rx)
+                stages["drain"].add(drained - sample.ts)
+                stages["render"].add(flipped - drained)
+                stages["total"].add(flipped - (rx if sent is None else sent))
+
+    def report(self):
+        """ Everything collected so far as plain dicts - latencies in ms """
+        with self._lock:
+            pids = {}
+            for pid, trace in sorted(self._pids.items()):
+                pids[f"{pid:02X}"] = {
+                    "requests": trace.requests,
+                    "responses": trace.responses,
+                    "timeouts": trace.timeouts,
+                    "unsolicited": trace.unsolicited,
+                    **{stage: hist.summary() for stage, hist in trace.stages.items()},
+                }
+            return {
+                "seconds": (time.monotonic_ns() - self.started) / 1e9,
+                "frames": self.frames.summary(),
+                "startup": self.startup.report(),
+                "pids": pids,
+            }
+
+    def dump(self, path):
+        """ Write report() to path as JSON """
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,175 @@
+import os
+import json
+import can_communication as can
+
+"""
+declarative dashboard layout
+
+layout.json lists the gauges and the info box options:
+    gauges  pid, label, pos (fraction of the window), radius, min/max, unit to show, resolution, default
+    box     label, pid, unit to show
+    graphs  pid, label, unit to show, min/max of the y axis, downsample (minmax or lttb) - the trend graph view
+
+a pid is its hex code from can.csv or a name from the PID table - derived channels (see metrics.py) only have a name
+
+load_layout() compiles it once into a RenderPlan - positions and ranges checked, PIDs resolved to numbers and one
+conversion function picked per PID - so the frame loop only reads values that are already in display units
+"""
+
+LAYOUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layout.json")
+
+# (unit from can.csv, unit to show) -> conversion
+CONVERSIONS = {
+    ("°C", "°F"): lambda v: (v * 9/5) + 32,
+    ("kph", "mph"): lambda v: v * 0.621371,
+    ("psi", "kPa"): lambda v: v * 6.894757,
+    ("psi", "bar"): lambda v: v * 0.0689476,
+    ("L/h", "gal/h"): lambda v: v * 0.264172,
+    ("sec", "min"): lambda v: v / 60,
+    ("L/100km", "mpg"): lambda v: 235.215 / v if v else 0.0,
+    ("km", "mi"): lambda v: v * 0.621371,
+    ("L", "gal"): lambda v: v * 0.264172,
+}
+
+class GaugeSpec:
+    """ One compiled gauge """
+    __slots__ = ("pid", "label", "pos", "radius", "min", "max", "unit", "resolution", "default")
+
+    def __init__(self, pid, label, pos, radius, min, max, unit, resolution, default):
+        self.pid = pid
+        self.label = label
+        self.pos = pos              # (x, y) as a fraction of the window
+        self.radius = radius
+        self.min = min
+        self.max = max
+        self.unit = unit
+        self.resolution = resolution  # smallest change worth redrawing for
+        self.default = default      # shown until the first sample comes in
+
+class BoxOption:
+    """ One compiled info box option """
+    __slots__ = ("pid", "label", "unit")
+
+    def __init__(self, pid, label, unit):
+        self.pid = pid
+        self.label = label
+        self.unit = unit
+
+class GraphSpec:
+    """ One compiled trend graph """
+    __slots__ = ("pid", "label", "unit", "min", "max", "downsample")
+
+    def __init__(self, pid, label, unit, min, max, downsample):
+        self.pid = pid
+        self.label = label
+        self.unit = unit
+        self.min = min
+        self.max = max
+        self.downsample = downsample  # history.DOWNSAMPLERS key
+
+class DisplaySample(can.Sample):
+    """ Sample converted to its display unit - unit and formatted() say the display unit, not the can.csv one """
+    __slots__ = ("unit",)
+
+    def __init__(self, sample, value, unit):
+        super().__init__(sample.ts, sample.pid, sample.raw, value, sample.trace, sample.source)
+        self.unit = unit
+
+class RenderPlan:
+    """ Compiled layout - gauges, box options, graphs and the conversion for every PID they show """
+
+    def __init__(self, gauges, box_options, converters, units, graphs=()):
+        self.gauges = gauges
+        self.box_options = box_options
+        self.graphs = graphs
+        self.converters = converters  # pid -> function from can.csv unit to display unit (only PIDs that need one)
+        self.units = units            # pid -> display unit
+
+    def converting(self, publish):
+        """ Sink that converts each sample to its display unit once and hands it to publish """
+        converters = self.converters
+        units = self.units
+
+        def sink(sample):
+            convert = converters.get(sample.pid)
+            if convert is not None:
+                sample = DisplaySample(sample, convert(sample.value), units[sample.pid])
+            publish(sample)
+        return sink
+
+def _pid(value, where):
+    """ '0C', 12 or a PID name like 'rpm_mean' -> its number, checked against the PID table """
+    if isinstance(value, str):
+        for pid, rec in can.PID_TABLE.items():
+            if rec.name == value:
+                return pid
+        try:
+            pid = int(value, 16)
+        except ValueError:
+            raise ValueError(f"{where}: no PID named {value}") from None
+    else:
+        pid = int(value)
+    if pid not in can.PID_TABLE:
+        raise ValueError(f"{where}: PID {value} is not in can.csv")
+    return pid
+
+def _display_unit(pid, unit, units, converters, where):
+    """ Check unit can be shown for pid and record its conversion - every PID has one display unit """
+    source = can.PID_TABLE[pid].unit
+    unit = unit or source
+    if units.get(pid, unit) != unit:
+        raise ValueError(f"{where}: PID {pid:02X} is already shown in {units[pid]}, not {unit}")
+    if unit != source:
+        convert = CONVERSIONS.get((source, unit))
+        if convert is None:
+            raise ValueError(f"{where}: no conversion from {source or 'no unit'} to {unit}")
+        converters[pid] = convert
+    units[pid] = unit
+    return unit
+
+def compile_layout(layout):
+    """ Layout dict (as in layout.json) -> RenderPlan """
+    units = {}
+    converters = {}
+
+    gauges = []
+    for i, g in enumerate(layout.get("gauges", [])):
+        where = f"gauge {i} ({g.get('label', '?')})"
+        pid = _pid(g["pid"], where)
+        unit = _display_unit(pid, g.get("unit"), units, converters, where)
+        x, y = g["pos"]
+        low, high = float(g.get("min", 0)), float(g["max"])
+        if high <= low:
+            raise ValueError(f"{where}: max must be above min")
+        resolution = float(g.get("resolution", 1))
+        if not resolution > 0:
+            raise ValueError(f"{where}: resolution must be above 0")
+        gauges.append(GaugeSpec(pid, g.get("label", unit), (float(x), float(y)), int(g["radius"]), low, high, unit,
+                                resolution, float(g.get("default", low))))
+
+    box_options = []
+    for i, b in enumerate(layout.get("box", [])):
+        where = f"box option {i} ({b.get('label', '?')})"
+        pid = _pid(b["pid"], where)
+        unit = _display_unit(pid, b.get("unit"), units, converters, where)
+        box_options.append(BoxOption(pid, b.get("label", can.PID_TABLE[pid].name), unit))
+
+    graphs = []
+    for i, g in enumerate(layout.get("graphs", [])):
+        where = f"graph {i} ({g.get('label', '?')})"
+        pid = _pid(g["pid"], where)
+        unit = _display_unit(pid, g.get("unit"), units, converters, where)
+        low, high = float(g.get("min", 0)), float(g["max"])
+        if high <= low:
+            raise ValueError(f"{where}: max must be above min")
+        method = g.get("downsample", "minmax")
+        if method not in ("minmax", "lttb"):
+            raise ValueError(f"{where}: downsample is minmax or lttb, not {method}")
+        graphs.append(GraphSpec(pid, g.get("label", can.PID_TABLE[pid].name), unit, low, high, method))
+
+    return RenderPlan(gauges, box_options, converters, units, graphs)
+
+def load_layout(path=LAYOUT_PATH):
+    """ Read and compile a layout file """
+    with open(path, encoding="utf-8") as f:
+        return compile_layout(json.load(f))
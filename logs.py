@@ -0,0 +1,204 @@
+import logging
+import logging.handlers
+import threading
+from collections import deque
+
+"""
+logging that stays off the serial reader's back
+
+code logs through get_logger(category) like any python logger - the only handler appends the record to a bounded
+ring buffer, and a background thread formats them and writes them to a rotating file (and optionally the console)
+
+categories and what goes in them:
+    serial   opening/closing ports and read errors
+    lines    text lines from the arduino (PONG, timeouts, echoes)
+    pid      every decoded sample - debug level, off unless asked for
+    poll     polling and adapters
+    app      everything else
+
+repeated messages (same category and message template) are rate limited - after `burst` of them in `interval`
+seconds the rest are counted and the next one that gets through says how many were suppressed. every arduino line
+has the same template so those are told apart by the start of the message - a flood of TIMEOUTs doesn't hide a PONG
+"""
+
+ROOT = "dashboard"
+CATEGORIES = ("serial", "lines", "pid", "poll", "app")
+DEFAULT_LEVELS = {"serial": logging.INFO, "lines": logging.INFO, "pid": logging.WARNING, "poll": logging.INFO,
+                  "app": logging.INFO}
+FORMAT = "%(asctime)s.%(msecs)03d %(levelname)-7s %(category)-6s %(message)s"
+
+def get_logger(category):
+    """ Logger for one category e.g. get_logger("serial") """
+    return logging.getLogger(f"{ROOT}.{category}")
+
+class RateLimitFilter(logging.Filter):
+    """ Let `burst` records per category and message template through every `interval` seconds - categories in
+    by_message are keyed on the first `prefix` characters of the formatted message as well """
+
+    MAX_WINDOWS = 1000  # expired windows are dropped past this many keys
+
+    def __init__(self, burst=10, interval=10.0, by_message=("lines",), prefix=32):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.by_message = {f"{ROOT}.{category}" for category in by_message}
+        self.prefix = prefix
+        self._windows = {}  # (logger, template, prefix) -> [window start, passed, suppressed]
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.name in self.by_message:
+            key = (record.name, record.msg, record.getMessage()[:self.prefix])
+        else:
+            key = (record.name, record.msg, None)
+        window = self._windows.get(key)
+        if window is None or record.created - window[0] >= self.interval:
+            # new window - say how many the last one held back
+            if window is not None and window[2]:
+                record.suppressed = window[2]
+            elif window is None and len(self._windows) >= self.MAX_WINDOWS:
+                self._prune(record.created)
+            self._windows[key] = [record.created, 1, 0]
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        self.suppressed += 1
+        return False
+
+    def _prune(self, now):
+        # message keyed categories can make a key per line - forget the windows that have run out
+        self._windows = {key: window for key, window in self._windows.items() if now - window[0] < self.interval}
+
+class RingHandler(logging.Handler):
+    """ Keep records in a bounded deque for the writer thread - oldest are dropped when it is full """
+
+    def __init__(self, capacity=10000):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+        self.dropped = 0
+
+    def handle(self, record):
+        # deque.append is thread safe - skip the handler lock so logging threads never wait on each other
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+
+class _Formatter(logging.Formatter):
+    """ Adds the category and how many similar messages were suppressed """
+
+    def format(self, record):
+        record.category = record.name.rpartition(".")[2]
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" ({suppressed} similar suppressed)"
+        return text
+
+class LogWriter:
+    """ Background thread moving records from the ring buffer to the real handlers """
+
+    def __init__(self, ring, handlers, flush_interval=0.5):
+        self.ring = ring
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.written = 0
+
+    def start(self):
+        self._thread.start()
+
+    def _writer_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """ Write everything buffered so far """
+        records = self.ring.records
+        count = len(records)
+        for _ in range(count):
+            record = records.popleft()
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        for handler in self.handlers:
+            handler.flush()
+        self.written += count
+
+    def stop(self):
+        """ Write what is left and close the handlers """
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+        for handler in self.handlers:
+            handler.close()
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.ring.dropped,
+                "suppressed": sum(f.suppressed for f in self.ring.filters if isinstance(f, RateLimitFilter))}
+
+_writer = None
+
+def setup(path="dashboard.log", levels=None, console_level=None, max_bytes=1_000_000, backups=3, capacity=10000,
+          burst=10, interval=10.0, flush_interval=0.5):
+    """ Route every category through the ring buffer to a rotating file at path (None for no file) and to the console
+    at console_level (None for no console) - levels overrides DEFAULT_LEVELS per category """
+    global _writer
+    shutdown()
+
+    formatter = _Formatter(FORMAT, datefmt="%H:%M:%S")
+    handlers = []
+    if path:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(formatter)
+        handlers.append(handler)
+    if console_level is not None:
+        handler = logging.StreamHandler()
+        handler.setLevel(console_level)
+        handler.setFormatter(_Formatter("%(message)s"))
+        handlers.append(handler)
+
+    ring = RingHandler(capacity)
+    ring.addFilter(RateLimitFilter(burst, interval))
+    root = logging.getLogger(ROOT)
+    root.handlers[:] = [ring]
+    root.setLevel(logging.DEBUG)
+    root.propagate = False
+
+    chosen = dict(DEFAULT_LEVELS)
+    if levels:
+        chosen.update(levels)
+    for category, level in chosen.items():
+        get_logger(category).setLevel(level)
+
+    _writer = LogWriter(ring, handlers, flush_interval)
+    _writer.start()
+    return _writer
+
+def shutdown():
+    """ Flush and close whatever setup() started """
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+def parse_levels(specs):
+    """ ['pid=DEBUG', 'lines=WARNING'] -> {category: level} """
+    levels = {}
+    for spec in specs or ():
+        category, _, level = spec.partition("=")
+        if category not in CATEGORIES:
+            raise ValueError(f"unknown log category {category!r} (one of {', '.join(CATEGORIES)})")
+        levels[category] = logging.getLevelName(level.upper())
+        if not isinstance(levels[category], int):
+            raise ValueError(f"unknown log level {level!r}")
+    return levels
@@ -0,0 +1,180 @@
+import threading
+from collections import deque
+import can_communication as can
+
+"""
+derived channels computed from decoded samples as they come in
+
+every metric updates in constant time per sample - rolling windows keep the values from the last few seconds with a
+running sum and monotonic deques for min/max, trip values are integrated sample by sample - so nothing is ever
+recomputed over the history of a drive
+
+results are published as Samples under synthetic PIDs (0x100 and up, never sent to the car). MetricsEngine registers
+them in can.PID_TABLE so the store, layout and box cycle treat them like any other PID - make the engine before
+compiling a layout that names them
+"""
+
+# synthetic PIDs - above 0xFF so they can't clash with mode 01 PIDs
+RPM_MEAN, RPM_MIN, RPM_MAX = 0x100, 0x101, 0x102
+COOLANT_MEAN, COOLANT_MIN, COOLANT_MAX = 0x103, 0x104, 0x105
+FUEL_ECONOMY = 0x110
+TRIP_FUEL_ECONOMY = 0x111
+TRIP_DISTANCE = 0x112
+TRIP_FUEL_USED = 0x113
+
+SPEED, RPM, COOLANT, FUEL_RATE = 0x0D, 0x0C, 0x05, 0x5E
+
+def register(pid, name, unit):
+    """ Add a derived channel to the shared PID table - no formula so nothing ever polls it """
+    if pid not in can.PID_TABLE:
+        can.PID_TABLE[pid] = can.PIDRecord(pid, f"{pid:02X}", name, "", unit, None)
+
+class RollingWindow:
+    """ Mean, min and max of the values from the last `seconds` of sample time - O(1) per value amortized """
+
+    def __init__(self, seconds):
+        self.span_ns = int(seconds * 1e9)
+        self._values = deque()  # (ts, value) in the window, oldest first
+        self._sum = 0.0
+        self._min = deque()  # (ts, value) increasing values - front is the min of the window
+        self._max = deque()  # (ts, value) decreasing values - front is the max of the window
+
+    def add(self, ts, value):
+        self._values.append((ts, value))
+        self._sum += value
+
+        # values that can never be the min/max again leave the back
+        ring = self._min
+        while ring and ring[-1][1] >= value:
+            ring.pop()
+        ring.append((ts, value))
+        ring = self._max
+        while ring and ring[-1][1] <= value:
+            ring.pop()
+        ring.append((ts, value))
+
+        # values older than the span leave the front - the newest always stays
+        oldest = ts - self.span_ns
+        values = self._values
+        while values[0][0] <= oldest:
+            self._sum -= values.popleft()[1]
+        if len(values) == 1:
+            self._sum = value  # no drift left over from the values that went
+        for ring in (self._min, self._max):
+            while ring[0][0] <= oldest:
+                ring.popleft()
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def mean(self):
+        return self._sum / len(self._values) if self._values else 0.0
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else 0.0
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else 0.0
+
+class RollingStats:
+    """ Rolling mean/min/max of one PID over the last `seconds` """
+
+    def __init__(self, pid, seconds, mean_pid, min_pid, max_pid):
+        self.pids = (pid,)
+        self.window = RollingWindow(seconds)
+        self.outputs = (mean_pid, min_pid, max_pid)
+        rec = can.PID_TABLE[pid]
+        self.channels = ((mean_pid, f"{rec.name}_mean", rec.unit), (min_pid, f"{rec.name}_min", rec.unit),
+                         (max_pid, f"{rec.name}_max", rec.unit))
+
+    def update(self, sample):
+        w = self.window
+        w.add(sample.ts, sample.value)
+        mean_pid, min_pid, max_pid = self.outputs
+        return ((mean_pid, w.mean), (min_pid, w.min), (max_pid, w.max))
+
+class Integrator:
+    """ Running integral of a rate over sample time - gaps longer than max_gap (e.g. a dropped adapter) are skipped """
+
+    def __init__(self, max_gap=5.0):
+        self.max_gap_ns = int(max_gap * 1e9)
+        self.total = 0.0
+        self._last = None  # (ts, rate)
+
+    def add(self, ts, rate_per_hour):
+        last = self._last
+        self._last = (ts, rate_per_hour)
+        if last is not None and 0 < ts - last[0] <= self.max_gap_ns:
+            self.total += last[1] * (ts - last[0]) / 3.6e12  # ns -> hours
+        return self.total
+
+class TripComputer:
+    """ Instantaneous and trip fuel economy (L/100km), distance (km) and fuel used (L) from speed and fuel rate -
+    instant economy is 0 below min_speed """
+
+    channels = ((FUEL_ECONOMY, "fuel_economy", "L/100km"), (TRIP_FUEL_ECONOMY, "trip_fuel_economy", "L/100km"),
+                (TRIP_DISTANCE, "trip_distance", "km"), (TRIP_FUEL_USED, "trip_fuel_used", "L"))
+
+    def __init__(self, max_gap=5.0, min_speed=1.0):
+        self.pids = (SPEED, FUEL_RATE)
+        self.min_speed = min_speed  # kph - below this economy is meaningless
+        self.distance = Integrator(max_gap)
+        self.fuel = Integrator(max_gap)
+        self._speed = 0.0
+        self._rate = 0.0
+
+    def update(self, sample):
+        out = []
+        if sample.pid == SPEED:
+            self._speed = sample.value
+            out.append((TRIP_DISTANCE, self.distance.add(sample.ts, sample.value)))
+        else:
+            self._rate = sample.value
+            out.append((TRIP_FUEL_USED, self.fuel.add(sample.ts, sample.value)))
+
+        # stopped or crawling - no economy to speak of, and the last one while moving would stay on the gauge
+        economy = self._rate / self._speed * 100 if self._speed >= self.min_speed else 0.0
+        out.append((FUEL_ECONOMY, economy))
+        if self.distance.total > 0.01:
+            out.append((TRIP_FUEL_ECONOMY, self.fuel.total / self.distance.total * 100))
+        return out
+
+def default_metrics():
+    """ RPM and coolant rolling stats plus the trip computer """
+    return [
+        RollingStats(RPM, 5.0, RPM_MEAN, RPM_MIN, RPM_MAX),
+        RollingStats(COOLANT, 60.0, COOLANT_MEAN, COOLANT_MIN, COOLANT_MAX),
+        TripComputer(),
+    ]
+
+class MetricsEngine:
+    """ Feed decoded samples to every metric that uses their PID and publish what they derive """
+
+    def __init__(self, publish=None, metrics=None):
+        """ publish takes the derived samples - None until Pipeline connects it. registers every metric's channels
+        in the PID table """
+        self.publish = publish
+        self.metrics = default_metrics() if metrics is None else metrics
+        self._by_pid = {}
+        for metric in self.metrics:
+            for pid in metric.pids:
+                self._by_pid.setdefault(pid, []).append(metric)
+            for pid, name, unit in metric.channels:
+                register(pid, name, unit)
+        self._lock = threading.Lock()  # several adapters can feed it at once
+        self.derived = 0
+
+    def consume(self, sample):
+        """ Sink for raw samples (can.csv units) - derived samples go to publish in their registered unit """
+        metrics = self._by_pid.get(sample.pid)
+        if not metrics:
+            return
+        with self._lock:
+            results = [result for metric in metrics for result in metric.update(sample)]
+            self.derived += len(results)
+        # no source - per-adapter sample counts only count what the adapters sent
+        for pid, value in results:
+            self.publish(can.Sample(sample.ts, pid, b"", float(value)))
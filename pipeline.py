@@ -0,0 +1,96 @@
+import can_communication as can
+from recorder import Recorder
+from sources import start_sources
+from discovery import SupportCache
+from broadcast import BroadcastServer, BroadcastSource, parse_address
+import logs
+
+"""
+where samples go once they are decoded - the same for the dashboard and the ingest process
+
+    metrics = MetricsEngine()  # before the layout - it can name the derived channels
+    plan = load_layout()
+    pipeline = Pipeline(plan, [store.publish], metrics)
+    pipeline.record("recordings/today")
+    pipeline.serve("0.0.0.0:5555")
+    pipeline.open(find_ports(options), options, tracer)
+    ...
+    pipeline.stop(store.source_stats())
+
+publish() takes new samples in can.csv units and hands them to the metrics, the recorder and the broadcast, and in
+display units to the display sinks (the telemetry store, the graphs) - the metrics publish there too
+"""
+
+def find_ports(options):
+    """ Ports the dashboard arguments say to read - the capture to replay, the ones given or every arduino found """
+    return [options.replay_serial] if options.replay_serial else options.port or can.find_arduino_ports()
+
+class Pipeline:
+    """ Sample sinks plus the sources feeding them """
+
+    def __init__(self, plan, display_sinks, metrics):
+        """ plan is the layout.RenderPlan converting to display units, display_sinks take the converted samples (and
+        can still be added to), metrics is the metrics.MetricsEngine made before the layout was compiled """
+        self.display_sinks = display_sinks
+
+        # rolling stats and trip data derived from the samples as they come in - published like any PID
+        metrics.publish = plan.converting(self.publish_display)
+        self.metrics = metrics
+        self.sample_sinks = [plan.converting(self.publish_display), self.metrics.consume]
+        self.recorder = None
+        self.server = None
+        self.sources = []  # one per adapter, or the broadcast read from
+
+    def publish_display(self, sample):
+        """ Hand a sample in display units to the display sinks """
+        for sink in self.display_sinks:
+            sink(sample)
+
+    def publish(self, sample):
+        """ Hand a new sample to every sink """
+        for sink in self.sample_sinks:
+            sink(sample)
+
+    def record(self, path):
+        """ Record every sample from now on to the directory path - can.csv units, OSError if it can't """
+        recorder = Recorder(path)
+        recorder.start()
+        self.recorder = recorder
+        self.sample_sinks.append(recorder.record)
+
+    def serve(self, address):
+        """ Broadcast the samples over TCP on [HOST:]PORT - same can.csv units as the recorder, OSError if it can't """
+        server = BroadcastServer(*parse_address(address))
+        server.start()
+        self.server = server
+        self.sample_sinks.append(server.publish)
+
+    def connect(self, address):
+        """ Read the samples another dashboard broadcasts on HOST:PORT """
+        source = BroadcastSource(address, self.publish)
+        source.start()
+        self.sources.append(source)
+
+    def open(self, ports, options, tracer=None):
+        """ Open and poll the adapters on ports as the dashboard arguments say - returns the sources that opened """
+        if not ports:
+            return []
+        opened = start_sources(ports, self.publish, tracer=tracer, use_asyncio=options.asyncio,
+                               capture=options.capture, replay=bool(options.replay_serial), speed=options.speed,
+                               support_cache=SupportCache(options.pid_cache), rediscover=options.rediscover,
+                               batch=options.batch)
+        self.sources.extend(opened)
+        return opened
+
+    def stop(self, source_stats):
+        """ Stop the sources, recorder and broadcast, logging what each did - source_stats is the store's """
+        for source in self.sources:
+            source.stop()
+            counts = source_stats.get(source.name, {"samples": 0, "per_second": 0.0})
+            logs.get_logger("poll").info("%s: %d samples (%.1f/s) %s", source.name, counts['samples'],
+                                         counts['per_second'], source.stats())
+        if self.recorder:
+            self.recorder.stop()
+        if self.server:
+            self.server.stop()
+            logs.get_logger("app").info("Broadcast: %s", self.server.stats())
@@ -0,0 +1,282 @@
+import os
+import json
+import struct
+import time
+import threading
+from array import array
+from collections import deque
+import can_communication as can
+from logs import get_logger
+
+_log = get_logger("app")
+
+"""
+append-only telemetry recorder and memory-mapped replay
+
+a recording is a directory with one fixed-width binary file per column plus a sparse index:
+    ts.bin      int64    time.monotonic_ns() the sample was read
+    pid.bin     uint16   numeric PID
+    value.bin   float64  decoded value
+    raw.bin     uint8x2  A and B
+    nraw.bin    uint8    how many raw bytes were sent (1 or 2)
+    index.bin   one entry per INDEX_EVERY rows: first row, first ts (int64) and a 256 bit mask of its PIDs (4x uint64)
+    meta.json   start times and format info
+
+row n of a recording is at offset n * width in every column file, so any point can be reached without reading
+what comes before it
+"""
+
+FORMAT_VERSION = 1
+INDEX_EVERY = 4096
+
+# index entry - row, ts, pid mask
+INDEX_ENTRY = struct.Struct("<qq4Q")
+INDEX_DTYPE = [("row", "<i8"), ("ts", "<i8"), ("mask", "<u8", 4)]
+
+# (file, array typecode, numpy dtype, items per row)
+COLUMNS = (
+    ("ts", "q", "<i8", 1),
+    ("pid", "H", "<u2", 1),
+    ("value", "d", "<f8", 1),
+    ("raw", "B", "u1", 2),
+    ("nraw", "B", "u1", 1),
+)
+
+def check_new(path):
+    """ Make sure a new recording can go in path - OSError if it already has one or can't be written to """
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, "ts.bin")):
+        raise FileExistsError(f"{path} already has a recording")
+    if not os.access(path, os.W_OK):
+        raise PermissionError(f"{path} isn't writable")
+
+class Recorder:
+    """ Write samples to a recording from a background thread - record() only appends to a queue """
+
+    def __init__(self, path, flush_interval=0.25, max_pending=100000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = deque()
+        self._files = {}
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        # index state for the block being written
+        self._rows = 0
+        self._block_ts = 0
+        self._block_mask = 0
+
+        # counters
+        self.recorded = 0
+        self.dropped = 0  # samples thrown away because the writer fell too far behind
+
+    def start(self):
+        """ Create the recording directory and start the writer thread """
+        check_new(self.path)
+
+        for name, *_ in COLUMNS:
+            self._files[name] = open(os.path.join(self.path, f"{name}.bin"), "ab")
+        self._files["index"] = open(os.path.join(self.path, "index.bin"), "ab")
+
+        meta = {
+            "version": FORMAT_VERSION,
+            "start_time": time.time(),
+            "start_monotonic_ns": time.monotonic_ns(),
+            "index_every": INDEX_EVERY,
+            "columns": {name: {"dtype": dtype, "width": width} for name, _, dtype, width in COLUMNS},
+        }
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    def record(self, sample):
+        """ Queue a sample for writing - safe to call from the reader thread, never waits on disk """
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(sample)
+
+    def _writer_loop(self):
+        """ Write whatever is queued every flush_interval """
+        while not self._stop_event.wait(self.flush_interval):
+            self._write_pending()
+        self._write_pending()
+
+    def _write_pending(self):
+        """ Append all queued samples to the column files in one write per column """
+        count = len(self._pending)
+        if not count:
+            return
+
+        columns = {name: array(code) for name, code, *_ in COLUMNS}
+        index = bytearray()
+        popleft = self._pending.popleft
+        for _ in range(count):
+            sample = popleft()
+            raw = sample.raw
+
+            # first row of a new index block
+            if self._rows % INDEX_EVERY == 0:
+                self._block_ts = sample.ts
+                self._block_mask = 0
+
+            columns["ts"].append(sample.ts)
+            columns["pid"].append(sample.pid)
+            columns["value"].append(sample.value)
+            columns["raw"].append(raw[0] if raw else 0)
+            columns["raw"].append(raw[1] if len(raw) > 1 else 0)
+            columns["nraw"].append(len(raw))
+            if sample.pid < 256:
+                self._block_mask |= 1 << sample.pid
+            self._rows += 1
+
+            # block is full - its index entry is final
+            if self._rows % INDEX_EVERY == 0:
+                index += self._index_entry()
+
+        for name, col in columns.items():
+            col.tofile(self._files[name])
+            self._files[name].flush()
+        if index:
+            self._files["index"].write(index)
+            self._files["index"].flush()
+        self.recorded += count
+
+    def _index_entry(self):
+        """ Packed index entry for the current block """
+        mask = self._block_mask
+        words = [(mask >> (64 * i)) & 0xFFFFFFFFFFFFFFFF for i in range(4)]
+        first_row = (self._rows - 1) // INDEX_EVERY * INDEX_EVERY
+        return INDEX_ENTRY.pack(first_row, self._block_ts, *words)
+
+    def stop(self, timeout=5.0):
+        """ Write everything still queued and close the files - left open if the writer is still stuck on disk after
+        timeout seconds """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                # it is still writing rows - an index entry now could be out of order and closing would fail its
+                # writes. the recording reads like one still being written
+                _log.warning("Recorder: writer still busy after %.0fs, %d samples queued - %s left without its last "
+                             "index entry", timeout, len(self._pending), self.path)
+                return
+
+        # index entry for the last, partly filled block
+        if self._files and self._rows % INDEX_EVERY:
+            self._files["index"].write(self._index_entry())
+        for f in self._files.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+        self._files.clear()
+
+class Recording:
+    """ Read-only view of a recording through memory maps - nothing is loaded until it is touched """
+
+    def __init__(self, path):
+        import numpy as np
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported recording version: {self.meta.get('version')}")
+
+        def column(name, dtype, width):
+            file = os.path.join(path, f"{name}.bin")
+            shape = (os.path.getsize(file) // (np.dtype(dtype).itemsize * width), width)
+            # mmap can't map an empty file
+            if shape[0] == 0:
+                return np.zeros(shape, dtype=dtype)
+            return np.memmap(file, dtype=dtype, mode="r", shape=shape)
+
+        cols = {name: column(name, dtype, width) for name, _, dtype, width in COLUMNS}
+
+        # a recording that is still being written can have columns one flush ahead of each other
+        self.rows = min(len(c) for c in cols.values())
+        self.ts = cols["ts"][:self.rows, 0]
+        self.pid = cols["pid"][:self.rows, 0]
+        self.value = cols["value"][:self.rows, 0]
+        self.raw = cols["raw"][:self.rows]
+        self.nraw = cols["nraw"][:self.rows, 0]
+
+        # index blocks - a recording that is still being written has no entry for its last block yet
+        index_file = os.path.join(path, "index.bin")
+        entries = os.path.getsize(index_file) // INDEX_ENTRY.size
+        index = np.fromfile(index_file, dtype=INDEX_DTYPE, count=entries)[:-(-self.rows // INDEX_EVERY)]
+        if len(index) * INDEX_EVERY < self.rows:
+            tail = np.zeros(1, dtype=INDEX_DTYPE)
+            tail["row"] = len(index) * INDEX_EVERY
+            tail["ts"] = self.ts[tail["row"][0]]
+            tail["mask"] = 0xFFFFFFFFFFFFFFFF  # unknown - could hold any PID
+            index = np.concatenate((index, tail))
+        self.index = index
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def duration(self):
+        """ Seconds between the first and last sample """
+        if not self.rows:
+            return 0.0
+        return (int(self.ts[-1]) - int(self.ts[0])) / 1e9
+
+    def seek(self, seconds):
+        """ Row of the first sample at least `seconds` after the start of the recording """
+        import numpy as np
+        if not self.rows:
+            return 0
+        target = int(self.ts[0]) + int(seconds * 1e9)
+
+        # find the block in the small index first, then search just that block of the ts column
+        block = max(int(np.searchsorted(self.index["ts"], target, side="right")) - 1, 0)
+        start = int(self.index["row"][block])
+        end = min(start + INDEX_EVERY, self.rows)
+        return start + int(np.searchsorted(self.ts[start:end], target))
+
+    def blocks_with(self, pid):
+        """ Row ranges of the index blocks that contain pid """
+        word, bit = divmod(pid, 64)
+        for start, mask in zip(self.index["row"].tolist(), self.index["mask"][:, word].tolist()):
+            if (mask >> bit) & 1:
+                yield start, min(start + INDEX_EVERY, self.rows)
+
+    def sample(self, row):
+        """ Row as a Sample """
+        n = int(self.nraw[row])
+        return can.Sample(int(self.ts[row]), int(self.pid[row]), bytes(self.raw[row, :n]), float(self.value[row]))
+
+    def replay(self, publish, stop_event, speed=1.0, start=0.0, pids=None):
+        """ Feed samples to publish() with their original spacing divided by speed (0 = as fast as possible) """
+        row = self.seek(start)
+        if row >= self.rows:
+            return
+        first_ts = int(self.ts[row])
+        began = time.monotonic()
+
+        while row < self.rows and not stop_event.is_set():
+            end = min(row + INDEX_EVERY, self.rows)
+            # copy one block out of the mmap at a time
+            ts = self.ts[row:end].tolist()
+            pid = self.pid[row:end].tolist()
+            value = self.value[row:end].tolist()
+            raw = self.raw[row:end].tobytes()
+            nraw = self.nraw[row:end].tolist()
+
+            for i in range(end - row):
+                if pids is not None and pid[i] not in pids:
+                    continue
+                if speed:
+                    wait = (ts[i] - first_ts) / 1e9 / speed - (time.monotonic() - began)
+                    if wait > 0.001:
+                        if stop_event.wait(wait):
+                            return
+                publish(can.Sample(ts[i], pid[i], raw[2 * i:2 * i + nraw[i]], value[i]))
+            row = end
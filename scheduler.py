@@ -0,0 +1,226 @@
+import heapq
+import threading
+import time
+from logs import get_logger
+
+_log = get_logger("poll")
+
+"""
+picks which PID to request next
+
+each PID has its own poll interval - the next request goes out as soon as the arduino answers the last one
+(or says it timed out) instead of on a fixed timer, and PIDs that keep timing out get polled less and less
+
+with batch > 1 every PID that is due (up to batch of them) goes out in one request and the next request waits for
+the whole answer - on_batch() settles all of it at once, so the next batch can't go out between its PIDs. firmware
+from before batching ignores multi-PID requests without a word, so after BATCH_FALLBACK of them in a row go unanswered
+(and no batch ever was) it goes back to one PID per request
+"""
+
+# seconds between polls of each PID - gauges that move fast get polled fast, things that barely change slow
+DEFAULT_INTERVALS = {
+    0x0C: 0.1,   # rpm
+    0x0D: 0.1,   # speed
+    0x11: 0.25,  # throttle position
+    0x04: 0.5,   # engine load
+    0x0B: 0.5,   # intake manifold pressure
+    0x0A: 1.0,   # fuel pressure
+    0x1F: 1.0,   # engine run time
+    0x42: 1.0,   # control module voltage
+    0x5E: 1.0,   # engine fuel rate
+    0x05: 2.0,   # coolant temp
+    0x0F: 2.0,   # intake air temp
+    0x5C: 2.0,   # oil temp
+    0x32: 5.0,   # evap system vapor pressure
+    0x33: 5.0,   # barometric pressure
+    0x46: 5.0,   # ambient air temp
+    0x2F: 10.0,  # fuel level
+}
+DEFAULT_INTERVAL = 2.0
+BATCH_FALLBACK = 3  # silent multi-PID requests in a row before polling one PID at a time
+
+class _PIDState:
+    """ Scheduling state for one PID """
+    __slots__ = ("interval", "next_due", "fails", "requests", "responses", "timeouts")
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_due = 0.0
+        self.fails = 0  # timeouts in a row
+        self.requests = 0
+        self.responses = 0
+        self.timeouts = 0
+
+class PIDScheduler:
+    """ Response-driven PID poller with per-PID rates and backoff for PIDs that keep timing out """
+
+    def __init__(self, pids, intervals=None, response_timeout=1.5, min_backoff=1.0, max_backoff=60.0):
+        """ pids are numeric PIDs, intervals overrides DEFAULT_INTERVALS, response_timeout is a fallback for when the
+        arduino never answers at all (its own CAN timeout is 1s) """
+        rates = dict(DEFAULT_INTERVALS)
+        if intervals:
+            rates.update(intervals)
+        self.response_timeout = response_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self._state = {pid: _PIDState(rates.get(pid, DEFAULT_INTERVAL)) for pid in pids}
+        self._lock = threading.Lock()
+        self._answered = threading.Event()
+        self._pending = set()  # PIDs waiting for a response
+        self.single_pid = False  # set once the firmware turned out not to answer batches
+        self._batch_answered = False
+        self._silent_batches = 0
+
+    def next_pid(self, now):
+        """ Return (pid, 0) for the most overdue PID or (None, seconds until the next one is due) """
+        pids, wait = self.next_batch(now, 1)
+        return (pids[0], 0) if pids else (None, wait)
+
+    def next_batch(self, now, size):
+        """ Return ([pids], 0) for up to size PIDs that are due, most overdue first, or ([], seconds until the next
+        one is due) """
+        if not self._state:
+            return [], self.response_timeout
+        if self.single_pid:
+            size = 1
+        with self._lock:
+            soonest = heapq.nsmallest(size, self._state.items(), key=lambda item: item[1].next_due)
+        due = [pid for pid, state in soonest if state.next_due <= now]
+        if not due:
+            return [], soonest[0][1].next_due - now
+        return due, 0
+
+    def mark_sent(self, pids, now):
+        """ Record a request for a PID (or a batch of them) going out """
+        if isinstance(pids, int):
+            pids = (pids,)
+        with self._lock:
+            for pid in pids:
+                state = self._state[pid]
+                state.requests += 1
+                state.next_due = now + self._backoff(state)
+            self._pending = set(pids)
+            self._answered.clear()
+
+    def on_response(self, pid):
+        """ Response callback for SerialManager - pid is the PID that answered or None for a timeout line (or the
+        end of a batch answer) """
+        with self._lock:
+            pending = self._pending
+            if pid is None:
+                # arduino timeout or CAN send failure is for whatever is pending - so is a batch that left PIDs out
+                for failed in pending:
+                    self._failed(failed)
+            else:
+                state = self._state.get(pid)
+                if state is not None:
+                    state.responses += 1
+                    state.fails = 0
+                # late answers to an old request don't release the current one, nor does part of a batch
+                if pid not in pending:
+                    return
+                pending.discard(pid)
+                if pending:
+                    return
+            self._pending = set()
+        self._answered.set()
+
+    def on_batch(self, answered):
+        """ Batch callback for SerialManager - answered are the PIDs in a BATCH line, everything else pending failed.
+        only call it for a BATCH line - it is what tells the scheduler the firmware batches """
+        with self._lock:
+            self._batch_answered = True
+            self._silent_batches = 0
+            for pid in answered:
+                state = self._state.get(pid)
+                if state is not None:
+                    state.responses += 1
+                    state.fails = 0
+            # a late answer to an old batch doesn't settle the current one
+            if answered and self._pending.isdisjoint(answered):
+                return
+            for pid in self._pending:
+                if pid not in answered:
+                    self._failed(pid)
+            self._pending = set()
+        self._answered.set()
+
+    def _failed(self, pid):
+        """ Push a PID back after a timeout - call with _lock held """
+        state = self._state[pid]
+        state.timeouts += 1
+        state.fails += 1
+        state.next_due = time.monotonic() + self._backoff(state)
+
+    def _backoff(self, state):
+        """ Poll interval doubled for every timeout in a row (starting from at least min_backoff), up to max_backoff """
+        if not state.fails:
+            return state.interval
+        base = max(state.interval, self.min_backoff)
+        return min(base * (2 ** state.fails), max(self.max_backoff, base))
+
+    def wait_for_response(self, timeout=None):
+        """ Block until the pending request is answered or timed out - True if an answer came back """
+        if self._answered.wait(self.response_timeout if timeout is None else timeout):
+            return True
+        self.no_answer()
+        return False
+
+    def no_answer(self):
+        """ Nothing at all came back for the pending request - count it as a timeout """
+        with self._lock:
+            if len(self._pending) > 1 and not self._batch_answered and not self.single_pid:
+                # could be firmware that doesn't batch - no backoff until that's settled, or the PIDs would sit out
+                # the seconds it takes to find out
+                self._silent_batches += 1
+                for pid in self._pending:
+                    self._state[pid].timeouts += 1
+            else:
+                for pid in self._pending:
+                    self._failed(pid)
+            self._pending = set()
+            if self._silent_batches < BATCH_FALLBACK or self.single_pid:
+                return
+            # those PIDs never got asked properly - start them over
+            self.single_pid = True
+            for state in self._state.values():
+                state.fails = 0
+                state.next_due = 0.0
+        _log.warning("No answer to %d multi-PID requests - the firmware doesn't batch, polling one PID at a time "
+                     "(--batch 1 skips the wait)", BATCH_FALLBACK)
+
+    def run(self, send, stop_event, batch=1):
+        """ Loop sending requests with send([pids]) - up to batch PIDs at a time - until stop_event is set """
+        while not stop_event.is_set():
+            now = time.monotonic()
+            pids, wait = self.next_batch(now, batch)
+            if not pids:
+                stop_event.wait(wait)
+                continue
+
+            self.mark_sent(pids, now)
+            try:
+                send(pids)
+            except Exception:
+                # port went away or is busy - drop this request and try again shortly
+                with self._lock:
+                    self._pending = set()
+                stop_event.wait(0.1)
+                continue
+            self.wait_for_response()
+
+    def restrict(self, supported):
+        """ Stop polling PIDs the car doesn't support - returns the PIDs dropped """
+        with self._lock:
+            dropped = sorted(pid for pid in self._state if pid not in supported)
+            for pid in dropped:
+                del self._state[pid]
+        return dropped
+
+    def stats(self):
+        """ Per-PID request, response and timeout counts plus the current interval """
+        with self._lock:
+            return {pid: {"requests": s.requests, "responses": s.responses, "timeouts": s.timeouts,
+                          "interval": self._backoff(s)}
+                    for pid, s in self._state.items()}
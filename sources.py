@@ -0,0 +1,199 @@
+import threading
+import can_communication as can
+from scheduler import PIDScheduler
+from capture import replay_factory
+import async_serial
+import discovery
+from logs import get_logger
+
+_log = get_logger("poll")
+
+"""
+serial sources - one per adapter, each with its own reader, its own poll schedule and its own thread(s), all
+publishing into the same sink so a slow adapter only holds up itself
+
+    sources = [SerialSource(port, store.publish) for port in can.find_arduino_ports()]
+
+a port spec on the command line can pick the PIDs an adapter polls: /dev/ttyUSB1=0C,0D,11
+
+before polling, each live adapter asks the car which PIDs it supports (or takes them from the cache) and drops the
+rest from its schedule - see discovery.py
+"""
+
+def parse_port_spec(spec):
+    """ 'PORT' or 'PORT=PID,PID' -> (port, [pids] or None for every PID with a formula) """
+    port, _, pids = spec.partition("=")
+    if not pids:
+        return port, None
+    return port, [int(pid, 16) for pid in pids.split(",") if pid.strip()]
+
+def pollable_pids():
+    """ Every PID in the shared table with a formula """
+    return [pid for pid, rec in can.PID_TABLE.items() if rec.decoder is not None]
+
+class SerialSource:
+    """ One adapter with its own reader and poller - threaded SerialManager, asyncio engine or capture replay """
+
+    def __init__(self, port, publish, pids=None, intervals=None, tracer=None, use_asyncio=False, capture=None,
+                 replay=False, speed=1.0, support_cache=None, rediscover=False, batch=1):
+        """ pids is what this adapter polls (default every PID with a formula), replay treats port as a capture file
+        (see capture.py) which needs no polling, batch is how many PIDs go in one request (up to can.MAX_BATCH - 1
+        for firmware without batch support)
+
+        support_cache is a discovery.SupportCache to look up and save the supported PIDs in, rediscover asks the car
+        again even when the cache has them """
+        self.port = port
+        self.name = port
+        self.publish = publish
+        self.tracer = tracer
+        self.use_asyncio = use_asyncio and not replay
+        self.replay = replay
+        self.batch = max(1, min(batch, can.MAX_BATCH))
+        self.scheduler = PIDScheduler(pids if pids is not None else pollable_pids(), intervals=intervals)
+        self.support_cache = support_cache
+        self.rediscover = rediscover
+        self.supported = None  # PIDs the car supports once known
+
+        self.mgr = None
+        self.engine = None
+        self._thread = None  # poller thread, or the engine's event loop thread
+        self._stop_event = threading.Event()
+        self.running = False
+
+        if not self.use_asyncio:
+            factory = replay_factory(speed=speed) if replay else None
+            self.mgr = can.SerialManager(port, event_callback=publish, serial_factory=factory, capture=capture,
+                                         tracer=tracer, source=self.name)
+
+    def start(self):
+        """ Open the port and start polling - raises if the port can't be opened """
+        if self.use_asyncio:
+            # one event loop does the reading and polling - no reader or poller thread
+            self.engine, self._thread = async_serial.start_thread(self.port, self.scheduler, event_callback=self.publish,
+                                                                  tracer=self.tracer, source=self.name,
+                                                                  prepare=self._discover_async, batch=self.batch)
+        else:
+            self.mgr.start()
+            # captured bytes already hold the responses - nothing to poll
+            if not self.replay:
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._poller, daemon=True)
+                self._thread.start()
+        self.running = True
+
+    def _cached_support(self):
+        """ Supported PIDs from the cache (None if not cached or asked to rediscover) and the key they go under """
+        if self.support_cache is None:
+            return None, None
+        key = discovery.vehicle_key(self.port)
+        return (None if self.rediscover else self.support_cache.get(key)), key
+
+    def _mark(self, milestone):
+        """ Startup milestone for the tracer's startup report - the first adapter to get there counts """
+        if self.tracer is not None:
+            self.tracer.startup.mark(milestone)
+
+    def _use_support(self, supported, key, discovered):
+        """ Drop the PIDs the car doesn't support from the schedule and cache what was discovered """
+        self._mark("supported pids")
+        if supported is None:
+            _log.warning("%s: car didn't answer PID 00, polling every PID", self.name)
+            return
+        self.supported = supported
+        if discovered and key is not None:
+            try:
+                self.support_cache.put(key, supported)
+            except OSError as e:
+                _log.warning("Couldn't save supported PIDs for %s: %s", self.name, e)
+        dropped = self.scheduler.restrict(supported)
+        _log.info("%s: %d supported PIDs (%s), not polling %s", self.name, len(supported),
+                  "discovered" if discovered else "cached", " ".join(f"{pid:02X}" for pid in dropped) or "none")
+
+    async def _discover_async(self, engine):
+        self._mark("handshake")
+        supported, key = self._cached_support()
+        discovered = supported is None
+        if discovered:
+            supported = await discovery.discover_async(engine.request_support)
+        self._use_support(supported, key, discovered)
+
+    def _poller(self):
+        """ Request PIDs from the Arduino as fast as it answers, each PID at its own rate """
+        mgr = self.mgr
+
+        # wait for the arduino to say it is up rather than a fixed time
+        try:
+            if mgr.handshake():
+                self._mark("handshake")
+            else:
+                _log.warning("%s never said Arduino Ready or PONG - polling anyway", self.name)
+        except Exception as e:
+            _log.error("%s didn't take a PING, not polling it: %s", self.name, e)
+            return
+
+        supported, key = self._cached_support()
+        discovered = supported is None
+        if discovered:
+            supported = discovery.discover(discovery.serial_query(mgr))
+        self._use_support(supported, key, discovered)
+        mgr.response_callback = self.scheduler.on_response
+        mgr.batch_callback = self.scheduler.on_batch
+
+        def send(pids):
+            if self.tracer is not None:
+                self.tracer.request(pids, source=self.name)
+            mgr.send(can.request_command(pids))
+
+        # Send in format: "01 <PID> [<PID> ...]" (mode 01 = current data) - next one goes out when this one is answered
+        self.scheduler.run(send, self._stop_event, batch=self.batch)
+
+    def stop(self):
+        """ Stop polling and close the port """
+        if self.engine is not None:
+            self.engine.stop()
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+        if self.mgr is not None:
+            try:
+                self.mgr.stop()
+            except Exception:
+                pass
+        self.running = False
+
+    def stats(self):
+        """ Request, response and timeout totals for this adapter """
+        per_pid = self.scheduler.stats().values()
+        stats = {
+            "requests": sum(s["requests"] for s in per_pid),
+            "responses": sum(s["responses"] for s in per_pid),
+            "timeouts": sum(s["timeouts"] for s in per_pid),
+        }
+        if self.mgr is not None:
+            stats["dropped_events"] = self.mgr.dropped_events
+        return stats
+
+def start_sources(specs, publish, **kwargs):
+    """ Start a SerialSource per port spec at the same time - returns the ones that started """
+    capture = kwargs.pop("capture", None)
+    sources = []
+    for i, spec in enumerate(specs):
+        port, pids = parse_port_spec(spec)
+        # one capture file per adapter
+        path = f"{capture}.{i}" if capture and len(specs) > 1 else capture
+        sources.append(SerialSource(port, publish, pids=pids, capture=path, **kwargs))
+
+    # opening a port can take a while (arduino reset, asyncio engine startup) - don't wait on them one by one
+    failed = set()
+    def start(source):
+        try:
+            source.start()
+        except Exception as e:
+            _log.error("Failed to start %s: %s", source.name, e)
+            failed.add(source)
+    threads = [threading.Thread(target=start, args=(source,), daemon=True) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [source for source in sources if source not in failed]
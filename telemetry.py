@@ -0,0 +1,342 @@
+import zlib
+import struct
+import threading
+from collections import deque
+from multiprocessing import shared_memory
+import can_communication as can
+
+"""
+latest-value store shared between the serial reader and the render loop
+
+writers overwrite the newest sample per PID in place so they never wait on the render loop, and the render loop
+takes a consistent snapshot each frame instead of draining a queue
+
+SharedTelemetryStore is the same store in shared memory, so the serial side can run in another process (see ingest.py)
+"""
+
+class TelemetryStore:
+    """ Latest sample per PID with a sequence number, optional short history and drop/coalesce counters """
+
+    def __init__(self, history=0):
+        """ history is how many recent samples to keep per PID (0 keeps none) """
+        self.history = history
+        self._lock = threading.Lock()  # only ever held for a dict update or copy
+        self._latest = {}   # pid -> newest sample
+        self._seq = {}      # pid -> samples published so far
+        self._unread = set()  # pids published since the last snapshot
+        self._recent = {}   # pid -> deque of recent samples
+        self._sources = {}  # source -> [samples, first ts, last ts]
+
+        # counters
+        self.published = 0
+        self.coalesced = 0  # samples replaced by a newer one before a snapshot saw them
+        self.dropped = 0    # samples that couldn't be stored
+
+    def publish(self, sample):
+        """ Store a decoded sample - never blocks for longer than a dict update """
+        try:
+            pid = sample.pid
+        except Exception:
+            with self._lock:
+                self.dropped += 1
+            return
+
+        with self._lock:
+            self._latest[pid] = sample
+            self._seq[pid] = self._seq.get(pid, 0) + 1
+            self.published += 1
+            if pid in self._unread:
+                self.coalesced += 1
+            else:
+                self._unread.add(pid)
+
+            source = sample.source
+            if source is not None:
+                counts = self._sources.get(source)
+                if counts is None:
+                    self._sources[source] = [1, sample.ts, sample.ts]
+                else:
+                    counts[0] += 1
+                    counts[2] = sample.ts
+
+            if self.history:
+                ring = self._recent.get(pid)
+                if ring is None:
+                    ring = self._recent[pid] = deque(maxlen=self.history)
+                ring.append(sample)
+
+    def snapshot(self):
+        """ Consistent copy of (latest sample per pid, sequence number per pid) """
+        with self._lock:
+            self._unread.clear()
+            return dict(self._latest), dict(self._seq)
+
+    def latest(self, pid, default=None):
+        """ Newest sample for one pid """
+        return self._latest.get(pid, default)
+
+    def recent(self, pid):
+        """ Recent samples for one pid, oldest first (empty when history is off) """
+        with self._lock:
+            ring = self._recent.get(pid)
+            return list(ring) if ring else []
+
+    def source_stats(self):
+        """ Samples and samples per second from each source """
+        with self._lock:
+            return {source: {"samples": n, "per_second": (n - 1) / ((last - first) / 1e9) if last > first else 0.0}
+                    for source, (n, first, last) in self._sources.items()}
+
+    def stats(self):
+        """ Counters for monitoring """
+        with self._lock:
+            return {"published": self.published, "coalesced": self.coalesced, "dropped": self.dropped,
+                    "pids": len(self._latest), "sources": len(self._sources)}
+
+class SharedTelemetryStore:
+    """ TelemetryStore in a fixed-layout shared memory table indexed by PID - one process writes, another reads
+
+    every PID has a 64 byte record written in one copy: its sequence number at both ends and a crc32 of
+    the rest. nothing is assumed about the order another process sees the bytes of a write in - python has no memory
+    barriers, and a weakly ordered CPU (the quad-core ARM boards this runs on) can show a reader the end of a write
+    before the middle - so a reader keeps a record only if both sequence numbers match and the crc does, and reads it
+    again otherwise. neither side ever locks the other out or waits on it
+
+    a separate column of sequence numbers, written after each record, only says which slots moved since the last
+    snapshot so a frame doesn't read all of them - a record that hasn't caught up with it yet is read again next time
+    """
+    SLOTS = 0x200  # mode 01 PIDs and the derived ones from metrics.py
+    MAX_SOURCES = 8
+    NAME_SIZE = 64
+    MAGIC = 0x44415349  # 'DASI' - layout 2
+
+    # header - int64 each
+    _MAGIC, _PUBLISHED, _DROPPED, _STATE, _SOURCES = range(5)
+    _HEADER = 8
+    # record - seq, ts, value, sent, rx, info, crc32 of everything before it, seq again. info packs
+    # nraw | A << 8 | B << 16 | source << 24 (0 = none)
+    _FIELDS = struct.Struct("=Qqdqqq")
+    _RECORD = struct.Struct("=QqdqqqQQ")
+    _TAIL = struct.Struct("=QQ")
+    # per source - samples, first ts, last ts
+    _SOURCE_COUNTS = 3
+
+    def __init__(self, shm, created):
+        """ Use create() or attach() """
+        self.shm = shm
+        self.name = shm.name
+        self._created = created
+        self._lock = threading.Lock()  # writer threads in the writing process take turns
+        buf = shm.buf
+        self._views = []
+
+        def view(offset, count, fmt):
+            v = buf[offset:offset + 8 * count].cast(fmt)
+            self._views.append(v)
+            return v, offset + 8 * count
+
+        offset = 0
+        self._header, offset = view(offset, self._HEADER, "q")
+        self._seq_bytes = buf[offset:offset + 8 * self.SLOTS]
+        self._views.append(self._seq_bytes)
+        self._seq, offset = view(offset, self.SLOTS, "Q")
+        self._records = buf[offset:offset + self._RECORD.size * self.SLOTS]
+        self._views.append(self._records)
+        offset += self._RECORD.size * self.SLOTS
+        self._source_counts, offset = view(offset, self.MAX_SOURCES * self._SOURCE_COUNTS, "q")
+        self._source_names = buf[offset:offset + self.MAX_SOURCES * self.NAME_SIZE]
+        self._views.append(self._source_names)
+
+        # writer side
+        self._source_index = {}  # source -> index + 1
+        # reader side
+        self._known = [0] * self.SLOTS  # sequence number of each slot when last read
+        self._seen = b""  # sequence column at the last snapshot
+        self._latest = {}
+        self._seqs = {}
+        self._names = []
+        self.coalesced = 0
+        self.torn = 0  # slot reads that raced the writer - picked up on the next snapshot
+
+    @classmethod
+    def size(cls):
+        return 8 * (cls._HEADER + cls.SLOTS + cls.MAX_SOURCES * cls._SOURCE_COUNTS) + \
+            cls._RECORD.size * cls.SLOTS + cls.MAX_SOURCES * cls.NAME_SIZE
+
+    @classmethod
+    def create(cls):
+        """ New zeroed table - the creator unlinks it in close() """
+        store = cls(shared_memory.SharedMemory(create=True, size=cls.size()), True)
+        store._header[cls._MAGIC] = cls.MAGIC
+        return store
+
+    @classmethod
+    def attach(cls, name):
+        """ Table another process created """
+        try:
+            shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # before 3.13 every process that opens it tracks it, and unlinks it when it exits
+            from multiprocessing import resource_tracker
+            shm = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        store = cls(shm, False)
+        if store._header[cls._MAGIC] != cls.MAGIC:
+            store.close()
+            raise ValueError(f"{name} is not a telemetry table")
+        return store
+
+    @property
+    def state(self):
+        """ Free int for the two processes to signal with - ingest.py keeps its lifecycle in it """
+        return self._header[self._STATE]
+
+    @state.setter
+    def state(self, value):
+        self._header[self._STATE] = value
+
+    @property
+    def published(self):
+        return self._header[self._PUBLISHED]
+
+    def _source(self, source, ts):
+        """ Index + 1 of source in the source table, counting the sample - call with _lock held """
+        index = self._source_index.get(source)
+        if index is None:
+            count = self._header[self._SOURCES]
+            if count >= self.MAX_SOURCES:
+                return 0
+            name = str(source).encode()[:self.NAME_SIZE]
+            self._source_names[count * self.NAME_SIZE:count * self.NAME_SIZE + len(name)] = name
+            base = count * self._SOURCE_COUNTS
+            self._source_counts[base + 1] = ts
+            self._header[self._SOURCES] = count + 1
+            index = self._source_index[source] = count + 1
+        base = (index - 1) * self._SOURCE_COUNTS
+        counts = self._source_counts
+        counts[base] += 1
+        counts[base + 2] = ts
+        return index
+
+    def publish(self, sample):
+        """ Store a decoded sample - writing process only """
+        try:
+            pid = sample.pid
+            if not 0 <= pid < self.SLOTS:
+                raise IndexError(pid)
+            raw = sample.raw
+            trace = sample.trace
+        except Exception:
+            with self._lock:
+                self._header[self._DROPPED] += 1
+            return
+        sent, rx = (trace[0] or 0, trace[1]) if trace is not None else (0, 0)
+
+        with self._lock:
+            source = self._source(sample.source, sample.ts) if sample.source is not None else 0
+            info = len(raw) | source << 24
+            if raw:
+                info |= raw[0] << 8
+                if len(raw) > 1:
+                    info |= raw[1] << 16
+
+            n = self._seq[pid] + 1
+            fields = self._FIELDS.pack(n, sample.ts, sample.value, sent, rx, info)
+            offset = pid * self._RECORD.size
+            # one copy of the whole record
+            self._records[offset:offset + self._RECORD.size] = fields + self._TAIL.pack(zlib.crc32(fields), n)
+            self._seq[pid] = n
+            self._header[self._PUBLISHED] += 1
+
+    def _read(self, pid, tries=100):
+        """ (sample, sequence number) for one slot or None if the writer kept getting in the way """
+        record, fields = self._RECORD, self._FIELDS
+        offset = pid * record.size
+        for _ in range(tries):
+            n, ts, value, sent, rx, info, crc, end = record.unpack_from(self._records, offset)
+            if n != end or crc != zlib.crc32(fields.pack(n, ts, value, sent, rx, info)):
+                continue
+            nraw = info & 0xFF
+            raw = bytes(((info >> 8) & 0xFF, (info >> 16) & 0xFF)[:nraw])
+            source = info >> 24
+            trace = (sent or None, rx) if rx else None
+            return can.Sample(ts, pid, raw, value, trace, self._source_name(source) if source else None), n
+        self.torn += 1
+        return None
+
+    def _source_name(self, index):
+        names = self._names
+        while len(names) < index:
+            i = len(names)
+            name = bytes(self._source_names[i * self.NAME_SIZE:(i + 1) * self.NAME_SIZE]).rstrip(b"\0").decode()
+            if not name:
+                # the count got here before the name did - don't keep it
+                return str(index)
+            names.append(name)
+        return names[index - 1]
+
+    def snapshot(self):
+        """ (latest sample per pid, sequence number per pid) like TelemetryStore.snapshot - reading process only """
+        current = self._seq_bytes.tobytes()
+        seen = self._seen
+        if current != seen:
+            self._seen = current
+            seq = self._seq
+            known = self._known
+            # compare 8 slots at a time - the PIDs in use sit in a few blocks
+            for block in range(0, len(current), 64):
+                if current[block:block + 64] == seen[block:block + 64]:
+                    continue
+                for pid in range(block // 8, block // 8 + 8):
+                    hint = seq[pid]
+                    if hint == known[pid]:
+                        continue
+                    read = self._read(pid)
+                    if read is None or read[1] < hint:
+                        self._seen = b""  # look at every slot again next time
+                    if read is None or read[1] == known[pid]:
+                        continue
+                    sample, n = read
+                    self.coalesced += max(0, n - known[pid] - 1)
+                    known[pid] = n
+                    self._latest[pid] = sample
+                    self._seqs[pid] = n
+        return dict(self._latest), dict(self._seqs)
+
+    def latest(self, pid, default=None):
+        """ Newest sample for one pid """
+        read = self._read(pid) if 0 <= pid < self.SLOTS and self._seq[pid] else None
+        return read[0] if read else default
+
+    def recent(self, pid):
+        """ No history in shared memory """
+        return []
+
+    def source_stats(self):
+        """ Samples and samples per second from each source """
+        stats = {}
+        counts = self._source_counts
+        for index in range(1, self._header[self._SOURCES] + 1):
+            base = (index - 1) * self._SOURCE_COUNTS
+            n, first, last = counts[base], counts[base + 1], counts[base + 2]
+            stats[self._source_name(index)] = {"samples": n,
+                                               "per_second": (n - 1) / ((last - first) / 1e9) if last > first else 0.0}
+        return stats
+
+    def stats(self):
+        """ Counters for monitoring - coalesced is as seen by this reader """
+        return {"published": self.published, "coalesced": self.coalesced, "dropped": self._header[self._DROPPED],
+                "pids": sum(1 for n in self._seq.tolist() if n), "sources": self._header[self._SOURCES],
+                "torn": self.torn}
+
+    def close(self):
+        """ Let go of the table - the process that created it also removes it """
+        for v in self._views:
+            v.release()
+        self._views = []
+        self.shm.close()
+        if self._created:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,44 @@
+import time
+import async_serial
+import can_communication as can
+from emulator import VirtualArduino
+from scheduler import PIDScheduler
+
+""" the asyncio engine's polling against the emulated arduino """
+
+PIDS = [0x0C, 0x0D, 0x05, 0x0F, 0x11, 0x04, 0x42]
+
+def _poll(emulator_options, batch, seconds):
+    """ Poll PIDS with the asyncio engine for seconds - returns (emulator, scheduler, samples) """
+    emu = VirtualArduino(latency=0.002, **emulator_options)
+    emu.start()
+    samples = []
+    scheduler = PIDScheduler(PIDS, intervals={pid: 0.05 for pid in PIDS}, response_timeout=0.3)
+    try:
+        engine, thread = async_serial.start_thread(emu.port, scheduler, event_callback=samples.append,
+                                                   request_timeout=0.3, batch=batch)
+        time.sleep(seconds)
+        engine.stop()
+        thread.join(timeout=2.0)
+    finally:
+        emu.stop()
+    return emu, scheduler, samples
+
+def test_batches():
+    emu, scheduler, samples = _poll({}, can.MAX_BATCH, 1.0)
+    assert not scheduler.single_pid
+    assert sum(s["timeouts"] for s in scheduler.stats().values()) == 0
+    assert {sample.pid for sample in samples} == set(PIDS)
+
+def test_falls_back_to_single_pids_without_batch_firmware():
+    emu, scheduler, samples = _poll({"max_batch": 1}, can.MAX_BATCH, 2.5)
+    assert scheduler.single_pid
+    assert {sample.pid for sample in samples} == set(PIDS)
+    # nothing was left backed off by the batches that went unanswered
+    assert all(s["interval"] == 0.05 for s in scheduler.stats().values())
+
+def test_single_pid_timeouts_do_not_count_as_batches():
+    emu, scheduler, samples = _poll({"unsupported": [0x42], "can_timeout": 0.05}, 1, 1.0)
+    assert not scheduler.single_pid
+    assert scheduler.stats()[0x42]["timeouts"] > 0
+    assert {sample.pid for sample in samples} == set(PIDS) - {0x42}
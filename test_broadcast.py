@@ -0,0 +1,66 @@
+import time
+import pytest
+import can_communication as can
+import broadcast
+from broadcast import (BroadcastServer, BroadcastClient, parse_address, encode_delta, decode_delta, encode_subscribe,
+                       decode_subscribe, HEADER, DELTA, SUBSCRIBE)
+
+""" telemetry broadcast - the wire format and a server with real clients on localhost """
+
+def body(data, kind):
+    length, got = HEADER.unpack_from(data)
+    assert got == kind[0] and len(data) == HEADER.size + length
+    return data[HEADER.size:]
+
+def test_parse_address():
+    assert parse_address("10.0.0.5:9000") == ("10.0.0.5", 9000)
+    assert parse_address(":9000") == ("127.0.0.1", 9000)
+    assert parse_address("9000") == ("127.0.0.1", 9000)
+    assert parse_address("carpi") == ("carpi", broadcast.DEFAULT_PORT)
+
+def test_delta_round_trip():
+    samples = [can.Sample(5_000_000_000, 0x0C, b"\x1a\xf8", 1726.25), can.Sample(4_999_000_000, 0x0D, b"\x3c", 60.0),
+               can.Sample(4_000_000_000, 0x112, b"", 12.3456789)]
+    decoded = decode_delta(body(encode_delta(samples), DELTA))
+    assert [(ts, pid) for ts, pid, _ in decoded] == [(s.ts, s.pid) for s in samples]
+    # values go as float32
+    assert [value for _, _, value in decoded] == pytest.approx([s.value for s in samples], rel=1e-6)
+
+def test_delta_age_is_clamped():
+    samples = [can.Sample(10**13, 0x0C, b"", 1.0), can.Sample(0, 0x0D, b"", 2.0)]
+    (_, _, _), (ts, _, _) = decode_delta(body(encode_delta(samples), DELTA))
+    assert ts == 10**13 - 0xFFFFFFFF * 1000
+
+def test_subscribe_round_trip():
+    assert decode_subscribe(body(encode_subscribe({0x0D, 0x0C, 0x110}), SUBSCRIBE)) == {0x0C, 0x0D, 0x110}
+    assert decode_subscribe(body(encode_subscribe(None), SUBSCRIBE)) is None
+
+def test_server_and_clients():
+    server = BroadcastServer(port=0, interval=0.01)
+    server.start()
+    everything = BroadcastClient("127.0.0.1", server.port)
+    speed_only = BroadcastClient("127.0.0.1", server.port, pids={0x0D})
+    try:
+        everything.connect()
+        speed_only.connect()
+        assert everything.units[0x0C] == "rpm"
+        time.sleep(0.1)  # the subscription is in before anything is published
+
+        now = time.monotonic_ns()
+        server.publish(can.Sample(now, 0x0C, b"\x1a\xf8", 1726.0))
+        server.publish(can.Sample(now, 0x0D, b"\x3c", 60.0))
+        got = {s.pid: s for s in everything.receive()}
+        assert {pid: s.value for pid, s in got.items()} == {0x0C: 1726.0, 0x0D: 60.0}
+        # on this machine's clock, give or take the offset worked out from the hello
+        assert abs(got[0x0C].ts - now) < 50_000_000 and got[0x0C].source == everything.name
+        assert [(s.pid, s.value) for s in speed_only.receive()] == [(0x0D, 60.0)]
+
+        # a value that didn't change isn't sent again
+        server.publish(can.Sample(now + 1, 0x0C, b"\x1a\xf8", 1726.0))
+        server.publish(can.Sample(now + 1, 0x0D, b"\x3d", 61.0))
+        assert [(s.pid, s.value) for s in everything.receive()] == [(0x0D, 61.0)]
+        assert server.stats()["clients"] == 2
+    finally:
+        everything.close()
+        speed_only.close()
+        server.stop()
@@ -0,0 +1,110 @@
+import time
+import threading
+import can_communication as can
+from emulator import VirtualArduino
+from scheduler import PIDScheduler
+
+""" frame parsing, and batches end to end against the emulated arduino """
+
+def test_parse_frames_matches_single_line_parser():
+    lines = [b"PID: 1A F8 0C", b"PID: 3C D", b"PID: 5 0 1F"]
+    rows, pids, A, B = can.parse_frames(b"\n".join(lines))
+    assert rows.tolist() == [0, 1, 2]
+    for row, line in enumerate(lines):
+        pid, a, b = can.parse_pid_frame(line)
+        assert (pids[row], A[row], B[row]) == (pid, a, b or 0)
+
+def test_parse_frames_skips_other_lines():
+    block = (b"Arduino Ready\r\n"
+             b"PID: 1A F8 0C\r\n"
+             b"No response - timeout\r\n"
+             b"PID: 1A\r\n"          # no pid
+             b"PID: 1G 0D\r\n"       # not hex
+             b"PID: 123 0D\r\n"      # three digits
+             b"PID: 1 2 3 0D\r\n"    # too many bytes
+             b"PID: 7B 5")
+    rows, pids, A, B = can.parse_frames(block)
+    assert rows.tolist() == [1, 7]
+    assert pids.tolist() == [0x0C, 0x05]
+    assert A.tolist() == [0x1A, 0x7B]
+    assert B.tolist() == [0xF8, 0]
+
+def test_parse_frames_takes_lines():
+    rows, pids, A, B = can.parse_frames(["PID: 3C D\r\n", b"PID: 1A F8 0C\n"])
+    assert pids.tolist() == [0x0D, 0x0C]
+    assert A.tolist() == [0x3C, 0x1A]
+
+def test_decode_frames():
+    decoded = can.decode_frames(b"PID: 1A F8 0C\nPID: 3C D\n")
+    assert decoded["value"].tolist() == [can.DECODERS[0x0C](0x1A, 0xF8), can.DECODERS[0x0D](0x3C)]
+
+def test_parse_batch_frame():
+    assert can.parse_batch_frame(b"BATCH: 41 0C 1A F8 0D 3C") == [(0x0C, 0x1A, 0xF8), (0x0D, 0x3C, None)]
+    assert can.parse_batch_frame(b"BATCH: 41 05 7B") == [(0x05, 0x7B, None)]
+
+def test_parse_batch_frame_rejects_bad_answers():
+    for line in (b"BATCH: 42 0C 1A F8",   # not a mode 01 answer
+                 b"BATCH: 41 0C 1A",      # two byte PID cut short
+                 b"BATCH: 41 99 01",      # PID without a formula - can't tell its length
+                 b"BATCH: ",
+                 b"BATCH: 41 0Z"):
+        try:
+            can.parse_batch_frame(line)
+        except ValueError:
+            continue
+        raise AssertionError(f"{line!r} parsed")
+
+def test_request_command():
+    assert can.request_command([0x0C]) == "01 0C"
+    assert can.request_command([0x0C, 0x0D, 0x05]) == "01 0C 0D 05"
+
+def _poll(emulator_options, batch, seconds, on_sample=None):
+    """ Poll every PID against a fresh emulator for seconds - returns (emulator, scheduler, samples) """
+    emu = VirtualArduino(latency=0.002, **emulator_options)
+    emu.start()
+    samples = []
+
+    def received(sample):
+        samples.append(sample)
+        if on_sample is not None:
+            on_sample(sample)
+
+    mgr = can.SerialManager(emu.port, event_callback=received)
+    scheduler = PIDScheduler(list(can.DECODERS), intervals={pid: 0.0 for pid in can.DECODERS}, response_timeout=0.3)
+    stop = threading.Event()
+    try:
+        mgr.start()
+        assert mgr.handshake(timeout=2.0)
+        mgr.response_callback = scheduler.on_response
+        mgr.batch_callback = scheduler.on_batch
+        poller = threading.Thread(target=scheduler.run,
+                                  args=(lambda pids: mgr.send(can.request_command(pids)), stop, batch))
+        poller.start()
+        time.sleep(seconds)
+        stop.set()
+        poller.join(timeout=2.0)
+    finally:
+        mgr.stop()
+        emu.stop()
+    return emu, scheduler, samples
+
+def test_batch_answers_settle_the_whole_batch():
+    # a slow consumer used to let the next batch go out before the end of the last one failed it
+    emu, scheduler, samples = _poll({}, can.MAX_BATCH, 1.0, on_sample=lambda sample: time.sleep(0.002))
+    stats = scheduler.stats()
+    assert emu.requests > 20
+    assert emu.timeouts == 0
+    assert sum(s["timeouts"] for s in stats.values()) == 0
+    assert {sample.pid for sample in samples} == set(can.DECODERS)
+
+def test_batch_answers_leave_out_unsupported_pids():
+    emu, scheduler, samples = _poll({"unsupported": [0x32]}, can.MAX_BATCH, 1.0)
+    stats = scheduler.stats()
+    assert stats[0x32]["timeouts"] > 0 and stats[0x32]["responses"] == 0
+    assert all(s["timeouts"] == 0 for pid, s in stats.items() if pid != 0x32)
+    assert 0x32 not in {sample.pid for sample in samples}
+
+def test_falls_back_to_single_pids_without_batch_firmware():
+    emu, scheduler, samples = _poll({"max_batch": 1}, can.MAX_BATCH, 2.0)
+    assert scheduler.single_pid
+    assert {sample.pid for sample in samples} == set(can.DECODERS)
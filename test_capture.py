@@ -0,0 +1,74 @@
+import time
+import pytest
+import can_communication as can
+from capture import CaptureWriter, ReplaySerial, read_capture, replay_factory, profile_replay, summarize, RX, TX
+
+""" serial captures - writing them, reading them back and replaying them through a SerialManager """
+
+FRAMES = [b"PONG\n", b"PID: 1A F8 0C\n", b"PID: 3C 0D\n", b"PID: 7D 05\n"]
+
+def write_capture(path, chunks):
+    writer = CaptureWriter(str(path))
+    writer.write(b"01 0C\n", TX)
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.close()
+    return str(path)
+
+def test_records_read_back_in_order(tmp_path):
+    path = write_capture(tmp_path / "drive.cap", FRAMES)
+    records = list(read_capture(path))
+    assert [(direction, data) for _, direction, data in records] == [(TX, b"01 0C\n")] + [(RX, f) for f in FRAMES]
+    times = [ts for ts, _, _ in records]
+    assert times == sorted(times)
+    assert summarize(path)["rx_bytes"] == sum(map(len, FRAMES))
+
+def test_cut_off_capture(tmp_path):
+    path = write_capture(tmp_path / "drive.cap", FRAMES)
+    with open(path, "rb+") as f:
+        f.truncate(f.seek(0, 2) - 3)
+    assert [data for _, _, data in read_capture(path)][-1] == FRAMES[-2]
+
+    (tmp_path / "other.bin").write_bytes(b"not a capture")
+    with pytest.raises(ValueError):
+        list(read_capture(str(tmp_path / "other.bin")))
+
+def test_replay_hands_out_one_read_at_a_time(tmp_path):
+    path = write_capture(tmp_path / "drive.cap", [b"PID: 1A", b" F8 0C\nPO", b"NG\n"])
+    port = ReplaySerial(path, timeout=0.05, speed=0)
+    assert port.write(b"01 0C\n") == 6  # thrown away
+    assert port.read(100) == b"PID: 1A"
+    assert port.read(100) == b" F8 0C\nPO"
+    assert port.readline() == b"NG\n"
+    assert port.finished and port.read(10) == b""
+    port.close()
+    with pytest.raises(OSError):
+        port.read()
+
+def test_replay_keeps_the_timing(tmp_path):
+    path = str(tmp_path / "drive.cap")
+    writer = CaptureWriter(path)
+    writer.write(b"PONG\n")
+    time.sleep(0.2)
+    writer.write(b"PONG\n")
+    writer.close()
+    port = ReplaySerial(path, timeout=1.0, speed=2.0)
+    assert port.readline() == b"PONG\n"
+    began = time.monotonic()
+    assert port.readline() == b"PONG\n"
+    assert 0.07 < time.monotonic() - began < 0.3
+
+def test_serial_manager_over_a_capture(tmp_path):
+    path = write_capture(tmp_path / "drive.cap", FRAMES * 50)
+    samples = []
+    mgr = can.SerialManager(path, serial_factory=replay_factory(speed=0), event_callback=samples.append)
+    mgr.start()
+    deadline = time.monotonic() + 5.0
+    while not mgr._ser.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    mgr.stop()
+    assert [(s.pid, s.value) for s in samples[:3]] == [(0x0C, 1726.0), (0x0D, 60.0), (0x05, 85.0)]
+    assert len(samples) == 150
+
+    assert profile_replay(path)["samples"] == 150
@@ -0,0 +1,42 @@
+import can_communication as can
+from discovery import discover, serial_query, next_support_pid
+from emulator import VirtualArduino
+
+""" supported PID discovery over the SUPPORTED handshake with the emulated arduino """
+
+def test_next_support_pid():
+    assert next_support_pid(0x00, 0x1) == 0x20
+    assert next_support_pid(0x00, 0x2) is None
+    assert next_support_pid(0x40, 0x1) is None
+
+def test_discover_walks_the_masks():
+    masks = {0x00: 0x80000001, 0x20: 0x00000001, 0x40: 0x40000000}
+    asked = []
+
+    def query(pid):
+        asked.append(pid)
+        return masks[pid]
+    assert discover(query) == {0x01, 0x20, 0x40, 0x42}
+    assert asked == [0x00, 0x20, 0x40]
+
+def test_discover_without_pid_00():
+    assert discover(lambda pid: None) is None
+
+def test_support_frame():
+    assert can.parse_support_frame(b"SUPPORTED: 00 BE1FA813") == (0x00, 0xBE1FA813)
+
+def test_serial_discovery():
+    emu = VirtualArduino(latency=0.002, unsupported=[0x32, 0x5E])
+    emu.start()
+    mgr = can.SerialManager(emu.port)
+    try:
+        mgr.start()
+        assert mgr.handshake(timeout=2.0)
+        supported = discover(serial_query(mgr, timeout=1.0))
+    finally:
+        mgr.stop()
+        emu.stop()
+    assert set(can.DECODERS) - {0x32, 0x5E} <= supported
+    assert not supported & {0x32, 0x5E}
+    # the callbacks are the poller's again
+    assert mgr.support_callback is None and mgr.response_callback is None
@@ -0,0 +1,90 @@
+import can_communication as can
+import numpy as np
+from history import History, RingBuffer, LttbCache, minmax, lttb
+
+""" graph history buffers and downsampling """
+
+def test_buffers_are_made_on_the_first_sample():
+    history = History([0x0C, 0x05], seconds=1, rate=10)
+    assert history.buffers == {} and history.newest() is None
+    history.record(can.Sample(100, 0x0C, b"", 1.0))
+    history.record(can.Sample(200, 0x0D, b"", 2.0))  # not graphed
+    assert set(history.buffers) == {0x0C}
+    assert history.count(0x0C) == 1 and history.count(0x05) == 0
+    assert history.newest() == 100
+    ts, values = history.window(0x05, 0)
+    assert len(ts) == len(values) == 0
+
+def test_ring_wraps_oldest_first():
+    buf = RingBuffer(4)
+    for ts in range(1, 7):
+        buf.append(ts, ts * 10.0)
+    assert len(buf) == 4 and buf.newest == 6
+    ts, values = buf.since(0)
+    assert ts.tolist() == [3, 4, 5, 6]
+    assert values.tolist() == [30.0, 40.0, 50.0, 60.0]
+    assert buf.since(5)[0].tolist() == [5, 6]
+    for ts in range(7, 9):
+        buf.append(ts, 0.0)
+    assert buf.since(0)[0].tolist() == [5, 6, 7, 8]
+
+def test_minmax_keeps_spikes():
+    buf = RingBuffer(100)
+    for ts in range(100):
+        buf.append(ts, 100.0 if ts == 37 else 1.0)
+    ts, values = buf.since(0)
+    columns, lows, highs = minmax(ts, values, 0, 100, 10)
+    assert columns.tolist() == list(range(10))
+    assert highs[3] == 100.0 and lows[3] == 1.0
+    assert max(highs[:3].tolist() + highs[4:].tolist()) == 1.0
+
+def test_ts_only_go_forward():
+    history = History([0x0C], seconds=1, rate=10)
+    for ts in (100, 300, 200, 400):  # a second adapter a little behind
+        history.record(can.Sample(ts, 0x0C, b"", float(ts)))
+    ts, values = history.window(0x0C, 0)
+    assert ts.tolist() == [100, 300, 300, 400]
+    assert values.tolist() == [100.0, 300.0, 200.0, 400.0]
+    assert history.newest() == 400 and history.count(0x0C) == 4
+
+def walk(n, seed=0):
+    return np.arange(n, dtype=np.int64) * 1000, np.cumsum(np.random.default_rng(seed).normal(size=n))
+
+def test_lttb_one_point_per_column():
+    ts, values = walk(5000)
+    columns, lows, highs = lttb(ts, values, 0, 5_000_000, 100)
+    assert 100 <= len(columns) <= 101
+    assert np.all(np.diff(columns) >= 0) and columns[-1] == (4999 * 1000) * 100 / 5_000_000
+    assert lows is highs and set(lows.tolist()) <= set(values.tolist())
+    # few enough samples are drawn as they are
+    columns, lows, _ = lttb(ts[:50], values[:50], 0, 5_000_000, 100)
+    assert len(columns) == 50 and lows.tolist() == values[:50].tolist()
+
+def test_lttb_keeps_spikes():
+    ts = np.arange(10_000, dtype=np.int64)
+    values = np.zeros(10_000)
+    values[4321] = 50.0
+    assert 50.0 in lttb(ts, values, 0, 10_000, 100)[1].tolist()
+
+def test_lttb_cache_picks_the_same_points():
+    ts, values = walk(20_000)
+    cache = LttbCache()
+    for n in (3000, 3001, 3500, 9000, 20_000):
+        cached = lttb(ts[:n], values[:n], 0, 20_000_000, 200, cache)
+        fresh = lttb(ts[:n], values[:n], 0, 20_000_000, 200)
+        assert all(np.array_equal(a, b) for a, b in zip(cached, fresh))
+    assert cache.ts and cache.done is not None
+
+def test_lttb_cache_follows_the_window():
+    ts, values = walk(20_000)
+    cache = LttbCache()
+    for n in range(10_000, 20_000, 1000):
+        end = int(ts[n - 1]) + 1
+        columns, _, _ = lttb(ts[:n], values[:n], end - 5_000_000, end, 100, cache)
+        assert columns.min() >= 0 and columns.max() <= 100
+        assert 100 <= len(columns) <= 102
+    assert cache.ts[0] >= end - 5_000_000
+
+    # a replay starting over doesn't draw what came before
+    columns, lows, _ = lttb(ts[:5000], values[:5000], 0, 5_000_000, 100, cache)
+    assert cache.ts[-1] < 5_000_000 and set(lows.tolist()) <= set(values[:5000].tolist())
@@ -0,0 +1,65 @@
+import pytest
+import can_communication as can
+from latency import Histogram, LatencyTracer, StartupTimer
+
+""" latency histograms, per-PID stage tracing and startup milestones """
+
+MS = 1_000_000
+
+def test_histogram_percentiles_within_a_bucket():
+    hist = Histogram()
+    for ms in range(1, 101):
+        hist.add(ms * MS)
+    summary = hist.summary()
+    assert summary["count"] == 100 and summary["mean"] == pytest.approx(50.5) and summary["max"] == 100.0
+    # upper edge of the bucket - at most one bucket (~9%) over
+    for p in (50, 95, 99):
+        assert p <= summary[f"p{p}"] <= p * 2 ** (1 / Histogram.BUCKETS_PER_OCTAVE) + 1e-9
+    assert hist.percentile(100) == 100.0
+    assert Histogram().summary()["p99"] == 0.0
+
+def test_request_and_response():
+    tracer = LatencyTracer()
+    tracer.request(0x0C, now=1 * MS, source="COM3")
+    assert tracer.response(0x0C, 4 * MS, source="COM3") == 1 * MS
+    # nothing asked for it
+    assert tracer.response(0x0D, 5 * MS, source="COM3") is None
+    # another adapter has its own pending request
+    tracer.request(0x0C, now=6 * MS, source="COM3")
+    tracer.request(0x05, now=6 * MS, source="COM4")
+    assert tracer.response(None, 8 * MS, source="COM3") is None  # timeout line
+    # asked again before any answer
+    tracer.request(0x05, now=9 * MS, source="COM4")
+    tracer.response(0x05, 10 * MS, source="COM4")
+
+    pids = tracer.report()["pids"]
+    assert {k: pids["0C"][k] for k in ("requests", "responses", "timeouts", "unsolicited")} == \
+        {"requests": 2, "responses": 1, "timeouts": 1, "unsolicited": 0}
+    assert pids["0C"]["rtt"]["max"] == 3.0
+    assert pids["0D"]["unsolicited"] == 1
+    assert (pids["05"]["requests"], pids["05"]["responses"], pids["05"]["timeouts"]) == (2, 1, 1)
+    assert pids["05"]["rtt"]["max"] == 1.0
+
+def test_displayed_stages():
+    tracer = LatencyTracer()
+    traced = can.Sample(12 * MS, 0x0C, b"\x1a\xf8", 1726.0, trace=(1 * MS, 10 * MS))
+    unrequested = can.Sample(12 * MS, 0x0D, b"\x3c", 60.0, trace=(None, 11 * MS))
+    replayed = can.Sample(12 * MS, 0x05, b"\x7d", 85.0)
+    tracer.displayed([traced, unrequested, replayed], drained=15 * MS, flipped=20 * MS)
+    tracer.displayed([], drained=40 * MS, flipped=53 * MS)
+
+    report = tracer.report()
+    stages = report["pids"]["0C"]
+    assert [stages[s]["max"] for s in ("decode", "drain", "render", "total")] == [2.0, 3.0, 5.0, 19.0]
+    assert report["pids"]["0D"]["total"]["max"] == 9.0
+    assert "05" not in report["pids"]
+    assert report["frames"]["count"] == 1 and report["frames"]["max"] == 33.0
+
+def test_startup_milestones():
+    startup = StartupTimer(started=0)
+    startup.mark("window", 30 * MS)
+    startup.mark("imports", 10 * MS)
+    startup.mark("window", 50 * MS)  # only the first one counts
+    assert startup.reached("imports") and not startup.reached("first needle")
+    assert startup.report() == {"imports": 10.0, "window": 30.0}
+    assert startup.summary() == "imports 10ms, window 30ms"
@@ -0,0 +1,54 @@
+import pytest
+import can_communication as can
+from layout import compile_layout, load_layout, DisplaySample
+from metrics import MetricsEngine
+
+""" compiling the layout - PIDs, display units and the checks on what it says """
+
+def gauge(**overrides):
+    spec = {"pid": "0D", "label": "Speed", "pos": [0.5, 0.5], "radius": 100, "max": 160, "unit": "mph"}
+    spec.update(overrides)
+    return spec
+
+def test_converting_sink():
+    plan = compile_layout({"gauges": [gauge()], "box": [{"pid": "oil_temperature", "unit": "°F"}]})
+    assert plan.units == {0x0D: "mph", 0x5C: "°F"}
+    published = []
+    sink = plan.converting(published.append)
+    sink(can.Sample(1, 0x0D, b"\x64", 100.0, source="COM3"))
+    sink(can.Sample(2, 0x5C, b"\x8c", 100.0))
+    sink(can.Sample(3, 0x0C, b"\x1a\xf8", 1726.0))
+
+    speed, oil, rpm = published
+    assert isinstance(speed, DisplaySample)
+    assert speed.value == pytest.approx(62.1371)
+    assert (speed.ts, speed.raw, speed.source) == (1, b"\x64", "COM3")
+    assert speed.formatted() == "62.14mph"
+    assert oil.formatted(0) == "212°F"
+    # PIDs shown in their can.csv unit go through untouched
+    assert type(rpm) is can.Sample and rpm.formatted() == "1726.00rpm"
+
+def test_pid_names_and_codes():
+    plan = compile_layout({"gauges": [gauge(pid="speed", unit=None)], "graphs": [{"pid": 12, "max": 8000}]})
+    assert plan.gauges[0].pid == 0x0D and plan.gauges[0].unit == "kph"
+    assert plan.graphs[0].pid == 0x0C and plan.graphs[0].label == "rpm"
+    assert not plan.converters
+
+@pytest.mark.parametrize("layout, message", [
+    ({"gauges": [gauge(pid="warp")]}, "no PID named warp"),
+    ({"gauges": [gauge(pid="FF")]}, "not in can.csv"),
+    ({"gauges": [gauge(unit="furlongs")]}, "no conversion from kph to furlongs"),
+    ({"gauges": [gauge(min=200)]}, "max must be above min"),
+    ({"gauges": [gauge(resolution=0)]}, "resolution must be above 0"),
+    ({"gauges": [gauge(resolution=-1)]}, "resolution must be above 0"),
+    ({"gauges": [gauge()], "box": [{"pid": "0D", "unit": "kph"}]}, "already shown in mph"),
+    ({"graphs": [{"pid": "0C", "max": 8000, "downsample": "mean"}]}, "minmax or lttb"),
+])
+def test_rejected(layout, message):
+    with pytest.raises(ValueError, match=message):
+        compile_layout(layout)
+
+def test_shipped_layout():
+    MetricsEngine()  # registers the derived channels the layout shows
+    plan = load_layout()
+    assert plan.gauges and all(spec.resolution > 0 for spec in plan.gauges)
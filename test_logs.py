@@ -0,0 +1,36 @@
+import logging
+import logs
+
+""" rate limiting of repeated log messages """
+
+def record(category, msg, *args, created=0.0):
+    rec = logging.LogRecord(f"{logs.ROOT}.{category}", logging.INFO, __file__, 0, msg, args, None)
+    rec.created = created
+    return rec
+
+def test_template_shares_a_budget():
+    limit = logs.RateLimitFilter(burst=2, interval=10.0)
+    passed = [limit.filter(record("poll", "polled %d", n)) for n in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert limit.suppressed == 3
+
+    # the next window says what was held back
+    rec = record("poll", "polled %d", 5, created=10.0)
+    assert limit.filter(rec)
+    assert rec.suppressed == 3
+
+def test_arduino_lines_keyed_by_message():
+    limit = logs.RateLimitFilter(burst=2, interval=10.0)
+    for _ in range(5):
+        limit.filter(record("lines", "%s: %s", "COM3", "TIMEOUT 0C"))
+    assert limit.filter(record("lines", "%s: %s", "COM3", "PONG"))
+    assert limit.filter(record("lines", "%s: %s", "COM4", "TIMEOUT 0C"))
+    assert limit.suppressed == 3
+
+def test_expired_windows_pruned():
+    limit = logs.RateLimitFilter(burst=1, interval=1.0)
+    limit.MAX_WINDOWS = 4
+    for n in range(4):
+        limit.filter(record("lines", "%s: %s", "COM3", f"ECHO {n}"))
+    limit.filter(record("lines", "%s: %s", "COM3", "PONG", created=2.0))
+    assert len(limit._windows) == 1
@@ -0,0 +1,73 @@
+import pytest
+import can_communication as can
+import metrics
+from metrics import MetricsEngine, RollingWindow, RollingStats, TripComputer
+
+""" derived channels - rolling windows over sample time and the trip computer """
+
+S = 1_000_000_000  # ns per second
+
+def sample(t, pid, value):
+    return can.Sample(int(t * S), pid, b"", float(value))
+
+def test_rolling_window_is_time_based():
+    window = RollingWindow(2.0)
+    for t, value in ((0.0, 5), (0.5, 1), (1.0, 9), (1.5, 3)):
+        window.add(int(t * S), value)
+    assert (len(window), window.mean, window.min, window.max) == (4, 4.5, 1, 9)
+
+    # 0.0 and 0.5 fall out - the 9 stays the max until it is too old too
+    window.add(int(2.5 * S), 4)
+    assert (len(window), window.min, window.max) == (3, 3, 9)
+    assert window.mean == pytest.approx(16 / 3)
+    window.add(int(3.1 * S), 2)
+    assert (len(window), window.min, window.max) == (3, 2, 4)
+
+    # a slow poll rate doesn't stretch the window
+    window.add(int(10 * S), 7)
+    assert (len(window), window.mean, window.min, window.max) == (1, 7, 7, 7)
+
+def test_trip_computer():
+    trip = TripComputer()
+    trip.update(sample(0, metrics.FUEL_RATE, 6.0))
+    out = dict(trip.update(sample(0, metrics.SPEED, 60.0)))
+    assert out[metrics.FUEL_ECONOMY] == pytest.approx(10.0)
+
+    # an hour at 60 kph burning 6 L/h - in 1 s steps so no gap is skipped
+    for t in range(1, 3601):
+        trip.update(sample(t, metrics.FUEL_RATE, 6.0))
+        out = dict(trip.update(sample(t, metrics.SPEED, 60.0)))
+    assert out[metrics.TRIP_DISTANCE] == pytest.approx(60.0)
+    assert trip.fuel.total == pytest.approx(6.0)
+    assert out[metrics.TRIP_FUEL_ECONOMY] == pytest.approx(10.0)
+
+def test_instant_economy_cleared_when_stopped():
+    trip = TripComputer()
+    trip.update(sample(0, metrics.FUEL_RATE, 6.0))
+    assert dict(trip.update(sample(0, metrics.SPEED, 60.0)))[metrics.FUEL_ECONOMY] == pytest.approx(10.0)
+    assert dict(trip.update(sample(1, metrics.SPEED, 0.0)))[metrics.FUEL_ECONOMY] == 0.0
+    assert dict(trip.update(sample(2, metrics.FUEL_RATE, 0.8)))[metrics.FUEL_ECONOMY] == 0.0
+
+def test_integrator_skips_gaps():
+    trip = TripComputer(max_gap=5.0)
+    trip.update(sample(0, metrics.SPEED, 36.0))
+    trip.update(sample(10, metrics.SPEED, 36.0))  # adapter dropped out
+    trip.update(sample(11, metrics.SPEED, 36.0))
+    assert trip.distance.total == pytest.approx(0.01)
+
+def test_engine_registers_and_publishes(monkeypatch):
+    # a table without the derived channels some other test's engine registered
+    monkeypatch.setattr(can, "PID_TABLE", {pid: rec for pid, rec in can.PID_TABLE.items() if pid < 0x100})
+    assert metrics.RPM_MEAN not in can.PID_TABLE
+    published = []
+    engine = MetricsEngine(published.append, [RollingStats(metrics.RPM, 5.0, metrics.RPM_MEAN, metrics.RPM_MIN,
+                                                           metrics.RPM_MAX)])
+    assert can.PID_TABLE[metrics.RPM_MEAN].name == "rpm_mean"
+    assert can.PID_TABLE[metrics.RPM_MAX].unit == "rpm"
+
+    engine.consume(sample(0, metrics.RPM, 1000))
+    engine.consume(sample(1, metrics.RPM, 3000))
+    engine.consume(sample(1, metrics.SPEED, 50))  # nothing uses it
+    assert [(s.pid, s.value) for s in published[-3:]] == [(metrics.RPM_MEAN, 2000.0), (metrics.RPM_MIN, 1000.0),
+                                                          (metrics.RPM_MAX, 3000.0)]
+    assert len(published) == 6 and engine.derived == 6
@@ -0,0 +1,81 @@
+import threading
+import numpy as np
+import pytest
+import can_communication as can
+import recorder
+from recorder import Recorder, Recording, check_new
+
+""" recording samples to column files and reading them back """
+
+def samples(n):
+    pids = (0x0C, 0x0D, 0x05, 0x100)
+    for i in range(n):
+        pid = pids[i % len(pids)]
+        raw = bytes((i & 0xFF, (i >> 8) & 0xFF)) if pid == 0x0C else b"" if pid >= 0x100 else bytes((i & 0xFF,))
+        yield can.Sample(1_000_000_000 + i * 10_000_000, pid, raw, i * 0.5)
+
+def record(path, n):
+    rec = Recorder(str(path), flush_interval=0.01)
+    rec.start()
+    written = list(samples(n))
+    for sample in written:
+        rec.record(sample)
+    rec.stop()
+    assert rec.recorded == n and rec.dropped == 0
+    return written
+
+def test_round_trip(tmp_path):
+    n = recorder.INDEX_EVERY * 2 + 100
+    written = record(tmp_path, n)
+    recording = Recording(str(tmp_path))
+    assert len(recording) == n
+    assert recording.duration == (n - 1) * 0.01
+    for row in (0, 1, 2, 3, recorder.INDEX_EVERY + 5, n - 1):
+        sample, expected = recording.sample(row), written[row]
+        assert (sample.ts, sample.pid, sample.raw, sample.value) == (expected.ts, expected.pid, expected.raw,
+                                                                      expected.value)
+
+    # one index entry per block, the last one partly filled
+    assert recording.index["row"].tolist() == [0, recorder.INDEX_EVERY, 2 * recorder.INDEX_EVERY]
+    assert recording.index["ts"].tolist() == [written[row].ts for row in recording.index["row"].tolist()]
+    assert recording.seek(0) == 0
+    assert recording.seek(50.0) == 5000
+    assert recording.seek(1e6) == n
+    assert list(recording.blocks_with(0x0C))[-1] == (2 * recorder.INDEX_EVERY, n)
+    assert list(recording.blocks_with(0x42)) == []
+
+def test_replay(tmp_path):
+    written = record(tmp_path, 500)
+    got = []
+    Recording(str(tmp_path)).replay(got.append, threading.Event(), speed=0, start=1.0, pids={0x0D})
+    expected = [s for s in written[100:] if s.pid == 0x0D]
+    assert [(s.ts, s.value, s.raw) for s in got] == [(s.ts, s.value, s.raw) for s in expected]
+
+def test_refuses_an_existing_recording(tmp_path):
+    record(tmp_path, 10)
+    with pytest.raises(FileExistsError):
+        check_new(str(tmp_path))
+
+def test_stuck_writer_keeps_its_files(tmp_path, monkeypatch):
+    rec = Recorder(str(tmp_path), flush_interval=0.01)
+    release = threading.Event()
+    write = rec._write_pending
+
+    def slow_write():
+        release.wait(5.0)
+        write()
+    monkeypatch.setattr(rec, "_write_pending", slow_write)
+    rec.start()
+    for sample in samples(10):
+        rec.record(sample)
+    rec.stop(timeout=0.05)
+    assert rec._files and not any(f.closed for f in rec._files.values())
+
+    # the writer finishes on its own - the recording reads like one still being written
+    release.set()
+    rec._thread.join(5.0)
+    assert rec.recorded == 10
+    recording = Recording(str(tmp_path))
+    assert len(recording) == 10 and np.all(recording.index["mask"] == 0xFFFFFFFFFFFFFFFF)
+    rec.stop()
+    assert not rec._files
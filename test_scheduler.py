@@ -0,0 +1,85 @@
+import time
+from scheduler import PIDScheduler, BATCH_FALLBACK
+
+""" response-driven scheduling, backoff and batch completion - driven by hand instead of a serial port """
+
+PIDS = [0x0C, 0x0D, 0x05]
+
+def scheduler(**options):
+    return PIDScheduler(PIDS, intervals={pid: 0.1 for pid in PIDS}, **options)
+
+def test_batch_completes_on_one_answer():
+    s = scheduler()
+    s.mark_sent(PIDS, time.monotonic())
+    s.on_batch([0x0C, 0x0D])
+    assert s.wait_for_response(timeout=0)
+    stats = s.stats()
+    assert stats[0x0C]["responses"] == 1 and stats[0x0C]["timeouts"] == 0
+    assert stats[0x05]["timeouts"] == 1
+
+def test_partial_answers_hold_the_batch():
+    s = scheduler()
+    s.mark_sent(PIDS, time.monotonic())
+    s.on_response(0x0C)
+    assert not s._answered.is_set()
+    s.on_response(0x0D)
+    s.on_response(0x05)
+    assert s._answered.is_set()
+
+def test_late_batch_answer_does_not_fail_the_next_request():
+    s = scheduler()
+    s.mark_sent([0x0C, 0x0D], time.monotonic())
+    s.on_batch([0x0C, 0x0D])
+    s.mark_sent([0x05], time.monotonic())
+    # an answer to the first batch turning up again only counts its PIDs
+    s.on_batch([0x0C])
+    assert s.stats()[0x05]["timeouts"] == 0
+
+def test_backoff_doubles_and_resets():
+    s = scheduler(min_backoff=1.0, max_backoff=8.0)
+    for _ in range(5):
+        s.mark_sent([0x05], time.monotonic())
+        s.on_response(None)
+    assert s.stats()[0x05]["interval"] == 8.0
+    assert s.stats()[0x0C]["interval"] == 0.1
+    s.mark_sent([0x05], time.monotonic())
+    s.on_response(0x05)
+    assert s.stats()[0x05]["interval"] == 0.1
+
+def test_backed_off_pid_waits():
+    s = scheduler()
+    s.mark_sent([0x05], 0.0)
+    s.on_response(None)
+    pids, wait = s.next_batch(time.monotonic(), 3)
+    assert 0x05 not in pids
+
+def test_no_answer_counts_as_timeout():
+    s = scheduler()
+    s.mark_sent([0x0C], time.monotonic())
+    assert not s.wait_for_response(timeout=0)
+    assert s.stats()[0x0C]["timeouts"] == 1
+
+def test_silent_batches_fall_back_to_single_pids():
+    s = scheduler()
+    for _ in range(BATCH_FALLBACK):
+        assert not s.single_pid
+        s.mark_sent(PIDS, time.monotonic())
+        s.wait_for_response(timeout=0)
+    assert s.single_pid
+    pids, wait = s.next_batch(time.monotonic(), 3)
+    assert len(pids) == 1
+    assert all(stats["interval"] == 0.1 for stats in s.stats().values())
+
+def test_answered_batches_never_fall_back():
+    s = scheduler()
+    s.mark_sent(PIDS, time.monotonic())
+    s.on_batch(PIDS)
+    for _ in range(BATCH_FALLBACK):
+        s.mark_sent(PIDS, time.monotonic())
+        s.wait_for_response(timeout=0)
+    assert not s.single_pid
+
+def test_restrict():
+    s = scheduler()
+    assert s.restrict({0x0C, 0x0D}) == [0x05]
+    assert set(s.stats()) == {0x0C, 0x0D}
@@ -0,0 +1,167 @@
+import os
+import sys
+import threading
+import subprocess
+import can_communication as can
+from telemetry import TelemetryStore, SharedTelemetryStore
+
+""" the latest-value store and the shared memory table's seqlock """
+
+def sample(pid, n, source="ttyTEST"):
+    # every field follows from n so a torn read shows up as a mismatch
+    return can.Sample(n, pid, bytes((n & 0xFF, (n >> 8) & 0xFF)), float(n), (n - 5, n), source)
+
+def consistent(s):
+    n = s.ts
+    return s.value == float(n) and s.raw == bytes((n & 0xFF, (n >> 8) & 0xFF)) and s.trace == (n - 5, n)
+
+def test_latest_value_store():
+    store = TelemetryStore(history=3)
+    for n in range(1, 6):
+        store.publish(sample(0x0C, n * 1_000_000_000))
+    store.publish(sample(0x0D, 7, source=None))
+    latest, seqs = store.snapshot()
+    assert latest[0x0C].ts == 5_000_000_000 and latest[0x0D].ts == 7
+    assert seqs == {0x0C: 5, 0x0D: 1}
+    assert [s.ts for s in store.recent(0x0C)] == [3_000_000_000, 4_000_000_000, 5_000_000_000]
+    assert store.recent(0x05) == [] and store.latest(0x05, "none") == "none"
+    # four of the rpm samples were replaced before a snapshot saw them
+    assert store.stats() == {"published": 6, "coalesced": 4, "dropped": 0, "pids": 2, "sources": 1}
+    assert store.source_stats() == {"ttyTEST": {"samples": 5, "per_second": 1.0}}
+
+    # read since the last snapshot - the next one isn't coalesced
+    store.publish(sample(0x0C, 6_000_000_000))
+    store.publish(object())
+    assert store.stats()["coalesced"] == 4 and store.stats()["dropped"] == 1
+
+def test_latest_value_store_from_threads():
+    store = TelemetryStore()
+
+    def writer(pid):
+        for n in range(1, 5001):
+            store.publish(sample(pid, n))
+    threads = [threading.Thread(target=writer, args=(pid,)) for pid in (0x0C, 0x0D, 0x05)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latest, seqs = store.snapshot()
+    assert seqs == {0x0C: 5000, 0x0D: 5000, 0x05: 5000}
+    assert all(s.ts == 5000 and consistent(s) for s in latest.values())
+    assert store.stats()["published"] == 15000
+
+def test_publish_and_read_back():
+    store = SharedTelemetryStore.create()
+    try:
+        store.publish(sample(0x0C, 1000))
+        latest, seqs = store.snapshot()
+        assert consistent(latest[0x0C])
+        assert latest[0x0C].source == "ttyTEST"
+        assert seqs == {0x0C: 1}
+        assert store.latest(0x0D) is None
+    finally:
+        store.close()
+
+def test_coalesced_updates():
+    store = SharedTelemetryStore.create()
+    try:
+        for n in range(1, 11):
+            store.publish(sample(0x0C, n))
+        latest, seqs = store.snapshot()
+        assert latest[0x0C].ts == 10 and seqs[0x0C] == 10
+        assert store.coalesced == 9
+    finally:
+        store.close()
+
+def test_half_written_records_are_read_again():
+    store = SharedTelemetryStore.create()
+    try:
+        store.publish(sample(0x0C, 1))
+        store.snapshot()
+        good = bytes(store._records[0x0C * 64:0x0D * 64])
+        store.publish(sample(0x0C, 2))
+        # the new sequence numbers made it but the value is still the old one - the crc doesn't match
+        store._records[0x0C * 64 + 16:0x0C * 64 + 24] = good[16:24]
+        latest, seqs = store.snapshot()
+        assert latest[0x0C].ts == 1
+        assert store.torn == 1
+        # only one end of a write made it
+        store.publish(sample(0x0C, 3))
+        store._records[0x0C * 64 + 56:0x0D * 64] = good[56:64]
+        latest, seqs = store.snapshot()
+        assert latest[0x0C].ts == 1 and store.torn == 2
+        store.publish(sample(0x0C, 4))
+        latest, seqs = store.snapshot()
+        assert latest[0x0C].ts == 4 and seqs[0x0C] == 4
+    finally:
+        store.close()
+
+def test_reads_are_never_torn():
+    store = SharedTelemetryStore.create()
+    stop = threading.Event()
+
+    def write():
+        n = 1
+        while not stop.is_set():
+            for pid in (0x0C, 0x0D, 0x05):
+                store.publish(sample(pid, n))
+            n += 1
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        reads = 0
+        while reads < 2000:
+            latest, seqs = store.snapshot()
+            for s in latest.values():
+                assert consistent(s)
+            reads += 1
+    finally:
+        stop.set()
+        writer.join()
+        store.close()
+
+def test_bad_samples_are_dropped():
+    store = SharedTelemetryStore.create()
+    try:
+        store.publish(sample(SharedTelemetryStore.SLOTS, 1))
+        assert store.stats()["dropped"] == 1
+        assert store.snapshot() == ({}, {})
+    finally:
+        store.close()
+
+WRITER = """
+import sys, time
+import can_communication as can
+from telemetry import SharedTelemetryStore
+store = SharedTelemetryStore.attach(sys.argv[1])
+deadline = time.monotonic() + float(sys.argv[2])
+n = 1
+while time.monotonic() < deadline:
+    for pid in (0x0C, 0x0D, 0x05, 0x42):
+        store.publish(can.Sample(n, pid, bytes((n & 0xFF, (n >> 8) & 0xFF)), float(n), (n - 5, n), "ttyTEST"))
+    n += 1
+store.state = 1
+store.close()
+"""
+
+def test_reads_from_another_process_are_never_torn():
+    store = SharedTelemetryStore.create()
+    here = os.path.dirname(os.path.abspath(__file__))
+    writer = subprocess.Popen([sys.executable, "-c", WRITER, store.name, "1.5"], cwd=here)
+    try:
+        reads = seen = 0
+        while store.state != 1 and writer.poll() is None:
+            latest, seqs = store.snapshot()
+            for s in latest.values():
+                assert consistent(s)
+                seen += 1
+            reads += 1
+        assert writer.wait(5.0) == 0
+        latest, seqs = store.snapshot()
+        assert set(latest) == {0x0C, 0x0D, 0x05, 0x42}
+        assert all(consistent(s) for s in latest.values())
+        assert seen > 0
+    finally:
+        if writer.poll() is None:
+            writer.kill()
+        store.close()